@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# address.py - Compact network address type.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compact network address type shared by crawl.py, ping.py and export.py.
+"""
+
+import binascii
+import socket
+from base64 import b32decode
+from base64 import b32encode
+from ipaddress import ip_network
+
+from networks import NetworkIndex
+
+IPV4 = 4
+IPV6 = 6
+ONION = 0
+
+BITS = {
+    IPV4: 32,
+    IPV6: 128,
+}
+
+AF = {
+    IPV4: socket.AF_INET,
+    IPV6: socket.AF_INET6,
+}
+
+# Network prefix masks by family and prefix length.
+MASKS = {
+    family: [((1 << bits) - 1) ^ ((1 << (bits - prefix)) - 1)
+             for prefix in range(bits + 1)]
+    for (family, bits) in BITS.items()
+}
+
+# Same ranges as ipaddress.IPv4Address.is_private and
+# ipaddress.IPv6Address.is_private.
+PRIVATE_NETWORKS = {
+    IPV4: [
+        '0.0.0.0/8',
+        '10.0.0.0/8',
+        '127.0.0.0/8',
+        '169.254.0.0/16',
+        '172.16.0.0/12',
+        '192.0.0.0/29',
+        '192.0.0.170/31',
+        '192.0.2.0/24',
+        '192.168.0.0/16',
+        '198.18.0.0/15',
+        '198.51.100.0/24',
+        '203.0.113.0/24',
+        '240.0.0.0/4',
+        '255.255.255.255/32',
+    ],
+    IPV6: [
+        '::1/128',
+        '::/128',
+        '::ffff:0:0/96',
+        '100::/64',
+        '2001::/23',
+        '2001:2::/48',
+        '2001:db8::/32',
+        '2001:10::/28',
+        'fc00::/7',
+        'fe80::/10',
+    ],
+}
+
+PRIVATE = {
+    family: NetworkIndex(
+        [(int(n.network_address), int(n.netmask))
+         for n in map(ip_network, networks)],
+        bits=BITS[family])
+    for (family, networks) in PRIVATE_NETWORKS.items()
+}
+
+
+class Address(object):
+    """
+    IPv4, IPv6 or .onion address held as its family and packed bytes, i.e.
+    4 bytes for IPv4, 16 bytes for IPv6 and the base32-decoded 10 (v2) or
+    35 (v3) bytes for .onion. The text form is kept to avoid converting it
+    back when building Redis keys.
+    """
+    __slots__ = ('family', 'packed', 'text')
+
+    def __init__(self, family, packed, text):
+        self.family = family
+        self.packed = packed
+        self.text = text
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Returns Address for the specified text or raises ValueError.
+        """
+        if text.endswith('.onion'):
+            try:
+                packed = b32decode(text[:-6].upper())
+            except (binascii.Error, ValueError):
+                raise ValueError(f'invalid onion address: {text}')
+            return cls(ONION, packed, text)
+        family = IPV6 if ':' in text else IPV4
+        try:
+            packed = socket.inet_pton(AF[family], text)
+        except (socket.error, UnicodeEncodeError):
+            raise ValueError(f'invalid IP address: {text}')
+        return cls(family, packed, text)
+
+    @classmethod
+    def from_packed(cls, packed):
+        """
+        Returns Address for the specified packed bytes.
+        """
+        if len(packed) == 4:
+            return cls(IPV4, packed, socket.inet_ntop(socket.AF_INET, packed))
+        if len(packed) == 16:
+            return cls(
+                IPV6, packed, socket.inet_ntop(socket.AF_INET6, packed))
+        if len(packed) in (10, 35):
+            return cls(
+                ONION, packed, b32encode(packed).decode().lower() + '.onion')
+        raise ValueError(f'invalid packed address length: {len(packed)}')
+
+    @property
+    def is_ipv4(self):
+        return self.family == IPV4
+
+    @property
+    def is_ipv6(self):
+        return self.family == IPV6
+
+    @property
+    def is_onion(self):
+        return self.family == ONION
+
+    @property
+    def value(self):
+        """
+        Returns the address as an integer.
+        """
+        return int.from_bytes(self.packed, 'big')
+
+    @property
+    def is_private(self):
+        if self.family == ONION:
+            return False
+        return self.value in PRIVATE[self.family]
+
+    def network(self, prefix):
+        """
+        Returns the integer network address for the specified prefix length.
+        """
+        return self.value & MASKS[self.family][prefix]
+
+    def cidr(self, prefix):
+        """
+        Returns CIDR notation to represent the address and its prefix.
+        """
+        packed = self.network(prefix).to_bytes(len(self.packed), 'big')
+        return f'{socket.inet_ntop(AF[self.family], packed)}/{prefix}'
+
+    def key(self, *fields):
+        """
+        Returns the address followed by the specified fields, e.g. port and
+        services, as used in Redis keys such as node:ADDRESS-PORT.
+        """
+        return '-'.join([self.text] + [str(field) for field in fields])
+
+    def __eq__(self, other):
+        return (isinstance(other, Address) and
+                self.family == other.family and
+                self.packed == other.packed)
+
+    def __hash__(self):
+        return hash(self.packed)
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f'Address({self.text!r})'
@@ -100,12 +100,11 @@ class CacheInv(Cache):
                         logging.debug(f'Skip: {key} ({timestamp})')
                         continue
                 invs += 1
-                # ZADD <key> LT <score> <member>
                 # LT: Only update existing elements if the new score is less
                 # than the current score. This flag doesn't prevent adding new
                 # elements.
-                self.redis_pipe.execute_command(
-                    'ZADD', key, 'LT', timestamp, self.node_hash(node))
+                self.redis_pipe.zadd(
+                    key, {self.node_hash(node): timestamp}, lt=True)
                 self.redis_pipe.expire(key, CONF['ttl'])
             self.count += invs
         elif msg['command'] == b'pong':
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# columns.py - Columnar NumPy sidecar for JSON snapshots.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Columnar NumPy sidecar for JSON snapshots.
+
+A sidecar is a directory next to the snapshot, e.g. 1663113591.columns for
+1663113591.json, with one .npy array per field so readers can memory-map
+only the columns they need. String fields are dictionary-encoded: the
+{field}.npy array holds int32 codes (-1 for None) into a string table stored
+as a UTF-8 blob ({field}.strings.npy) and its offsets ({field}.offsets.npy).
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+INT = 'int'
+FLOAT = 'float'
+STR = 'str'
+
+META_FILE = 'fields.json'
+
+# Temporary directories from mkdtemp() are only accessible by owner.
+DIR_MODE = 0o755
+
+
+def columns_path(path):
+    """
+    Returns path to the sidecar for the specified JSON snapshot.
+    """
+    if path.endswith('.json'):
+        path = path[:-5]
+    return f'{path}.columns'
+
+
+class ColumnWriter(object):
+    """
+    Accumulates rows as per-field values and saves them as a sidecar.
+    Fields are (name, kind) tuples in row order with kind being one of INT,
+    FLOAT or STR.
+    """
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        self.values = [[] for _ in self.fields]
+        self.tables = [{} if kind == STR else None
+                       for (_, kind) in self.fields]
+        self.rows = 0
+
+    def append(self, row):
+        """
+        Appends values from a row. Raises ValueError if the row does not
+        match the fields.
+        """
+        if len(row) != len(self.fields):
+            raise ValueError(f'expected {len(self.fields)} fields, '
+                             f'got {len(row)}')
+        for (values, table, (_, kind), value) in zip(
+                self.values, self.tables, self.fields, row):
+            if kind == STR:
+                if value is None:
+                    values.append(-1)
+                else:
+                    values.append(table.setdefault(value, len(table)))
+            elif kind == FLOAT:
+                values.append(np.nan if value is None else value)
+            else:
+                values.append(value or 0)
+        self.rows += 1
+
+    def save(self, path):
+        """
+        Saves the sidecar into the specified directory via a temporary
+        directory that is renamed into place once all arrays are written.
+        """
+        parent = os.path.dirname(path) or '.'
+        tmp_path = tempfile.mkdtemp(
+            dir=parent, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+        try:
+            os.chmod(tmp_path, DIR_MODE)
+            for (values, table, (name, kind)) in zip(
+                    self.values, self.tables, self.fields):
+                if kind == STR:
+                    save_array(tmp_path, name, np.array(values, np.int32))
+                    (offsets, strings) = encode_strings(table)
+                    save_array(tmp_path, f'{name}.offsets', offsets)
+                    save_array(tmp_path, f'{name}.strings', strings)
+                elif kind == FLOAT:
+                    save_array(tmp_path, name, np.array(values, np.float64))
+                else:
+                    save_array(tmp_path, name, np.array(values, np.int64))
+
+            meta = {
+                'rows': self.rows,
+                'fields': [list(field) for field in self.fields],
+            }
+            with open(os.path.join(tmp_path, META_FILE), 'w') as f:
+                f.write(json.dumps(meta))
+                f.flush()
+                os.fsync(f.fileno())
+
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+
+def encode_strings(strings):
+    """
+    Returns (offsets, blob) arrays for the specified strings, i.e. string i
+    is the UTF-8 bytes blob[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [text.encode() for text in strings]
+    offsets = np.zeros(len(encoded) + 1, np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return (offsets, np.frombuffer(b''.join(encoded), np.uint8))
+
+
+def save_array(directory, name, array):
+    """
+    Saves array into {name}.npy in the specified directory.
+    """
+    with open(os.path.join(directory, f'{name}.npy'), 'wb') as f:
+        np.save(f, array)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class StringColumn(object):
+    """
+    Dictionary-encoded string column. Strings are only decoded from the
+    table when accessed.
+    """
+
+    def __init__(self, codes, offsets, strings):
+        self.codes = codes
+        self.offsets = offsets
+        self.strings = strings
+
+    def lookup(self, code):
+        """
+        Returns string for the specified code from the string table.
+        """
+        if code < 0:
+            return None
+        start = self.offsets[code]
+        end = self.offsets[code + 1]
+        return self.strings[start:end].tobytes().decode()
+
+    @property
+    def table(self):
+        """
+        Returns all distinct strings in the column.
+        """
+        return [self.lookup(code) for code in range(len(self.offsets) - 1)]
+
+    def tolist(self):
+        table = self.table
+        return [None if code < 0 else table[code]
+                for code in self.codes.tolist()]
+
+    def __getitem__(self, index):
+        return self.lookup(int(self.codes[index]))
+
+    def __len__(self):
+        return len(self.codes)
+
+
+def load_columns(path, names=None, mmap_mode='r'):
+    """
+    Returns {name: column} for the specified field names, or all fields if
+    names is None, from the sidecar at the specified path. Numeric columns
+    are NumPy arrays and string columns are StringColumn objects, memory-
+    mapped by default.
+    """
+    meta = json.loads(open(os.path.join(path, META_FILE), 'r').read())
+    kinds = dict(meta['fields'])
+    if names is None:
+        names = [name for (name, _) in meta['fields']]
+
+    columns = {}
+    for name in names:
+        if name not in kinds:
+            raise KeyError(f'{path}: no field {name}')
+        array = load_array(path, name, mmap_mode)
+        if kinds[name] == STR:
+            array = StringColumn(
+                array,
+                load_array(path, f'{name}.offsets', mmap_mode),
+                load_array(path, f'{name}.strings', mmap_mode))
+        columns[name] = array
+    return columns
+
+
+def load_array(directory, name, mmap_mode='r'):
+    """
+    Returns array from {name}.npy in the specified directory.
+    """
+    return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
@@ -31,34 +31,60 @@ Greenlets-based Bitcoin network crawler.
 from gevent import monkey
 monkey.patch_all()
 
+import ast
 import geoip2.database
 import gevent
+import gevent.pool
+import gevent.queue
 import json
 import logging
+import math
 import os
 import random
 import redis
+import resource
 import redis.connection
 import socket
+import subprocess
 import sys
 import time
-from binascii import hexlify
 from binascii import unhexlify
 from collections import Counter
 from configparser import ConfigParser
 from geoip2.errors import AddressNotFoundError
-from ipaddress import ip_address
 from ipaddress import ip_network
-
+from maxminddb.errors import InvalidDatabaseError
+
+from address import Address
+from columns import INT
+from columns import STR
+from graph import PeerGraph
+from graph import graph_path
+from metrics import Registry
+from networks import NetworkIndex
+from peercache import pack_peers
+from peercache import unpack_peers
 from protocol import Connection
 from protocol import ConnectionError
 from protocol import ProtocolError
 from protocol import TO_SERVICES
+from protocol import create_connection
+from ratelimit import RateLimiter
+from rules import is_asn
+from rules import pack_asns
+from rules import pack_networks
+from rules import unpack_asns
+from rules import unpack_networks
+from snapshot import SnapshotWriter
+from snapshot import latest_snapshot
+from snapshot import load_snapshot
+from snapshot import write_atomic
+from storage import MemoryStorage
 from utils import configure_logger
 from utils import conf_list
 from utils import get_keys
 from utils import http_get_txt
-from utils import ip_to_network
+from utils import LruCache
 from utils import new_redis_conn
 
 redis.connection.socket = gevent.socket
@@ -66,7 +92,122 @@ redis.connection.socket = gevent.socket
 CONF = {}
 
 # MaxMind databases
-ASN = geoip2.database.Reader('geoip/GeoLite2-ASN.mmdb')
+ASN_DATABASE = 'geoip/GeoLite2-ASN.mmdb'
+ASN = geoip2.database.Reader(ASN_DATABASE)
+
+# Memoized (excluded, ASN) decisions keyed by packed address.
+EXCLUDED = LruCache()
+
+# Crawl priority for nodes in the pending sorted set (highest popped first).
+# Gossiped nodes accumulate priority with each report, see get_priority().
+REACHABLE_PRIORITY = 1000  # Reachable in the previous crawl.
+SEED_PRIORITY = 2  # From DNS seeders or configured .onion nodes.
+
+# Nodes over their connection rate limits are put back with their priority
+# lowered by DEFERRED_OFFSET, i.e. below all other nodes, so that they do not
+# hold up nodes of other ASNs and prefixes, see defer_pending().
+DEFERRED_OFFSET = 2 ** 32
+
+# ADDRESS-PORT of the nodes reachable in the previous crawl, exempt from the
+# deadline cutoff whatever their priority, see past_cutoff().
+REACHABLE = 'crawl:reachable'
+
+# Connection rate limits, see init_conf().
+LIMITER = RateLimiter()
+
+# With target_crawl_seconds, socket timeouts are shortened to fit the pending
+# nodes into the remaining time, but not below MIN_SOCKET_TIMEOUT, and nodes
+# that were not reachable in the previous crawl are skipped once less than
+# DEADLINE_CUTOFF of the target is left.
+MIN_SOCKET_TIMEOUT = 1.0
+DEADLINE_CUTOFF = 0.1
+
+# Established sockets handed from task workers to handshake workers in a
+# two-stage crawl, see handshake_task().
+HANDSHAKES = gevent.queue.Queue()
+
+# Keys fetched per round trip when dumping reachable nodes.
+DUMP_CHUNK_SIZE = 1000
+
+# Cumulative connect outcomes and Redis round trip times for this process,
+# see controller() and report_throughput().
+STATS = Counter()
+
+# Slave processes spawned by the master with --processes, see supervise().
+SLAVES = []
+
+# Metrics of this process served at metrics_port, see metrics.py.
+METRICS = Registry('hnsnodes_crawl')
+CONNECTS = METRICS.counter(
+    'connects_total', 'Connection attempts by result (reachable or failure '
+    'type)', ['result'])
+DEFERRED = METRICS.counter(
+    'deferred_total', 'Connections deferred by rate limit level', ['level'])
+EXCLUSIONS = METRICS.counter(
+    'exclusions_total', 'Addresses excluded by rule', ['rule'])
+HANDSHAKE_SECONDS = METRICS.histogram(
+    'handshake_seconds', 'Time taken by successful version handshakes')
+GETADDR_SECONDS = METRICS.histogram(
+    'getaddr_seconds', 'Time taken waiting for addr responses')
+PEERS_PER_REPLY = METRICS.histogram(
+    'peers_per_reply', 'Peers per addr response before filtering',
+    buckets=(0, 1, 10, 50, 100, 250, 500, 1000))
+REDIS_SECONDS = METRICS.histogram(
+    'redis_seconds', 'Redis round trip time by operation', ['op'])
+WORKERS = METRICS.gauge(
+    'workers', 'Task workers by state (total or busy)', ['state'])
+PENDING = METRICS.gauge(
+    'pending', 'Nodes in the crawl set as of the last pop',
+    function=lambda: CONF['backlog'])
+INFLIGHT_NODES = METRICS.gauge(
+    'inflight', 'Nodes in flight in all processes as of the last pop',
+    function=lambda: CONF['inflight'])
+
+# Workers and handshakes of all processes with a node in flight, scored by
+# the time they started, and the channel notified once the crawl set and
+# in-flight set are both empty, see finish_pending().
+INFLIGHT = 'crawl:inflight'
+IDLE_CHANNEL = 'crawl:idle'
+
+# Redis Stream and its consumer group used as the crawl set with
+# queue = stream.
+STREAM = 'crawl:stream'
+GROUP = 'crawl'
+
+# Rule sets stored by master as packed records (see rules.py) and the hash
+# of their versions, incremented whenever a rule set changes, that slaves
+# check to fetch only the rule sets that changed, see fetch_rules().
+INCLUDE_ASNS = 'include-asns'
+EXCLUDE_NETWORKS = {
+    4: 'exclude-ipv4-networks',
+    6: 'exclude-ipv6-networks',
+}
+RULES_VERSION = 'crawl:rules:version'
+
+# Per-crawl keys left without a TTL by versions before crawl epochs, deleted
+# once on master startup, and the key recording that they were deleted, see
+# delete_legacy_keys().
+LEGACY_KEYS = ('node:*', 'crawl:cidr:*')
+LEGACY_DELETED = 'crawl:legacy:deleted'
+
+# Due nodes a worker tries to claim in rolling mode, see pop_due().
+DUE_CANDIDATES = 10
+
+# Adaptive workers are grown by WORKER_STEP while there are pending nodes and
+# shrunk by WORKER_DECREASE on congestion or when less than MIN_FD_HEADROOM
+# of the open file limit is left.
+WORKER_STEP = 10
+WORKER_DECREASE = 0.75
+MIN_FD_HEADROOM = 0.1
+
+# Snapshot row fields for the columnar sidecar.
+FIELDS = (
+    ('address', STR),
+    ('port', INT),
+    ('services', INT),
+    ('height', INT),
+    ('user_agent', STR),
+)
 
 
 def getaddr(conn):
@@ -74,13 +215,15 @@ def getaddr(conn):
     Sends getaddr message.
     """
     addr_msgs = []
+    start = time.time()
     try:
         conn.getaddr(block=False)
     except (ProtocolError, ConnectionError, socket.error) as err:
         logging.debug(f'{conn.to_addr}: {err}')
     else:
         addr_wait = 0
-        while addr_wait < CONF['socket_timeout']:
+        timeout = get_timeout(CONF['socket_timeout'])
+        while addr_wait < timeout:
             addr_wait += 1
             # TODO: why sleep here
             gevent.sleep(0.3)
@@ -93,6 +236,7 @@ def getaddr(conn):
             if msgs and any([msg['count'] > 0 for msg in msgs]):
                 addr_msgs = msgs
                 break
+    GETADDR_SECONDS.observe(time.time() - start)
     return addr_msgs
 
 
@@ -105,6 +249,8 @@ def get_peers(conn):
     excluded_count = 0
 
     addr_msgs = getaddr(conn)
+    PEERS_PER_REPLY.observe(sum(
+        len(addr_msg.get('addr_list', [])) for addr_msg in addr_msgs))
 
     for addr_msg in addr_msgs:
         if 'addr_list' not in addr_msg:
@@ -139,12 +285,14 @@ def get_peers(conn):
 
 def get_cached_peers(conn, redis_conn):
     """
-    Returns cached peering nodes.
+    Returns cached peering nodes as (address, port, services, timestamp)
+    tuples with the most recent timestamp for each node. Peers are cached as
+    packed records, see peercache.py.
     """
-    key = f'peer:{conn.to_addr[0]}-{conn.to_addr[1]}'
+    key = f"peer:{CONF['session']}:{conn.to_addr[0]}-{conn.to_addr[1]}"
     peers = redis_conn.get(key)
     if peers:
-        peers = eval(peers)
+        peers = unpack_peers(peers)
         logging.debug(f'{conn.to_addr} Peers: {len(peers)}')
     else:
         peers = get_peers(conn)
@@ -153,43 +301,58 @@ def get_cached_peers(conn, redis_conn):
             ttl /= 2  # Shorter TTL for empty peers.
         else:
             ttl += random.randint(0, CONF['addr_ttl_var']) / 100.0 * ttl
-        redis_conn.setex(key, int(ttl), str(peers))
+        redis_conn.setex(key, int(ttl), pack_peers(
+            peers, compress=CONF['peer_cache_compress']))
 
-    # Exclude timestamp from the tuples.
+    latest = {}
+    for (address, port, services, timestamp) in peers:
+        node = (address, port, services)
+        latest[node] = max(timestamp, latest.get(node, 0))
     peers = set([
-        (address, port, services)
-        for (address, port, services, timestamp) in peers])
+        node + (timestamp,) for (node, timestamp) in latest.items()])
     return peers
 
 
-def connect(key, redis_conn):
+def get_priority(timestamp, failures, now):
+    """
+    Returns crawl priority added to a node for one report of it in an addr
+    message. Nodes reported by more peers, with fresher addr timestamps and
+    fewer consecutive failures (see get_failure()) are dialed first.
+    """
+    freshness = max(0.0, 1.0 - (now - timestamp) / CONF['max_age'])
+    return (1.0 + freshness) / (1 + failures)
+
+
+def connect(key, redis_conn, sock=None):
     """
-    Establishes connection with a node to:
+    Establishes connection with a node, or uses the specified socket already
+    connected to it by open_socket(), to:
     1) Send version message
     2) Receive version and verack message
     3) Send getaddr message
     4) Receive addr message containing list of peering nodes
     Stores state and height for node in Redis.
+    Returns True if the node is reachable, False if otherwise.
     """
     version_msg = {}
 
-    redis_conn.set(key, '')  # Set Redis key for a new node.
-
     # (address, port, services) = key[5:].split('-', 2)
     (address, port) = key[5:].split('-', 1)
+    address = Address.parse(address)
+    port = int(port)
     # services = int(services)
     height = redis_conn.get('height')
     if height:
         height = int(height)
 
     proxy = None
-    if address.endswith('.onion') and CONF['onion']:
+    if address.is_onion and CONF['onion']:
         proxy = random.choice(CONF['tor_proxies'])
 
-    conn = Connection((address, int(port)),
+    conn = Connection((address.text, port),
                       (CONF['source_address'], 0),
                       magic_number=CONF['magic_number'],
-                      socket_timeout=CONF['socket_timeout'],
+                      socket_timeout=get_timeout(CONF['socket_timeout']),
                       proxy=proxy,
                       protocol_version=CONF['protocol_version'],
                       #   to_services=services,
@@ -198,15 +361,25 @@ def connect(key, redis_conn):
                       user_agent=CONF['user_agent'],
                       height=height,
                       relay=CONF['relay'])
+    failure = None
     try:
-        logging.debug(f'Connecting to {conn.to_addr}')
-        conn.open()
+        if sock is None:
+            logging.debug(f'Connecting to {conn.to_addr}')
+            conn.open()
+        else:
+            conn.socket = sock
+        start = time.time()
         version_msg = conn.handshake()
+        HANDSHAKE_SECONDS.observe(time.time() - start)
     except (ProtocolError, ConnectionError, socket.error) as err:
         logging.debug(f'{conn.to_addr}: {err}')
+        failure = get_failure_type(err)
 
     redis_pipe = redis_conn.pipeline()
-    if version_msg:
+    if not version_msg:
+        add_failure(address, port, failure, redis_conn, redis_pipe)
+    else:
+        redis_pipe.delete(f'fail:{address.key(port)}')
         # try:
         #     conn.getaddr(block=False)
         # except (ProtocolError, ConnectionError, socket.error) as err:
@@ -235,85 +408,263 @@ def connect(key, redis_conn):
         #                   f'got {from_services} for services')
         #     key = f'node:{address}-{port}-{from_services}'
 
-        height_key = f'height:{address}-{port}-{from_services}'
+        height_key = f'height:{address.key(port, from_services)}'
         redis_pipe.setex(height_key, CONF['max_age'], height)
 
-        version_key = f'version:{address}-{port}'
+        version_key = f'version:{address.key(port)}'
         redis_pipe.setex(version_key,
                          CONF['max_age'],
                          str((version, user_agent, from_services)))
 
-        peers = get_cached_peers(conn, redis_conn)
-        for peer in peers:
-            redis_pipe.sadd('pending', str(peer))
-        redis_pipe.set(key, '')
-        up_key = "node:{}-{}-{}".format(address, port, from_services)
-        redis_pipe.sadd('up', up_key)
+        peers = list(get_cached_peers(conn, redis_conn))
+        if peers:
+            records = redis_conn.mget([
+                f'fail:{peer[0]}-{peer[1]}' for peer in peers])
+        else:
+            records = []
+        now = time.time()
+        priorities = {}
+        for (peer, record) in zip(peers, records):
+            record = get_failure(record)
+            failures = record[1] if record else 0
+            priorities[str(peer[:3])] = get_priority(peer[3], failures, now)
+        add_pending(redis_conn, priorities, incr=True, redis_pipe=redis_pipe)
+        if CONF['capture_graph']:
+            graph = epoch_keys(CONF['epoch'])[4]
+            redis_pipe.hset(graph, address.key(port),
+                            ' '.join(f'{peer[0]}-{peer[1]}' for peer in peers))
+            expire_epoch(graph, redis_pipe)
+        up_key = f'node:{address.key(port, from_services)}'
+        if CONF['rolling']:
+            redis_pipe.zadd('crawl:live', {address.key(port): now})
+            redis_pipe.hset('crawl:live:nodes', address.key(port), up_key)
+        else:
+            redis_pipe.sadd('up', up_key)
+            redis_pipe.zadd('crawl:reached', {up_key: now}, nx=True)
     conn.close()
+    start = time.time()
     redis_pipe.execute()
+    REDIS_SECONDS.observe(time.time() - start, op='connect')
+
+    count_connect(bool(version_msg), failure)
+
+    return bool(version_msg)
+
+
+def open_socket(key, redis_conn):
+    """
+    Opens a TCP connection to a node within connect_timeout (socket_timeout
+    for .onion nodes connected through a Tor proxy) for the first stage of a
+    two-stage crawl.
+    Returns the connected socket or None if the node is unreachable, in
+    which case the failure is recorded as in connect().
+    """
+    (address, port) = key[5:].split('-', 1)
+    address = Address.parse(address)
+    port = int(port)
+
+    proxy = None
+    timeout = get_timeout(CONF['connect_timeout'])
+    if address.is_onion and CONF['onion']:
+        proxy = random.choice(CONF['tor_proxies'])
+        timeout = get_timeout(CONF['socket_timeout'])
+
+    try:
+        sock = create_connection((address.text, port),
+                                 timeout=timeout,
+                                 source_address=(CONF['source_address'], 0),
+                                 proxy=proxy)
+    except (ProtocolError, ConnectionError, socket.error) as err:
+        logging.debug(f'{(address.text, port)}: {err}')
+        failure = get_failure_type(err)
+        redis_pipe = redis_conn.pipeline()
+        add_failure(address, port, failure, redis_conn, redis_pipe)
+        redis_pipe.execute()
+        count_connect(False, failure)
+        return None
+
+    sock.settimeout(get_timeout(CONF['socket_timeout']))
+    return sock
+
+
+def add_failure(address, port, failure, redis_conn, redis_pipe):
+    """
+    Adds commands into the pipeline to record a failed connection to a node
+    for its backoff, see in_backoff().
+    """
+    fail_key = f'fail:{address.key(port)}'
+    record = get_failure(redis_conn.get(fail_key))
+    failures = record[1] + 1 if record else 1
+    redis_pipe.setex(fail_key,
+                     CONF['backoff_max'] * 2,
+                     f'{int(time.time())}:{failures}:'
+                     f'{failure or "handshake"}')
+
+
+def count_connect(up, failure):
+    """
+    Counts a connection attempt and its outcome in STATS and CONNECTS.
+    """
+    CONNECTS.inc(result='reachable' if up else failure or 'handshake')
+    STATS['connects'] += 1
+    if up:
+        STATS['reachable'] += 1
+    elif failure == 'timeout':
+        STATS['timeouts'] += 1
 
 
-def dump(timestamp, nodes, redis_conn):
+def get_failure_type(err):
+    """
+    Returns failure type for the exception raised while connecting to a node.
+    """
+    if isinstance(err, ConnectionRefusedError):
+        return 'refused'
+    if isinstance(err, socket.timeout):
+        return 'timeout'
+    if isinstance(err, ProtocolError):
+        return 'handshake'
+    return 'error'
+
+
+def get_failure(record):
+    """
+    Returns (last attempt, consecutive failures, failure type) tuple from a
+    fail:ADDRESS-PORT value in Redis or None if there is no record.
+    """
+    if not record:
+        return None
+    (last_attempt, failures, failure_type) = record.decode().split(':')
+    return (int(last_attempt), int(failures), failure_type)
+
+
+def in_backoff(record, now):
+    """
+    Returns True if a node with the specified failure record is still within
+    its backoff window, i.e. CONF['backoff_base'] doubling with each
+    consecutive failure up to CONF['backoff_max'] seconds.
+    """
+    if record is None:
+        return False
+    (last_attempt, failures, _) = record
+    window = min(CONF['backoff_base'] * 2 ** (failures - 1),
+                 CONF['backoff_max'])
+    return now - last_attempt < window
+
+
+def dump(timestamp, nodes, redis_conn, coverage=None, graph=None):
     """
     Dumps data for reachable nodes into timestamp-prefixed JSON file and
-    returns most common height from the nodes.
+    returns most common height from the nodes. Coverage statistics of the
+    crawl, if specified, are recorded in the snapshot manifest and the peer
+    graph, if specified, is saved next to the snapshot.
     """
-    json_data = []
+    heights = Counter()
+    start = time.time()
 
     logging.info('Building JSON data')
-    for node in nodes:
-        (address, port, services) = node.decode()[5:].split('-', 2)
-        height_key = f'height:{address}-{port}-{services}'
-        try:
-            height = int(redis_conn.get(height_key))
-        except TypeError:
-            logging.warning(f'{height_key} missing')
-            height = 0
-        version_key = f'version:{address}-{port}'
-        try:
-            version = eval(redis_conn.get(version_key))
-        except TypeError:
-            logging.warning(f'{version_key} missing')
-            version = (0, '', services)
-        json_data.append(
-            [address, int(port), int(services), height, version[1]])
-    logging.info(f'Built JSON data: {len(json_data)}')
-
-    if len(json_data) == 0:
-        logging.warning(f'len(json_data): {len(json_data)}')
+    json_output = os.path.join(CONF['crawl_dir'], f'{timestamp}.json')
+    info = {'coverage': coverage} if coverage else None
+    writer = SnapshotWriter(json_output, fields=FIELDS, info=info)
+    try:
+        for row in get_rows(nodes, redis_conn):
+            writer.write(row)
+            heights[row[3]] += 1
+    except BaseException:
+        writer.abort()
+        raise
+    logging.info(f'Built JSON data: {writer.rows} '
+                 f'({time.time() - start:.2f}s)')
+
+    if writer.rows == 0:
+        writer.abort()
+        logging.warning(f'Rows: {writer.rows}')
         return 0
 
-    json_output = os.path.join(CONF['crawl_dir'], f'{timestamp}.json')
-    open(json_output, 'w').write(json.dumps(json_data))
+    if graph is not None:
+        path = graph_path(json_output)
+        graph.save(path)
+        writer.info['graph'] = os.path.basename(path)
+        logging.info(f'Graph: {len(graph)} nodes, {graph.edges} edges')
+
+    writer.commit()
     logging.info(f'Wrote {json_output}')
 
-    return Counter([node[3] for node in json_data]).most_common(1)[0][0]
+    return heights.most_common(1)[0][0]
 
 
-def restart(timestamp, redis_conn):
+def get_rows(nodes, redis_conn):
+    """
+    Yields snapshot rows for reachable nodes using heights and versions
+    fetched from Redis in chunks of DUMP_CHUNK_SIZE nodes.
+    """
+    nodes = [node.decode()[5:].split('-', 2) for node in nodes]
+    for i in range(0, len(nodes), DUMP_CHUNK_SIZE):
+        chunk = nodes[i:i + DUMP_CHUNK_SIZE]
+        height_keys = [f'height:{address}-{port}-{services}'
+                       for (address, port, services) in chunk]
+        version_keys = [f'version:{address}-{port}'
+                        for (address, port, _) in chunk]
+        redis_pipe = redis_conn.pipeline(transaction=False)
+        redis_pipe.mget(height_keys)
+        redis_pipe.mget(version_keys)
+        (heights, versions) = redis_pipe.execute()
+
+        for (node, height_key, height, version_key, version) in zip(
+                chunk, height_keys, heights, version_keys, versions):
+            (address, port, services) = node
+            if height is None:
+                logging.warning(f'{height_key} missing')
+                height = 0
+            if version is None:
+                logging.warning(f'{version_key} missing')
+                version = (0, '', services)
+            else:
+                version = ast.literal_eval(version.decode())
+            yield [address, int(port), int(services), int(height), version[1]]
+
+
+def restart(timestamp, redis_conn, start=None):
     """
     Dumps data for the reachable nodes into a JSON file.
-    Loads all reachable nodes from Redis into the crawl set.
-    Removes keys for all nodes from current crawl.
+    Reports time taken to reach 95% of the reachable nodes since start.
+    Reports crawl coverage, see get_coverage().
+    Saves the peer graph if enabled, see get_graph().
+    Loads all reachable nodes from Redis into the crawl set and records
+    them as reachable in the previous crawl, see past_cutoff().
+    Switches to a new crawl epoch, see roll_epoch(), and sets the start time
+    of the new crawl, see get_remaining(), as its nodes are queued.
+    Reloads ASN database if it has changed.
     Updates included ASNs.
     Updates excluded networks.
+    Reports nodes skipped or retried during backoff.
     Updates number of reachable nodes in Redis.
+    Returns start time of the new crawl.
     """
     redis_pipe = redis_conn.pipeline()
 
     nodes = redis_conn.smembers('up')  # Reachable nodes.
     redis_pipe.delete('up')
+    redis_pipe.delete(REACHABLE)
 
-    for node in nodes:
-        (address, port, services) = node.decode()[5:].split('-', 2)
-        redis_pipe.sadd('pending', str((address, int(port), int(services))))
+    coverage = get_coverage(redis_conn)
+    graph = get_graph(redis_conn)
 
-    for key in get_keys(redis_conn, 'node:*'):
-        redis_pipe.delete(key)
+    reached = redis_conn.zrange('crawl:reached', 0, -1, withscores=True)
+    redis_pipe.delete('crawl:reached')
+    if reached and start is not None:
+        index = math.ceil(0.95 * len(reached)) - 1
+        reach95 = reached[index][1] - start
+        logging.info(f'Reached 95%: {reach95:.1f}')
+        redis_pipe.set('crawl:reach95', int(reach95))
 
-    for key in get_keys(redis_conn, 'crawl:cidr:*'):
-        redis_pipe.delete(key)
+    reachable = {}
+    for node in nodes:
+        (address, port, services) = node.decode()[5:].split('-', 2)
+        reachable[str((address, int(port), int(services)))] = \
+            REACHABLE_PRIORITY
+        redis_pipe.sadd(REACHABLE, f'{address}-{port}')
 
+    checked = {}
     if CONF['include_checked']:
         checked_nodes = redis_conn.zrangebyscore(
             'check', timestamp - CONF['max_age'], timestamp)
@@ -322,19 +673,76 @@ def restart(timestamp, redis_conn):
             if is_excluded(address):
                 logging.debug(f'Exclude: {address}')
                 continue
-            redis_pipe.sadd('pending', str((address, port, services)))
+            checked[str((address, port, services))] = SEED_PRIORITY
 
+    CONF['epoch'] = roll_epoch(redis_conn, redis_pipe)
+    crawl_start = int(time.time())
+    redis_pipe.set('crawl:start', crawl_start)
     redis_pipe.execute()
 
+    add_pending(redis_conn, reachable)
+    add_pending(redis_conn, checked)
+
+    log_exclusion_cache()
+    refresh_asn_database()
     update_included_asns(redis_conn)
     update_excluded_networks(redis_conn)
 
+    redis_pipe = redis_conn.pipeline()
+    redis_pipe.get('crawl:backoff:skipped')
+    redis_pipe.get('crawl:backoff:retried')
+    redis_pipe.delete('crawl:backoff:skipped', 'crawl:backoff:retried')
+    (skipped, retried, _) = redis_pipe.execute()
+    logging.info(f'Backoff: {int(skipped or 0)} skipped, '
+                 f'{int(retried or 0)} retried')
+
     reachable_nodes = len(nodes)
     logging.info(f'Reachable nodes: {reachable_nodes}')
     redis_conn.lpush('nodes', str((timestamp, reachable_nodes)))
 
-    height = dump(timestamp, nodes, redis_conn)
+    coverage.update({
+        'reachable': reachable_nodes,
+        'backoff_skipped': int(skipped or 0),
+        'backoff_retried': int(retried or 0),
+        'elapsed': timestamp - start if start is not None else None,
+        'target': CONF['target_crawl_seconds'],
+    })
+    logging.info(f'Coverage: {coverage}')
+
+    height = dump(timestamp, nodes, redis_conn, coverage=coverage,
+                  graph=graph)
     logging.info(f'Height: {height}')
+    return crawl_start
+
+
+def get_coverage(redis_conn):
+    """
+    Returns number of nodes claimed (queued with queue = stream) and skipped
+    past the deadline cutoff in the current crawl epoch.
+    """
+    (claims, _, queued, coverage, _) = epoch_keys(CONF['epoch'])
+    redis_pipe = redis_conn.pipeline()
+    redis_pipe.hlen(queued if CONF['queue'] == 'stream' else claims)
+    redis_pipe.hget(coverage, 'deadline_skipped')
+    (crawled, skipped) = redis_pipe.execute()
+    return {
+        'crawled': crawled,
+        'deadline_skipped': int(skipped or 0),
+    }
+
+
+def get_graph(redis_conn):
+    """
+    Returns PeerGraph of the peers advertised by the reachable nodes in the
+    current crawl epoch or None if capture_graph is disabled.
+    """
+    if not CONF['capture_graph']:
+        return None
+    key = epoch_keys(CONF['epoch'])[4]
+    return PeerGraph.build(
+        (node.decode(), peers.decode().split())
+        for (node, peers) in redis_conn.hscan_iter(
+            key, count=DUMP_CHUNK_SIZE))
 
 
 def cron(redis_conn):
@@ -342,73 +750,871 @@ def cron(redis_conn):
     Assigned to a worker to perform the following tasks periodically to
     maintain a continuous crawl:
     1) Reports the current number of nodes in crawl set
-    2) Initiates a new crawl once the crawl set is empty
+    2) Initiates a new crawl once the crawl set is empty and no node is in
+       flight, woken up by workers as soon as that happens
     """
     start = int(time.time())
+    redis_conn.set('crawl:start', start)
 
-    while True:
-        pending_nodes = redis_conn.scard('pending')
-        logging.info(f'Pending: {pending_nodes}')
+    pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe(IDLE_CHANNEL)
 
-        if pending_nodes == 0:
+    while True:
+        pending_nodes = count_pending(redis_conn)
+        inflight_nodes = count_inflight(redis_conn)
+        logging.info(f'Pending: {pending_nodes}, In-flight: {inflight_nodes}')
+        if CONF['queue'] == 'stream':
+            log_stream(redis_conn)
+        log_throughput(redis_conn)
+
+        if pending_nodes == 0 and inflight_nodes == 0:
             redis_conn.set('crawl:master:state', 'starting')
             now = int(time.time())
             elapsed = now - start
             redis_conn.set('elapsed', elapsed)
             logging.info(f'Elapsed: {elapsed}')
             logging.info('Restarting')
-            restart(now, redis_conn)
-            while int(time.time()) - start < CONF['snapshot_delay']:
+            # The new crawl starts as restart() queues its nodes, i.e. it
+            # is timed from then on, but slaves only join it once
+            # snapshot_delay has passed since the previous crawl started.
+            previous = start
+            start = restart(now, redis_conn, start=start)
+            log_first_snapshot(redis_conn)
+            while int(time.time()) - previous < CONF['snapshot_delay']:
                 gevent.sleep(1)
-            start = int(time.time())
             redis_conn.set('crawl:master:state', 'running')
 
+        # Polls every cron_delay in case a notification was missed and
+        # drops notifications queued meanwhile, e.g. by idle workers.
+        pubsub.get_message(timeout=CONF['cron_delay'])
+        while pubsub.get_message() is not None:
+            pass
+
+
+def rolling_cron(redis_conn):
+    """
+    Assigned to a worker in rolling mode to perform the following tasks
+    periodically while workers recrawl nodes continuously:
+    1) Reports the current number of scheduled, due, live and pending nodes
+    2) Dumps live reachable nodes into a JSON file every snapshot_delay
+    """
+    start = int(time.time())
+
+    while True:
+        now = int(time.time())
+
+        redis_pipe = redis_conn.pipeline()
+        redis_pipe.zcard('crawl:schedule')
+        redis_pipe.zcount('crawl:schedule', '-inf', now)
+        redis_pipe.zcard('crawl:live')
+        (scheduled, due, live) = redis_pipe.execute()
+        pending = count_pending(redis_conn)
+        logging.info(f'Scheduled: {scheduled}, Due: {due}, Live: {live}, '
+                     f'Pending: {pending}')
+        if CONF['queue'] == 'stream':
+            log_stream(redis_conn)
+        log_throughput(redis_conn)
+
+        if now - start >= CONF['snapshot_delay']:
+            redis_conn.set('elapsed', now - start)
+            snapshot(now, redis_conn)
+            log_first_snapshot(redis_conn)
+            start = now
+
+        gevent.sleep(CONF['cron_delay'])
+
+
+def log_first_snapshot(redis_conn):
+    """
+    Reports time taken from master startup to its first snapshot, once.
+    """
+    if CONF['started'] is None:
+        return
+    elapsed = time.time() - CONF['started']
+    CONF['started'] = None
+    mode = 'warm' if CONF['warm_start'] else 'cold'
+    logging.info(f'First snapshot: {elapsed:.1f}s ({mode} start)')
+    redis_conn.set('crawl:first_snapshot', int(elapsed))
+
+
+def report_throughput(redis_conn):
+    """
+    Assigned to a worker in every crawl process to periodically report its
+    connects, reachable nodes and nodes deferred due to connection rate
+    limits per second into crawl:throughput in Redis.
+    """
+    field = f'{socket.gethostname()}:{os.getpid()}'
+    last = STATS.copy()
+    last_t = time.time()
+    while True:
         gevent.sleep(CONF['cron_delay'])
+        now = time.time()
+        (stats, last) = (STATS - last, STATS.copy())
+        elapsed = now - last_t
+        last_t = now
+        redis_conn.hset('crawl:throughput', field, str((
+            int(now),
+            stats['connects'] / elapsed,
+            stats['reachable'] / elapsed,
+            stats['deferred'] / elapsed)))
+
+
+def log_throughput(redis_conn):
+    """
+    Logs connect throughput aggregated over all crawl processes. Processes
+    that have stopped reporting are removed from crawl:throughput.
+    """
+    stale = time.time() - 3 * CONF['cron_delay']
+    processes = 0
+    connects = 0.0
+    reachable = 0.0
+    deferred = 0.0
+    for (field, value) in redis_conn.hgetall('crawl:throughput').items():
+        (timestamp, process_connects, process_reachable,
+         process_deferred) = ast.literal_eval(value.decode())
+        if timestamp < stale:
+            redis_conn.hdel('crawl:throughput', field)
+            continue
+        processes += 1
+        connects += process_connects
+        reachable += process_reachable
+        deferred += process_deferred
+    logging.info(f'Throughput: {connects:.1f} connects/s, '
+                 f'{reachable:.1f} reachable/s, {deferred:.1f} deferred/s '
+                 f'({processes} processes)')
+
+
+def supervise():
+    """
+    Assigned to a worker in the master process to spawn CONF['processes']
+    slave processes sharing the crawl set in Redis and restart any of them
+    that exit. Slave i serves its metrics at metrics_port + i + 1 and logs
+    to its own logfile, suffixed with i + 1, as RotatingFileHandler is not
+    safe to share between processes.
+    """
+    SLAVES.extend([None] * CONF['processes'])
+    while True:
+        for (i, slave) in enumerate(SLAVES):
+            if slave is not None:
+                if slave.poll() is None:
+                    continue
+                logging.warning(f'Slave {slave.pid} exited '
+                                f'({slave.returncode}), restarting')
+            (root, ext) = os.path.splitext(CONF['logfile'])
+            args = [sys.executable, os.path.abspath(__file__),
+                    CONF['config'], 'slave',
+                    '--logfile', f'{root}.{i + 1}{ext}']
+            if CONF['metrics_port'] > 0:
+                args += ['--metrics-port', str(CONF['metrics_port'] + i + 1)]
+            SLAVES[i] = subprocess.Popen(args, stdout=subprocess.DEVNULL)
+            logging.info(f'Slave {i}: {SLAVES[i].pid}')
+        gevent.sleep(CONF['cron_delay'])
+
+
+def stop_slaves():
+    """
+    Terminates slave processes spawned by supervise().
+    """
+    for slave in SLAVES:
+        if slave is not None and slave.poll() is None:
+            slave.terminate()
+    for slave in SLAVES:
+        if slave is not None:
+            slave.wait()
+
+
+def snapshot(timestamp, redis_conn):
+    """
+    Dumps data for the live reachable nodes into a JSON file in rolling mode.
+    Nodes that have not been seen reachable within twice the max. recrawl
+    interval are dropped from the live set first.
+    Switches to a new crawl epoch to reset the IPv6 prefix limits.
+    Saves the peer graph if enabled, see get_graph().
+    Reloads ASN database if it has changed.
+    Updates included ASNs.
+    Updates excluded networks.
+    Updates number of reachable nodes in Redis.
+    """
+    stale = timestamp - 2 * CONF['rolling_max_interval']
+    expired = redis_conn.zrangebyscore('crawl:live', '-inf', stale)
+    redis_pipe = redis_conn.pipeline()
+    if expired:
+        redis_pipe.zrem('crawl:live', *expired)
+        redis_pipe.hdel('crawl:live:nodes', *expired)
+        logging.info(f'Expired: {len(expired)}')
+    graph = get_graph(redis_conn)
+    CONF['epoch'] = roll_epoch(redis_conn, redis_pipe)
+    redis_pipe.execute()
+
+    live = redis_conn.zrange('crawl:live', 0, -1)
+    nodes = set()
+    if live:
+        nodes = set([node for node in redis_conn.hmget(
+            'crawl:live:nodes', live) if node is not None])
+
+    log_exclusion_cache()
+    refresh_asn_database()
+    update_included_asns(redis_conn)
+    update_excluded_networks(redis_conn)
+
+    reachable_nodes = len(nodes)
+    logging.info(f'Reachable nodes: {reachable_nodes}')
+    redis_conn.lpush('nodes', str((timestamp, reachable_nodes)))
+
+    height = dump(timestamp, nodes, redis_conn, graph=graph)
+    logging.info(f'Height: {height}')
 
 
 def task(redis_conn):
     """
-    Assigned to a worker to retrieve (pop) a node from the crawl set and
-    attempt to establish connection with a new node.
+    Assigned to a worker to retrieve (pop) the highest priority node from the
+    crawl set and attempt to establish connection with a new node.
+
+    In rolling mode, nodes due for a recrawl are popped first and new nodes
+    from the crawl set are only crawled if they are not already scheduled.
+
+    With queue = stream, nodes are read from the crawl stream instead and
+    acknowledged once crawled, see pop_pending().
+
+    With target_crawl_seconds, low priority nodes are skipped once the crawl
+    is close to its target duration, see past_cutoff().
+
+    The worker is in the in-flight set from the moment it pops a node until
+    the node is crawled, see finish_pending().
     """
+    marker = f"{CONF['consumer']}:{id(gevent.getcurrent())}"
     while True:
+        # Exit if the controller has shrunk the workers.
+        if CONF['retire_workers'] > 0:
+            CONF['retire_workers'] -= 1
+            return
+
         if not CONF['master']:
             while redis_conn.get('crawl:master:state') != b'running':
                 gevent.sleep(CONF['socket_timeout'])
 
-                # Refresh included ASNs and excluded networks.
-                set_included_asns(redis_conn)
-                set_excluded_networks(redis_conn)
+                # Refresh rule sets that changed and ASN database.
+                refresh_rules(redis_conn)
+                refresh_asn_database()
+
+        if CONF['rolling']:
+            node = pop_due(redis_conn)
+            if node is not None:
+                WORKERS.inc(state='busy')
+                crawl_node(node, None, True, redis_conn)
+                WORKERS.dec(state='busy')
+                continue
 
-        node = redis_conn.spop('pending')  # Pop random node from set.
-        if node is None:
+        (node, priority, epoch, entry) = pop_pending(redis_conn, marker)
+        if not node:
             gevent.sleep(1)
             continue
+        WORKERS.inc(state='busy')
+        if past_cutoff(node, redis_conn):
+            coverage = epoch_keys(epoch)[3]
+            redis_pipe = redis_conn.pipeline()
+            redis_pipe.hincrby(coverage, 'deadline_skipped')
+            expire_epoch(coverage, redis_pipe)
+            redis_pipe.execute()
+        else:
+            crawl_node(node, epoch, False, redis_conn, priority=priority)
+        finish_pending(marker, entry, redis_conn)
+        WORKERS.dec(state='busy')
 
-        node = eval(node)  # Convert string from Redis to tuple.
 
-        # Skip IPv6 node.
-        if ':' in node[0] and not CONF['ipv6']:
-            continue
+def crawl_node(node, epoch, scheduled, redis_conn, priority=None):
+    """
+    Attempts to establish connection with a node popped from the crawl set
+    with the specified priority in the specified crawl epoch or, in rolling
+    mode, with a node that is scheduled for a recrawl.
+    """
+    if not scheduled and CONF['rolling']:
+        if redis_conn.zscore('crawl:schedule', node) is not None:
+            return  # Already known, recrawled when due.
 
-        # Skip .onion node.
-        if node[0].endswith('.onion') and not CONF['onion']:
-            continue
+    node = eval(node)  # Convert string from Redis to tuple.
+    try:
+        address = Address.parse(node[0])
+    except ValueError as err:
+        logging.warning(err)
+        return
+
+    # Skip IPv6 node.
+    if address.is_ipv6 and not CONF['ipv6']:
+        return
+
+    # Skip .onion node.
+    if address.is_onion and not CONF['onion']:
+        return
+
+    # key = "node:{}-{}-{}".format(node[0], node[1], node[2])
+    key = f'node:{address.key(node[1])}'
+
+    if scheduled:
+        wait = check_rate(address, key)
+        if wait is not None:
+            redis_conn.zadd('crawl:schedule', {str(node): time.time() + wait})
+            return
+        was_up = redis_conn.zscore(
+            'crawl:live', address.key(node[1])) is not None
+        visit(node, key, was_up, redis_conn)
+        return
+
+    (claims, cidrs, *_) = epoch_keys(epoch)
+
+    # Claim node for the rest of this crawl. Nodes in the crawl stream are
+    # only queued once per crawl and may be redelivered if not acknowledged.
+    claimed = False
+    if not CONF['rolling'] and CONF['queue'] != 'stream':
+        redis_pipe = redis_conn.pipeline()
+        redis_pipe.hsetnx(claims, address.key(node[1]), '')
+        expire_epoch(claims, redis_pipe)
+        if not redis_pipe.execute()[0]:
+            return
+        claimed = True
+
+    # Skip node that has been failing, occasionally retrying it anyway
+    # so that recovered nodes are rediscovered.
+    record = get_failure(redis_conn.get(f'fail:{address.key(node[1])}'))
+    if in_backoff(record, time.time()):
+        if random.random() >= CONF['backoff_retry']:
+            logging.debug(f'Backoff: {key} {record}')
+            redis_conn.incr('crawl:backoff:skipped')
+            return
+        redis_conn.incr('crawl:backoff:retried')
+
+    # Check if prefix has hit its limit.
+    cidr = None
+    if address.is_ipv6 and CONF['ipv6_prefix'] < 128:
+        cidr = address.cidr(CONF['ipv6_prefix'])
+        redis_pipe = redis_conn.pipeline()
+        redis_pipe.hincrby(cidrs, cidr)
+        expire_epoch(cidrs, redis_pipe)
+        (nodes, _) = redis_pipe.execute()
+        if nodes > CONF['nodes_per_ipv6_prefix']:
+            logging.debug(f'CIDR {cidr}: {nodes}')
+            return
+
+    # Put node back into the crawl set below all other nodes if over its
+    # connection rate limits, releasing its claim and prefix count.
+    wait = check_rate(address, key)
+    if wait is not None:
+        redis_pipe = redis_conn.pipeline()
+        if claimed:
+            redis_pipe.hdel(claims, address.key(node[1]))
+        if cidr is not None:
+            redis_pipe.hincrby(cidrs, cidr, -1)
+            expire_epoch(cidrs, redis_pipe)
+        defer_pending(node, priority, redis_pipe)
+        redis_pipe.execute()
+        # Only deferred nodes are left if this one was deferred before.
+        if priority < 0:
+            gevent.sleep(min(wait, 1))
+        return
 
-        # key = "node:{}-{}-{}".format(node[0], node[1], node[2])
-        key = f'node:{node[0]}-{node[1]}'
-        if redis_conn.exists(key):
-            continue
+    visit(node, key, False, redis_conn)
 
-        # Check if prefix has hit its limit.
-        if ':' in node[0] and CONF['ipv6_prefix'] < 128:
-            cidr = ip_to_network(node[0], CONF['ipv6_prefix'])
-            nodes = redis_conn.incr(f'crawl:cidr:{cidr}')
-            if nodes > CONF['nodes_per_ipv6_prefix']:
-                logging.debug(f'CIDR {cidr}: {nodes}')
-                continue
 
-        connect(key, redis_conn)
+def visit(node, key, was_up, redis_conn):
+    """
+    Connects to a node and, in rolling mode, reschedules its recrawl.
+
+    In a two-stage crawl (handshake_workers > 0), the task worker only opens
+    the TCP connection and queues the established socket for a handshake
+    worker, so that connects to unreachable nodes, the bulk of a crawl, do
+    not hold up the version and getaddr exchanges with reachable nodes.
+    """
+    if CONF['handshake_workers'] > 0:
+        sock = open_socket(key, redis_conn)
+        if sock is not None:
+            # Kept in flight, under its own marker, until the handshake
+            # worker is done with it.
+            marker = f"{CONF['consumer']}:{key}"
+            redis_conn.zadd(INFLIGHT, {marker: time.time()})
+            # Blocks while all handshake workers are busy.
+            HANDSHAKES.put((node, key, was_up, sock, marker))
+            return
+        up = False
+    else:
+        up = connect(key, redis_conn)
+    if CONF['rolling']:
+        reschedule(node, was_up, up, redis_conn)
+
+
+def handshake_task(redis_conn):
+    """
+    Assigned to a worker in a two-stage crawl to complete the handshake with
+    nodes connected by task workers, see visit().
+    """
+    while True:
+        (node, key, was_up, sock, marker) = HANDSHAKES.get()
+        up = connect(key, redis_conn, sock=sock)
+        if CONF['rolling']:
+            reschedule(node, was_up, up, redis_conn)
+        finish_pending(marker, None, redis_conn)
+
+
+def get_remaining():
+    """
+    Returns seconds left for the current crawl to finish within
+    target_crawl_seconds or None if there is no target.
+    """
+    if (not CONF['target_crawl_seconds'] or CONF['rolling'] or
+            not CONF['crawl_start']):
+        return None
+    return CONF['crawl_start'] + CONF['target_crawl_seconds'] - time.time()
+
+
+def get_timeout(timeout):
+    """
+    Returns the specified timeout shortened, if there is a target crawl
+    duration, to the time each worker in flight can spend on each pending
+    node for the crawl to finish in time, i.e. remaining seconds * workers in
+    flight / pending nodes, but not below MIN_SOCKET_TIMEOUT.
+    """
+    remaining = get_remaining()
+    if remaining is None:
+        return timeout
+    budget = remaining * max(CONF['inflight'], 1) / max(CONF['backlog'], 1)
+    return min(timeout, max(budget, MIN_SOCKET_TIMEOUT))
+
+
+def past_cutoff(node, redis_conn):
+    """
+    Returns True if the specified node, not reachable in the previous crawl
+    (see REACHABLE), is to be skipped as less than DEADLINE_CUTOFF of the
+    target crawl duration is left.
+    """
+    remaining = get_remaining()
+    if (remaining is None or
+            remaining >= DEADLINE_CUTOFF * CONF['target_crawl_seconds']):
+        return False
+    if isinstance(node, bytes):
+        node = node.decode()
+    (address, port) = ast.literal_eval(node)[:2]
+    return not redis_conn.sismember(REACHABLE, f'{address}-{port}')
+
+
+def check_rate(address, key):
+    """
+    Returns None if a connection to the Address is within the global,
+    per-ASN and per-prefix (IPv4 /16 or IPv6 ipv6_prefix) connection rate
+    limits or seconds to wait before retrying it if otherwise.
+    """
+    if not LIMITER.enabled:
+        return None
+    keys = {}
+    if not address.is_onion:
+        prefix = CONF['ipv6_prefix'] if address.is_ipv6 else 16
+        keys = {
+            'asn': get_decision(address)[1],
+            'prefix': address.cidr(prefix),
+        }
+    denied = LIMITER.acquire(keys)
+    if denied is None:
+        return None
+    (level, wait) = denied
+    logging.debug(f'Deferred: {key} ({level} {keys.get(level, "")})')
+    STATS['deferred'] += 1
+    DEFERRED.inc(level=level)
+    return wait
+
+
+def defer_pending(node, priority, redis_pipe):
+    """
+    Adds commands into the pipeline to put a rate-limited node back into the
+    crawl set, or at the end of the crawl stream, with the priority it was
+    popped with lowered by DEFERRED_OFFSET, unless it has since been added
+    with a higher priority. Deferred nodes are thus only popped again once
+    no other node is left and keep their order among themselves.
+    """
+    if priority >= 0:
+        priority -= DEFERRED_OFFSET
+    if CONF['queue'] == 'stream':
+        redis_pipe.xadd(STREAM, {'node': str(node), 'priority': priority})
+    else:
+        redis_pipe.zadd('pending', {str(node): priority}, gt=True)
+
+
+def controller(workers, redis_conn):
+    """
+    Assigned to a worker to periodically grow or shrink the task workers in
+    the specified group based on the connect outcomes, Redis latency and
+    file descriptor headroom observed since its last run.
+    """
+    last = STATS.copy()
+    while True:
+        gevent.sleep(CONF['cron_delay'])
+
+        (stats, last) = (STATS - last, STATS.copy())
+
+        backlog = count_pending(redis_conn)
+        if CONF['rolling']:
+            backlog += redis_conn.zcount('crawl:schedule', '-inf', time.time())
+        headroom = get_fd_headroom()
+
+        active = len(workers) - CONF['retire_workers']
+        (target, reason) = adjust_workers(active, stats, headroom, backlog)
+        if target > active:
+            for _ in range(target - active):
+                workers.spawn(task, redis_conn)
+        elif target < active:
+            CONF['retire_workers'] += active - target
+        WORKERS.set(target, state='total')
+
+        (reachable_rate, timeout_rate, latency) = get_rates(stats)
+        logging.info(f'Workers: {active} -> {target} ({reason}) '
+                     f"Connects: {stats['connects']} "
+                     f'Reachable: {reachable_rate:.0%} '
+                     f'Timeouts: {timeout_rate:.0%} '
+                     f'Redis: {latency * 1000:.1f} ms '
+                     f'FD headroom: {headroom:.0%} '
+                     f'Backlog: {backlog}')
+
+
+def adjust_workers(active, stats, headroom, backlog):
+    """
+    Returns (target number of workers, reason) using additive increase while
+    the backlog of pending nodes exceeds the active workers and enough
+    connects reach a node, and multiplicative decrease on congestion,
+    bounded by min_workers and max_workers.
+    """
+    (reachable_rate, timeout_rate, latency) = get_rates(stats)
+    if headroom < MIN_FD_HEADROOM:
+        reason = 'fd headroom'
+    elif latency > CONF['max_redis_latency']:
+        reason = 'redis latency'
+    elif timeout_rate > CONF['max_timeout_rate']:
+        reason = 'timeouts'
+    elif stats['connects'] and reachable_rate < CONF['min_reachable_rate']:
+        return (min(max(active, CONF['min_workers']), CONF['max_workers']),
+                'unreachable')
+    elif backlog > active:
+        return (min(active + WORKER_STEP, CONF['max_workers']), 'backlog')
+    else:
+        return (max(active, CONF['min_workers']), 'steady')
+    return (max(int(active * WORKER_DECREASE), CONF['min_workers']), reason)
+
+
+def get_rates(stats):
+    """
+    Returns (reachable rate, timeout rate, average Redis latency) from the
+    specified connect and Redis stats.
+    """
+    connects = stats['connects']
+    reachable_rate = stats['reachable'] / connects if connects else 0.0
+    timeout_rate = stats['timeouts'] / connects if connects else 0.0
+    calls = stats['redis_calls']
+    latency = stats['redis_time'] / calls if calls else 0.0
+    return (reachable_rate, timeout_rate, latency)
+
+
+def get_fd_headroom():
+    """
+    Returns share of the open file limit that is still available.
+    """
+    (limit, _) = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        used = len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return 1.0  # Not available on this platform.
+    return max(0.0, 1.0 - used / limit)
+
+
+def pop_pending(redis_conn, marker):
+    """
+    Returns (node, priority, epoch, entry) for the highest priority node from
+    the crawl set, or the next node from the crawl stream with queue =
+    stream, along with the crawl epoch at the time it was popped. entry is
+    the ID of the stream entry to acknowledge with finish_pending() once the
+    node is crawled or None. node is None if there is no node to crawl.
+    The specified marker is added into the in-flight set in the same
+    transaction so that a popped node is never out of both sets, and removed
+    again with finish_pending() if there is no node to crawl, so that master
+    is notified if the crawl became idle meanwhile.
+    Also updates the crawl epoch, peer cache session, crawl start time and
+    the number of nodes pending and in flight in CONF.
+    """
+    start = time.time()
+    redis_pipe = redis_conn.pipeline()
+    redis_pipe.zadd(INFLIGHT, {marker: start})
+    if CONF['queue'] == 'stream':
+        redis_pipe.xreadgroup(
+            GROUP, CONF['consumer'], {STREAM: '>'}, count=1)
+    else:
+        redis_pipe.zpopmax('pending')
+    redis_pipe.mget('crawl:epoch', 'crawl:session', 'crawl:start')
+    redis_pipe.zcard(INFLIGHT)
+    count_pending(redis_pipe)
+    try:
+        (_, node, (epoch, session, crawl_start), inflight,
+         backlog) = redis_pipe.execute()
+    except redis.exceptions.ResponseError as err:
+        logging.warning(err)  # Stream is recreated on master startup.
+        redis_conn.zrem(INFLIGHT, marker)
+        return (None, None, None, None)
+    STATS['redis_calls'] += 1
+    STATS['redis_time'] += time.time() - start
+    REDIS_SECONDS.observe(time.time() - start, op='pop')
+    CONF['epoch'] = int(epoch or 0)
+    CONF['session'] = int(session or 0)
+    CONF['crawl_start'] = int(crawl_start or 0)
+    CONF['inflight'] = inflight
+    CONF['backlog'] = backlog
+
+    if CONF['queue'] != 'stream':
+        if not node:
+            finish_pending(marker, None, redis_conn)
+            return (None, None, CONF['epoch'], None)
+        (node, priority) = node[0]
+        return (node, priority, CONF['epoch'], None)
+
+    entries = node[0][1] if node else []
+    if not entries:
+        entries = reclaim_pending(redis_conn)
+    if not entries:
+        finish_pending(marker, None, redis_conn)
+        return (None, None, CONF['epoch'], None)
+    (entry, fields) = entries[0]
+    priority = float(fields.get(b'priority', REACHABLE_PRIORITY))
+    return (fields[b'node'], priority, CONF['epoch'], entry)
+
+
+def reclaim_pending(redis_conn):
+    """
+    Claims and returns the oldest stream entry that was delivered to another
+    consumer but not acknowledged within stream_reclaim_idle seconds, e.g.
+    due to a slave that exited while crawling the node.
+    """
+    try:
+        (_, entries, *_) = redis_conn.xautoclaim(
+            STREAM, GROUP, CONF['consumer'],
+            CONF['stream_reclaim_idle'] * 1000, start_id='0-0', count=1)
+    except redis.exceptions.ResponseError as err:
+        logging.warning(err)
+        return []
+    entries = [(entry, fields) for (entry, fields) in entries if fields]
+    if entries:
+        logging.debug(f'Reclaimed: {entries[0]}')
+        STATS['reclaimed'] += 1
+    return entries
+
+
+def finish_pending(marker, entry, redis_conn):
+    """
+    Removes the specified marker from the in-flight set once its node is
+    crawled, acknowledging and removing the crawled entry from the crawl
+    stream if any. Notifies master over IDLE_CHANNEL if no node is left in
+    the crawl set or in flight.
+    """
+    start = time.time()
+    redis_pipe = redis_conn.pipeline()
+    if entry is not None:
+        redis_pipe.xack(STREAM, GROUP, entry)
+        redis_pipe.xdel(STREAM, entry)
+    redis_pipe.zrem(INFLIGHT, marker)
+    redis_pipe.zcard(INFLIGHT)
+    count_pending(redis_pipe)
+    (inflight, pending) = redis_pipe.execute()[-2:]
+    REDIS_SECONDS.observe(time.time() - start, op='finish')
+    if inflight == 0 and pending == 0:
+        redis_conn.publish(IDLE_CHANNEL, CONF['consumer'])
+
+
+def add_pending(redis_conn, priorities, incr=False, redis_pipe=None):
+    """
+    Adds nodes from {node: priority} into the crawl set, raising the priority
+    of nodes already in it or, if incr is True, incrementing it. Commands are
+    added into redis_pipe if specified.
+
+    With queue = stream, nodes not yet queued in the current crawl epoch are
+    added into the crawl stream instead, in the order they were added. Nodes
+    are queued once per ADDRESS-PORT whatever services they were advertised
+    with.
+    """
+    if not priorities:
+        return
+
+    if CONF['queue'] == 'stream':
+        nodes = list(priorities)
+        queued = epoch_keys(CONF['epoch'])[2]
+        stream_pipe = redis_conn.pipeline(transaction=False)
+        for node in nodes:
+            (address, port) = ast.literal_eval(node)[:2]
+            stream_pipe.hsetnx(queued, f'{address}-{port}', '')
+        expire_epoch(queued, stream_pipe)
+        added = stream_pipe.execute()[:-1]
+        for (node, is_new) in zip(nodes, added):
+            if is_new:
+                stream_pipe.xadd(STREAM, {
+                    'node': node, 'priority': priorities[node]})
+        stream_pipe.execute()
+        return
+
+    pipe = redis_pipe if redis_pipe is not None else redis_conn.pipeline()
+    if incr:
+        for (node, priority) in priorities.items():
+            pipe.zincrby('pending', priority, node)
+    else:
+        pipe.zadd('pending', priorities, gt=True)
+    if redis_pipe is None:
+        pipe.execute()
+
+
+def count_pending(redis_conn):
+    """
+    Returns number of nodes in the crawl set or, with queue = stream, the
+    number of entries in the crawl stream that are yet to be acknowledged.
+    """
+    if CONF['queue'] == 'stream':
+        return redis_conn.xlen(STREAM)
+    return redis_conn.zcard('pending')
+
+
+def count_inflight(redis_conn):
+    """
+    Returns number of nodes in flight after dropping markers older than
+    inflight_timeout seconds, e.g. of a slave that exited while crawling.
+    """
+    redis_pipe = redis_conn.pipeline()
+    redis_pipe.zremrangebyscore(
+        INFLIGHT, '-inf', time.time() - CONF['inflight_timeout'])
+    redis_pipe.zcard(INFLIGHT)
+    (expired, inflight) = redis_pipe.execute()
+    if expired:
+        logging.warning(f'In-flight: {expired} expired')
+    return inflight
+
+
+def log_stream(redis_conn):
+    """
+    Logs undelivered and unacknowledged entries in the crawl stream with the
+    unacknowledged entries per consumer. Idle consumers without
+    unacknowledged entries are removed from the consumer group.
+    """
+    length = redis_conn.xlen(STREAM)
+    try:
+        consumers = redis_conn.xinfo_consumers(STREAM, GROUP)
+    except redis.exceptions.ResponseError as err:
+        logging.warning(err)
+        return
+    unacked = sum([consumer['pending'] for consumer in consumers])
+    backlog = ', '.join([
+        f"{consumer['name'].decode()}: {consumer['pending']}"
+        for consumer in consumers if consumer['pending'] > 0])
+    logging.info(f'Stream: {length - unacked} undelivered, '
+                 f'{unacked} unacknowledged ({backlog})')
+
+    for consumer in consumers:
+        if (consumer['pending'] == 0 and
+                consumer['idle'] > CONF['stream_reclaim_idle'] * 1000):
+            redis_conn.xgroup_delconsumer(STREAM, GROUP, consumer['name'])
+
+
+def epoch_keys(epoch):
+    """
+    Returns names of the hashes holding the node claims, the per-IPv6
+    prefix node counts, the nodes queued in the crawl stream with queue =
+    stream, the coverage counts and the peers advertised by each reachable
+    node with capture_graph for the specified crawl epoch.
+    """
+    return (f'crawl:epoch:{epoch}:nodes',
+            f'crawl:epoch:{epoch}:cidr',
+            f'crawl:epoch:{epoch}:queued',
+            f'crawl:epoch:{epoch}:coverage',
+            f'crawl:epoch:{epoch}:graph')
+
+
+def expire_epoch(key, redis_pipe):
+    """
+    Adds a command into the pipeline to expire the specified key of a crawl
+    epoch max_age seconds after its last write. A worker still on an epoch
+    that has since been rolled, e.g. in a slave that has not popped a node
+    since, would otherwise recreate the unlinked key without a TTL.
+    """
+    redis_pipe.expire(key, CONF['max_age'])
+
+
+def roll_epoch(redis_conn, redis_pipe):
+    """
+    Adds commands to switch to a new crawl epoch into the pipeline. Keys from
+    the previous epoch are unlinked, i.e. freed by Redis in the background,
+    instead of being scanned and deleted one by one.
+    Returns the new epoch.
+    """
+    epoch = int(redis_conn.get('crawl:epoch') or 0)
+    redis_pipe.set('crawl:epoch', epoch + 1)
+    redis_pipe.unlink(*epoch_keys(epoch))
+    return epoch + 1
+
+
+def delete_legacy_keys(redis_conn):
+    """
+    Deletes the node:* and crawl:cidr:* keys left without a TTL by versions
+    before crawl epochs, once per Redis database.
+    Returns number of keys deleted.
+    """
+    if redis_conn.exists(LEGACY_DELETED):
+        return 0
+    deleted = 0
+    for pattern in LEGACY_KEYS:
+        keys = get_keys(redis_conn, pattern)
+        for i in range(0, len(keys), DUMP_CHUNK_SIZE):
+            deleted += redis_conn.unlink(*keys[i:i + DUMP_CHUNK_SIZE])
+    redis_conn.set(LEGACY_DELETED, int(time.time()))
+    logging.info(f'Legacy keys: {deleted} deleted')
+    return deleted
+
+
+def pop_due(redis_conn):
+    """
+    Returns the node that is most overdue for a recrawl in rolling mode or
+    None if no node is due yet.
+    Up to DUE_CANDIDATES due nodes are selected, most overdue first, and the
+    first one this worker manages to remove from the schedule is claimed,
+    so that a node is never returned to more than one worker and a node not
+    due yet is never taken off the schedule.
+    """
+    nodes = redis_conn.zrangebyscore(
+        'crawl:schedule', '-inf', time.time(), start=0, num=DUE_CANDIDATES)
+    for node in nodes:
+        if redis_conn.zrem('crawl:schedule', node):
+            return node
+    return None
+
+
+def reschedule(node, was_up, up, redis_conn):
+    """
+    Schedules the next crawl of a node in rolling mode.
+
+    The recrawl interval is halved if the node's reachability has changed
+    since its last crawl (volatile) and doubled if it has not (stable),
+    bounded by rolling_min_interval and rolling_max_interval. Nodes that are
+    unreachable on two consecutive crawls (or on their first crawl) are
+    dropped from the schedule until they are gossiped again.
+    """
+    member = str(node)
+    live_key = f'{node[0]}-{node[1]}'
+
+    interval = redis_conn.hget('crawl:interval', member)
+    if interval is None:
+        interval = CONF['rolling_min_interval']
+    elif was_up != up:
+        interval = max(int(interval) // 2, CONF['rolling_min_interval'])
+    else:
+        interval = min(int(interval) * 2, CONF['rolling_max_interval'])
+
+    redis_pipe = redis_conn.pipeline()
+    if not up:
+        redis_pipe.zrem('crawl:live', live_key)
+        redis_pipe.hdel('crawl:live:nodes', live_key)
+    if not up and not was_up:
+        redis_pipe.zrem('crawl:schedule', member)
+        redis_pipe.hdel('crawl:interval', member)
+    else:
+        redis_pipe.zadd('crawl:schedule', {member: time.time() + interval})
+        redis_pipe.hset('crawl:interval', member, interval)
+    redis_pipe.execute()
 
 
 def set_pending(redis_conn):
@@ -417,40 +1623,139 @@ def set_pending(redis_conn):
     seeders and hardcoded list of .onion nodes to bootstrap the crawler.
     """
     # For testing with `js-tests`:
-    # redis_conn.sadd('pending', str(('127.0.0.10', 15010, TO_SERVICES)))
+    # redis_conn.zadd('pending',
+    #                 {str(('127.0.0.10', 15010, TO_SERVICES)): SEED_PRIORITY})
     # return
 
-    for seeder in CONF['seeders']:
-        nodes = []
-
-        try:
-            ipv4_nodes = socket.getaddrinfo(seeder, None, socket.AF_INET)
-        except socket.gaierror as err:
-            logging.warning(err)
-        else:
-            nodes.extend(ipv4_nodes)
+    seeds = resolve_seeders()
+    cached = load_seed_cache()
+    if seeds:
+        save_seed_cache(dict(cached, **seeds))
 
-        if CONF['ipv6']:
-            try:
-                ipv6_nodes = socket.getaddrinfo(seeder, None, socket.AF_INET6)
-            except socket.gaierror as err:
-                logging.warning(err)
-            else:
-                nodes.extend(ipv6_nodes)
+    # Fall back to the last good results of seeders that did not answer.
+    for seeder in CONF['seeders']:
+        if seeder not in seeds and seeder in cached:
+            logging.info(f'{seeder}: {len(cached[seeder])} cached addresses')
+            seeds[seeder] = cached[seeder]
 
-        for node in nodes:
-            address = node[-1][0]
+    for (seeder, addresses) in seeds.items():
+        for address in addresses:
             if is_excluded(address):
                 logging.debug(f'Exclude: {address}')
                 continue
             logging.debug(f'{seeder}: {address}')
-            redis_conn.sadd(
-                'pending', str((address, CONF['port'], TO_SERVICES)))
+            add_pending(redis_conn, {
+                str((address, CONF['port'], TO_SERVICES)): SEED_PRIORITY})
 
     if CONF['onion']:
-        for address in CONF['onion_nodes']:
-            redis_conn.sadd(
-                'pending', str((address, CONF['port'], TO_SERVICES)))
+        add_pending(redis_conn, {
+            str((address, CONF['port'], TO_SERVICES)): SEED_PRIORITY
+            for address in CONF['onion_nodes']})
+
+
+def warm_pending(redis_conn):
+    """
+    Loads the reachable nodes from the latest snapshot in crawl_dir, if not
+    older than max_age, into the crawl set to warm start the crawler.
+    Nodes that have failed since are given lower priorities based on their
+    failure records, see get_failure().
+    Returns number of nodes loaded.
+    """
+    path = latest_snapshot(CONF['crawl_dir'])
+    if path is None:
+        logging.info('Warm start: no snapshot')
+        return 0
+    age = time.time() - os.path.getmtime(path)
+    if age > CONF['max_age']:
+        logging.info(f'Warm start: {path} is {age:.0f}s old')
+        return 0
+    try:
+        rows = load_snapshot(path)
+    except (OSError, ValueError) as err:
+        logging.warning(f'Warm start: {err}')
+        return 0
+
+    nodes = [tuple(row[:3]) for row in rows if not is_excluded(row[0])]
+    priorities = {}
+    for i in range(0, len(nodes), DUMP_CHUNK_SIZE):
+        chunk = nodes[i:i + DUMP_CHUNK_SIZE]
+        records = redis_conn.mget([
+            f'fail:{address}-{port}' for (address, port, _) in chunk])
+        for (node, record) in zip(chunk, records):
+            record = get_failure(record)
+            failures = record[1] if record else 0
+            priorities[str(node)] = REACHABLE_PRIORITY / (1 + failures)
+    redis_pipe = redis_conn.pipeline()
+    for i in range(0, len(nodes), DUMP_CHUNK_SIZE):
+        redis_pipe.sadd(REACHABLE, *[
+            f'{address}-{port}'
+            for (address, port, _) in nodes[i:i + DUMP_CHUNK_SIZE]])
+    redis_pipe.execute()
+    add_pending(redis_conn, priorities)
+
+    logging.info(f'Warm start: {len(priorities)} nodes from {path}')
+    return len(priorities)
+
+
+def resolve_seeders():
+    """
+    Concurrently resolves IPv4 and, if enabled, IPv6 addresses of the DNS
+    seeders.
+    Returns dict of seeder to its addresses for seeders that answered.
+    """
+    families = [socket.AF_INET]
+    if CONF['ipv6']:
+        families.append(socket.AF_INET6)
+    queries = [(seeder, family)
+               for seeder in CONF['seeders'] for family in families]
+    greenlets = [gevent.spawn(resolve_seeder, seeder, family)
+                 for (seeder, family) in queries]
+    gevent.joinall(greenlets)
+
+    seeds = {}
+    for ((seeder, _), greenlet) in zip(queries, greenlets):
+        if greenlet.value is not None:
+            seeds.setdefault(seeder, []).extend(greenlet.value)
+    return seeds
+
+
+def resolve_seeder(seeder, family):
+    """
+    Returns sorted addresses of the specified family from a DNS seeder or
+    None if it fails to answer within seed_timeout seconds.
+    """
+    try:
+        with gevent.Timeout(CONF['seed_timeout']):
+            nodes = socket.getaddrinfo(seeder, None, family)
+    except gevent.Timeout:
+        logging.warning(f'{seeder}: timed out')
+        return None
+    except socket.gaierror as err:
+        logging.warning(f'{seeder}: {err}')
+        return None
+    return sorted({node[-1][0] for node in nodes})
+
+
+def load_seed_cache():
+    """
+    Returns dict of seeder to its addresses from the last good results of
+    the configured DNS seeders saved in seed_cache.
+    """
+    try:
+        with open(CONF['seed_cache']) as f:
+            cached = json.load(f)
+    except (OSError, ValueError) as err:
+        logging.debug(f"{CONF['seed_cache']}: {err}")
+        return {}
+    return {seeder: addresses for (seeder, addresses) in cached.items()
+            if seeder in CONF['seeders']}
+
+
+def save_seed_cache(seeds):
+    """
+    Saves dict of seeder to its addresses into seed_cache.
+    """
+    write_atomic(CONF['seed_cache'], json.dumps(seeds, indent=4))
 
 
 def is_excluded(address):
@@ -459,71 +1764,190 @@ def is_excluded(address):
 
     In priority order, the rules are:
     - Include onion address
+    - Exclude bad address
     - Exclude private address
     - Exclude address without ASN when include_asns/exclude_asns is set
     - Exclude if address is in exclude_asns
-    - Exclude bad address
     - Exclude if address is in exclude_ipv4_networks/exclude_ipv6_networks
     - Exclude if address is not in include_asns
     - Include address
+
+    The address may be given as text or as Address. Decisions are memoized
+    by packed address in EXCLUDED until the rules or the ASN database change.
     """
-    if address.endswith('.onion'):
-        return False
+    if not isinstance(address, Address):
+        try:
+            address = Address.parse(address)
+        except ValueError:
+            logging.warning(f'Bad address: {address}')
+            EXCLUSIONS.inc(rule='bad')
+            return True
+    (excluded, _, rule) = get_decision(address)
+    if excluded:
+        EXCLUSIONS.inc(rule=rule)
+    return excluded
 
-    if CONF['exclude_private'] and ip_address(address).is_private:
-        return True
 
-    include_asns = CONF['current_include_asns']
-    exclude_ipv6_networks = CONF['current_exclude_ipv6_networks']
-    exclude_ipv4_networks = CONF['current_exclude_ipv4_networks']
+def get_decision(address):
+    """
+    Returns memoized (excluded, ASN, rule) tuple for an Address, see
+    classify_address().
+    """
+    if address.is_onion:
+        return (False, None, None)
 
-    if None in ([include_asns, exclude_ipv6_networks, exclude_ipv4_networks]):
+    if None in ([CONF['current_include_asns'],
+                 CONF['current_exclude_ipv6_networks'],
+                 CONF['current_exclude_ipv4_networks']]):
         logging.warning('Rules not ready')
-        return True
+        return (True, None, 'not_ready')
+
+    decision = EXCLUDED.get(address.packed)
+    if decision is None:
+        decision = classify_address(address)
+        EXCLUDED.put(address.packed, decision)
+    return decision
+
+
+def classify_address(address):
+    """
+    Applies exclusion rules to an IPv4/IPv6 Address and returns a tuple of
+    (excluded, ASN, rule) with rule being the name of the rule that excluded
+    the address or None. ASN is None if not looked up or not found. ASN is
+    only looked up if included/excluded ASNs or a per-ASN connection rate
+    limit are set.
+    """
+    if CONF['exclude_private'] and address.is_private:
+        return (True, None, 'private')
 
+    include_asns = CONF['current_include_asns']
     exclude_asns = CONF['exclude_asns']
+    asn_rules = len(include_asns) > 0 or len(exclude_asns) > 0
 
     asn = None
-    if len(include_asns) > 0 or len(exclude_asns) > 0:
+    if asn_rules or CONF['connect_rate_per_asn'] > 0:
         try:
-            asn_record = ASN.asn(address)
+            asn_record = ASN.asn(address.text)
         except AddressNotFoundError:
             asn = None
         else:
             asn = f'AS{asn_record.autonomous_system_number}'
-        if asn is None:
-            return True
+        if asn is None and asn_rules:
+            return (True, asn, 'no_asn')
 
     if len(exclude_asns) > 0 and asn in exclude_asns:
-        return True
+        return (True, asn, 'exclude_asns')
 
-    if ':' in address:
-        address_family = socket.AF_INET6
-        exclude_ip_networks = exclude_ipv6_networks
+    if address.is_ipv6:
+        exclude_index = CONF['exclude_ipv6_index']
     else:
-        address_family = socket.AF_INET
-        exclude_ip_networks = exclude_ipv4_networks
-    try:
-        addr = int(hexlify(socket.inet_pton(address_family, address)), 16)
-    except socket.error:
-        logging.warning(f'Bad address: {address}')
-        return True
-    if any([(addr & net[1] == net[0]) for net in exclude_ip_networks]):
-        return True
+        exclude_index = CONF['exclude_ipv4_index']
+    if address.value in exclude_index:
+        return (True, asn, 'exclude_networks')
 
     if len(include_asns) > 0 and asn not in include_asns:
-        return True
+        return (True, asn, 'include_asns')
 
-    return False
+    return (False, asn, None)
+
+
+def bump_rules_version():
+    """
+    Marks the exclusion rules as changed, invalidating memoized decisions.
+    """
+    CONF['rules_version'] += 1
+    EXCLUDED.clear()
+    logging.debug(f'Rules version: {CONF["rules_version"]}')
+
+
+def refresh_asn_database():
+    """
+    Reopens the MaxMind ASN database if geoip/update.sh has replaced it.
+    """
+    global ASN
+
+    try:
+        mtime = os.stat(ASN_DATABASE).st_mtime
+    except OSError as err:
+        logging.warning(err)
+        return
+    if mtime == CONF['asn_database_mtime']:
+        return
+
+    try:
+        asn = geoip2.database.Reader(ASN_DATABASE)
+    except (InvalidDatabaseError, IOError) as err:
+        logging.warning(err)  # Retry on next call.
+        return
+
+    ASN = asn
+    CONF['asn_database_mtime'] = mtime
+    logging.info(f'Reloaded {ASN_DATABASE}')
+    bump_rules_version()
+
+
+def log_exclusion_cache():
+    """
+    Logs hit rate for memoized exclusion decisions since the last call.
+    """
+    (hits, misses, rate) = EXCLUDED.stats()
+    logging.info(f'Exclusion cache: {len(EXCLUDED)} entries, '
+                 f'{hits} hits, {misses} misses ({rate:.1f}%)')
+    EXCLUDED.reset_stats()
+
+
+def store_rules(redis_conn, key, record):
+    """
+    Stores packed rule set in Redis and increments its version if it has
+    changed.
+    """
+    if redis_conn.get(key) == record:
+        return
+    redis_pipe = redis_conn.pipeline()
+    redis_pipe.set(key, record)
+    redis_pipe.hincrby(RULES_VERSION, key)
+    (_, version) = redis_pipe.execute()
+    logging.info(f'{key}: version {version} ({len(record)} bytes)')
+
+
+def fetch_rules(redis_conn, keys):
+    """
+    Returns {key: record} for the specified rule sets whose version in Redis
+    differs from the version last fetched. A rule set without a version,
+    e.g. stored before rule sets were versioned, is always fetched.
+    """
+    versions = redis_conn.hmget(RULES_VERSION, keys)
+    changed = [(key, version) for (key, version) in zip(keys, versions)
+               if version is None or
+               version != CONF['rule_set_versions'].get(key)]
+    if not changed:
+        return {}
+    records = redis_conn.mget([key for (key, _) in changed])
+    rules = {}
+    for ((key, version), record) in zip(changed, records):
+        if record is not None:
+            CONF['rule_set_versions'][key] = version
+            rules[key] = record
+    return rules
+
+
+def refresh_rules(redis_conn):
+    """
+    Fetches the rule sets that changed since the last call from Redis and
+    rebuilds the rules built from them.
+    """
+    set_included_asns(redis_conn)
+    set_excluded_networks(redis_conn)
 
 
 def set_included_asns(redis_conn):
     """
-    Fetches up-to-date included ASNs from Redis.
+    Fetches up-to-date included ASNs from Redis if their version changed.
     """
-    asns = redis_conn.get('include-asns')
-    if asns is not None:
-        CONF['current_include_asns'] = eval(asns)
+    rules = fetch_rules(redis_conn, [INCLUDE_ASNS])
+    if INCLUDE_ASNS in rules:
+        CONF['current_include_asns'] = unpack_asns(rules[INCLUDE_ASNS])
+        bump_rules_version()
 
 
 def update_included_asns(redis_conn):
@@ -532,43 +1956,58 @@ def update_included_asns(redis_conn):
     """
     include_asns = set()
 
-    if CONF['include_asns']:
-        include_asns.update(CONF['include_asns'])
+    for asn in CONF['include_asns']:
+        if is_asn(asn):
+            include_asns.add(asn)
+        else:
+            logging.warning(f'Invalid ASN in include_asns: {asn!r}')
 
     if CONF['include_asns_from_url']:
         txt = http_get_txt(CONF['include_asns_from_url'])
         include_asns.update(list_included_asns(txt))
 
     logging.info(f'ASNs: {len(include_asns)}')
-    redis_conn.set('include-asns', str(include_asns))
+    store_rules(redis_conn, INCLUDE_ASNS, pack_asns(include_asns))
     set_included_asns(redis_conn)
 
 
 def list_included_asns(txt, asns=None):
     """
-    Converts list of ASNs from configuration file into a set.
+    Converts list of ASNs from configuration file into a set. Only the first
+    word of each line is read, e.g. AS13335 in "AS13335 Cloudflare".
+    Malformed ASNs, e.g. AS-FOO, are skipped with a warning.
     """
     if asns is None:
         asns = set()
     lines = txt.strip().split('\n')
     for line in lines:
-        line = line.strip()
-        if line.startswith('AS'):
-            asns.add(line)
+        words = line.split()
+        if not words or not words[0].startswith('AS'):
+            continue
+        if is_asn(words[0]):
+            asns.add(words[0])
+        else:
+            logging.warning(f'Invalid ASN: {words[0]!r}')
     return asns
 
 
 def set_excluded_networks(redis_conn):
     """
-    Fetches up-to-date excluded networks from Redis.
+    Fetches up-to-date excluded networks from Redis and rebuilds the compiled
+    lookup index for each address family whose networks' version changed.
     """
-    exclude_ipv4_networks = redis_conn.get('exclude-ipv4-networks')
-    if exclude_ipv4_networks is not None:
-        CONF['current_exclude_ipv4_networks'] = eval(exclude_ipv4_networks)
-
-    exclude_ipv6_networks = redis_conn.get('exclude-ipv6-networks')
-    if exclude_ipv6_networks is not None:
-        CONF['current_exclude_ipv6_networks'] = eval(exclude_ipv6_networks)
+    rules = fetch_rules(redis_conn, list(EXCLUDE_NETWORKS.values()))
+    for (version, bits) in ((4, 32), (6, 128)):
+        key = EXCLUDE_NETWORKS[version]
+        if key not in rules:
+            continue
+        networks = unpack_networks(rules[key], bits)
+        index = NetworkIndex(networks, bits=bits)
+        CONF[f'current_exclude_ipv{version}_networks'] = networks
+        CONF[f'exclude_ipv{version}_index'] = index
+        logging.debug(f'IPv{version} index: {len(networks)} networks '
+                      f'({len(index.starts)} intervals)')
+        bump_rules_version()
 
 
 def update_excluded_networks(redis_conn):
@@ -595,8 +2034,8 @@ def update_excluded_networks(redis_conn):
         v6 = list_excluded_networks(http_get_txt(url), networks=v6)
 
     logging.info(f'IPv4: {len(v4)}, IPv6: {len(v6)}')
-    redis_conn.set('exclude-ipv4-networks', str(v4))
-    redis_conn.set('exclude-ipv6-networks', str(v6))
+    store_rules(redis_conn, EXCLUDE_NETWORKS[4], pack_networks(v4, 32))
+    store_rules(redis_conn, EXCLUDE_NETWORKS[6], pack_networks(v6, 128))
     set_excluded_networks(redis_conn)
 
 
@@ -623,15 +2062,57 @@ def init_conf(argv):
     """
     Populates CONF with key-value pairs from configuration file.
     """
+    global LIMITER
+    global HANDSHAKES
+
     conf = ConfigParser(inline_comment_prefixes='#')
     conf.read(argv[1])
+    CONF['config'] = argv[1]
     CONF['logfile'] = conf.get('crawl', 'logfile')
+    if '--logfile' in argv:
+        CONF['logfile'] = argv[argv.index('--logfile') + 1]
     CONF['log_to_console'] = conf.getboolean('crawl', 'log_to_console')
     CONF['magic_number'] = unhexlify(conf.get('crawl', 'magic_number'))
     CONF['port'] = conf.getint('crawl', 'port')
     CONF['db'] = conf.getint('crawl', 'db')
-    CONF['seeders'] = conf.get('crawl', 'seeders').strip().split('\n')
+    CONF['seeders'] = conf_list(conf, 'crawl', 'seeders')
+    CONF['seed_timeout'] = conf.getfloat('crawl', 'seed_timeout')
+    CONF['seed_cache'] = conf.get('crawl', 'seed_cache')
+    seed_dir = os.path.dirname(CONF['seed_cache'])
+    if seed_dir and not os.path.exists(seed_dir):
+        os.makedirs(seed_dir)
     CONF['workers'] = conf.getint('crawl', 'workers')
+    CONF['adaptive_workers'] = conf.getboolean('crawl', 'adaptive_workers')
+    CONF['min_workers'] = conf.getint('crawl', 'min_workers')
+    CONF['max_workers'] = conf.getint('crawl', 'max_workers')
+    CONF['max_timeout_rate'] = conf.getfloat('crawl', 'max_timeout_rate')
+    CONF['max_redis_latency'] = conf.getfloat('crawl', 'max_redis_latency')
+    CONF['min_reachable_rate'] = conf.getfloat(
+        'crawl', 'min_reachable_rate')
+    CONF['retire_workers'] = 0
+
+    CONF['connect_rate'] = conf.getfloat('crawl', 'connect_rate')
+    CONF['connect_rate_per_asn'] = conf.getfloat(
+        'crawl', 'connect_rate_per_asn')
+    CONF['connect_rate_per_prefix'] = conf.getfloat(
+        'crawl', 'connect_rate_per_prefix')
+    LIMITER = RateLimiter(rate=CONF['connect_rate'], levels={
+        'asn': CONF['connect_rate_per_asn'],
+        'prefix': CONF['connect_rate_per_prefix'],
+    })
+
+    CONF['queue'] = conf.get('crawl', 'queue')
+    if CONF['queue'] not in ('zset', 'stream'):
+        raise ValueError(f"Invalid queue: {CONF['queue']}")
+    CONF['stream_reclaim_idle'] = conf.getint('crawl', 'stream_reclaim_idle')
+    CONF['inflight_timeout'] = conf.getint('crawl', 'inflight_timeout')
+    CONF['target_crawl_seconds'] = conf.getint('crawl', 'target_crawl_seconds')
+    CONF['capture_graph'] = conf.getboolean('crawl', 'capture_graph')
+    CONF['metrics_address'] = conf.get('crawl', 'metrics_address')
+    CONF['metrics_port'] = conf.getint('crawl', 'metrics_port')
+    if '--metrics-port' in argv:
+        CONF['metrics_port'] = int(argv[argv.index('--metrics-port') + 1])
+    CONF['consumer'] = f'{socket.gethostname()}:{os.getpid()}'
     CONF['debug'] = conf.getboolean('crawl', 'debug')
     CONF['source_address'] = conf.get('crawl', 'source_address')
     CONF['protocol_version'] = conf.getint('crawl', 'protocol_version')
@@ -639,10 +2120,15 @@ def init_conf(argv):
     CONF['services'] = conf.getint('crawl', 'services')
     CONF['relay'] = conf.getint('crawl', 'relay')
     CONF['socket_timeout'] = conf.getint('crawl', 'socket_timeout')
+    CONF['handshake_workers'] = conf.getint('crawl', 'handshake_workers')
+    CONF['connect_timeout'] = conf.getfloat('crawl', 'connect_timeout')
+    HANDSHAKES = gevent.queue.Queue(maxsize=max(CONF['handshake_workers'], 1))
     CONF['cron_delay'] = conf.getint('crawl', 'cron_delay')
     CONF['snapshot_delay'] = conf.getint('crawl', 'snapshot_delay')
     CONF['addr_ttl'] = conf.getint('crawl', 'addr_ttl')
     CONF['addr_ttl_var'] = conf.getint('crawl', 'addr_ttl_var')
+    CONF['peer_cache_compress'] = conf.getboolean(
+        'crawl', 'peer_cache_compress')
     CONF['max_age'] = conf.getint('crawl', 'max_age')
     CONF['peers_per_node'] = conf.getint('crawl', 'peers_per_node')
     CONF['ipv6'] = conf.getboolean('crawl', 'ipv6')
@@ -676,6 +2162,36 @@ def init_conf(argv):
     CONF['current_exclude_ipv4_networks'] = None
     CONF['current_exclude_ipv6_networks'] = None
 
+    # Compiled lookup index for the current excluded networks.
+    CONF['exclude_ipv4_index'] = NetworkIndex(bits=32)
+    CONF['exclude_ipv6_index'] = NetworkIndex(bits=128)
+
+    # Versions of the rule sets last fetched from Redis, see fetch_rules().
+    CONF['rule_set_versions'] = {}
+
+    # Incremented whenever included ASNs, excluded networks or the ASN
+    # database change; memoized exclusion decisions are dropped on change.
+    CONF['rules_version'] = 0
+
+    # Namespace for cached peers, incremented on each cold master startup.
+    CONF['session'] = 0
+
+    # Master startup time until its first snapshot, see log_first_snapshot().
+    CONF['started'] = None
+
+    # Current crawl epoch, see roll_epoch().
+    CONF['epoch'] = 0
+
+    # Start time of the current crawl and number of nodes pending and in
+    # flight as of the last pop, see get_timeout().
+    CONF['crawl_start'] = 0
+    CONF['backlog'] = 0
+    CONF['inflight'] = 0
+
+    CONF['asn_database_mtime'] = os.stat(ASN_DATABASE).st_mtime
+    EXCLUDED.maxsize = conf.getint('crawl', 'asn_cache_size')
+    EXCLUDED.clear()
+
     CONF['onion'] = conf.getboolean('crawl', 'onion')
     CONF['tor_proxies'] = [
         (p.split(':')[0], int(p.split(':')[1]))
@@ -683,6 +2199,15 @@ def init_conf(argv):
     CONF['onion_nodes'] = conf_list(conf, 'crawl', 'onion_nodes')
 
     CONF['include_checked'] = conf.getboolean('crawl', 'include_checked')
+    CONF['warm_start'] = conf.getboolean('crawl', 'warm_start')
+
+    CONF['backoff_base'] = conf.getint('crawl', 'backoff_base')
+    CONF['backoff_max'] = conf.getint('crawl', 'backoff_max')
+    CONF['backoff_retry'] = conf.getfloat('crawl', 'backoff_retry')
+
+    CONF['rolling'] = conf.getboolean('crawl', 'rolling')
+    CONF['rolling_min_interval'] = conf.getint('crawl', 'rolling_min_interval')
+    CONF['rolling_max_interval'] = conf.getint('crawl', 'rolling_max_interval')
 
     CONF['crawl_dir'] = conf.get('crawl', 'crawl_dir')
     if not os.path.exists(CONF['crawl_dir']):
@@ -691,10 +2216,16 @@ def init_conf(argv):
     # Set to True for master process
     CONF['master'] = argv[2] == 'master'
 
+    # Number of slave processes to spawn from master process
+    CONF['processes'] = 0
+    if '--processes' in argv:
+        CONF['processes'] = int(argv[argv.index('--processes') + 1])
+
 
 def main(argv):
     if len(argv) < 3 or not os.path.exists(argv[1]):
-        print('Usage: crawl.py [config] [master|slave]')
+        print('Usage: crawl.py [config] [master|slave] [--processes N] '
+              '[--metrics-port PORT] [--logfile PATH]')
         return 1
 
     # Initialize global conf.
@@ -707,40 +2238,91 @@ def main(argv):
 
     redis_conn = new_redis_conn(db=CONF['db'])
 
+    # Slaves and consumer groups of the crawl stream need a Redis server
+    # shared across processes.
+    if isinstance(redis_conn, MemoryStorage) and (
+            CONF['processes'] > 0 or CONF['queue'] == 'stream'):
+        print('STORAGE=memory supports neither --processes nor '
+              'queue = stream')
+        return 1
+
+    if CONF['metrics_port'] > 0:
+        METRICS.serve(CONF['metrics_address'], CONF['metrics_port'])
+
     if CONF['master']:
+        CONF['started'] = time.time()
         redis_conn.set('crawl:master:state', 'starting')
-        logging.info('Removing all keys')
+        logging.info('Resetting crawl set and rolling crawl epoch')
         redis_pipe = redis_conn.pipeline()
         redis_pipe.delete('up')
-        patterns = [
-            'node:*',
-            'height:*',
-            'crawl:cidr:*',
-            'version:*',
-            'peer:*',
-        ]
-        for pattern in patterns:
-            for key in get_keys(redis_conn, pattern):
-                redis_pipe.delete(key)
+        # Keys from previous crawls are left to expire: height and version
+        # keys are refreshed for every reachable node and cached peers are
+        # namespaced by session. A warm start keeps the previous session so
+        # that its cached peers are reused until they expire.
+        session = redis_conn.get('crawl:session')
+        if CONF['warm_start'] and session is not None:
+            CONF['session'] = int(session)
+        else:
+            CONF['session'] = redis_conn.incr('crawl:session')
+        CONF['epoch'] = roll_epoch(redis_conn, redis_pipe)
         redis_pipe.delete('pending')
+        redis_pipe.delete('crawl:reached')
+        redis_pipe.delete(REACHABLE)
+        redis_pipe.delete('crawl:schedule')
+        redis_pipe.delete('crawl:interval')
+        redis_pipe.delete('crawl:live')
+        redis_pipe.delete('crawl:live:nodes')
+        redis_pipe.delete('crawl:throughput')
+        redis_pipe.delete(STREAM)
+        redis_pipe.delete(INFLIGHT)
+        if CONF['queue'] == 'stream':
+            redis_pipe.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
         redis_pipe.execute()
+        delete_legacy_keys(redis_conn)
         update_included_asns(redis_conn)
         update_excluded_networks(redis_conn)
         set_pending(redis_conn)
+        if CONF['warm_start']:
+            warm_pending(redis_conn)
         redis_conn.set('crawl:master:state', 'running')
 
+    if not CONF['master']:
+        refresh_rules(redis_conn)
+
     # Spawn workers (greenlets) including one worker reserved for cron tasks.
     workers = []
-    if CONF['master']:
+    tasks = gevent.pool.Group()
+    if CONF['master'] and CONF['rolling']:
+        workers.append(gevent.spawn(rolling_cron, redis_conn))
+    elif CONF['master']:
         workers.append(gevent.spawn(cron, redis_conn))
-    for _ in range(CONF['workers'] - len(workers)):
-        workers.append(gevent.spawn(task, redis_conn))
-    logging.info(f'Workers: {len(workers)}')
+    count = CONF['workers'] - len(workers)
+    if CONF['adaptive_workers']:
+        count = min(max(count, CONF['min_workers']), CONF['max_workers'])
+    for _ in range(count):
+        tasks.spawn(task, redis_conn)
+    WORKERS.set(len(tasks), state='total')
+    logging.info(f'Workers: {len(workers) + len(tasks)}')
+
+    # Handshake workers in a two-stage crawl, see visit().
+    for _ in range(CONF['handshake_workers']):
+        workers.append(gevent.spawn(handshake_task, redis_conn))
+    if CONF['handshake_workers'] > 0:
+        logging.info(f"Handshake workers: {CONF['handshake_workers']}")
+
+    # Housekeeping workers, not counted towards CONF['workers'].
+    if CONF['adaptive_workers']:
+        workers.append(gevent.spawn(controller, tasks, redis_conn))
+    if CONF['master'] and CONF['processes'] > 0:
+        workers.append(gevent.spawn(supervise))
+    workers.append(gevent.spawn(report_throughput, redis_conn))
 
     try:
-        gevent.joinall(workers)
+        gevent.joinall(workers + list(tasks))
     except KeyboardInterrupt:
         pass
+    finally:
+        stop_slaves()
 
     return 0
 
@@ -28,7 +28,6 @@
 Exports enumerated data for reachable nodes into a JSON file.
 """
 
-import json
 import logging
 import os
 import sys
@@ -38,11 +37,34 @@ from binascii import unhexlify
 from collections import Counter
 from configparser import ConfigParser
 
+from address import Address
+from columns import FLOAT
+from columns import INT
+from columns import STR
 from resolve import Resolve
+from snapshot import write_snapshot
 from utils import configure_logger, new_redis_conn, hsd_getblockheights
 
 CONF = {}
 
+# Snapshot row fields for the columnar sidecar.
+FIELDS = (
+    ('address', STR),
+    ('port', INT),
+    ('user_agent', STR),
+    ('timestamp', INT),
+    ('services', INT),
+    ('height', INT),
+    ('hostname', STR),
+    ('city', STR),
+    ('country', STR),
+    ('latitude', FLOAT),
+    ('longitude', FLOAT),
+    ('timezone', STR),
+    ('asn', STR),
+    ('org', STR),
+)
+
 
 class Export(object):
     """
@@ -85,7 +107,7 @@ class Export(object):
         Writes rows into timestamp-prefixed JSON file.
         """
         json_file = os.path.join(CONF['export_dir'], f'{self.timestamp}.json')
-        open(json_file, 'w').write(json.dumps(rows))
+        write_snapshot(json_file, rows, fields=FIELDS)
         logging.info(f'Wrote {json_file}')
 
     def get_row(self, node):
@@ -94,17 +116,18 @@ class Export(object):
         """
         # address, port, version, user_agent, timestamp, services
         node = eval(node)
-        address = node[0]
+        address = Address.parse(node[0])
         port = node[1]
         services = node[2]
 
-        n = f'{address}-{port}'
+        n = address.key(port)
         if n in self.heights:
             # Height from received block inv message in ping.py.
             height = (self.heights[n],)
         else:
             # Height from handshake in crawl.py.
-            height = self.redis_conn.get(f'height:{address}-{port}-{services}')
+            height = self.redis_conn.get(
+                f'height:{address.key(port, services)}')
             if height is None:
                 height = (0,)
             else:
@@ -121,7 +144,7 @@ class Export(object):
             # resolve.py may not have seen this node in opendata yet when
             # it last ran, so manually trigger raw geoip now.
             logging.warning(f'Raw geoip triggered for {address}')
-            geoip = Resolve().raw_geoip(address)
+            geoip = Resolve().raw_geoip(address.text)
         else:
             geoip = eval(geoip)
 
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# graph.py - Peer graph captured during a crawl.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Peer graph captured during a crawl for network topology analysis.
+
+Edges from each reachable node to the peers it advertised in its addr
+response are stored in compressed sparse row (CSR) form next to the
+snapshot, e.g. 1663113591.graph.npz for 1663113591.json: node names are
+interned into integer ids, the peers of node i are the sorted ids
+indices[indptr[i]:indptr[i + 1]] and names are dictionary-encoded as in the
+columnar sidecar (see columns.py).
+"""
+
+import os
+from array import array
+
+import numpy as np
+
+from columns import StringColumn
+from columns import encode_strings
+from snapshot import mkstemp
+
+
+def graph_path(path):
+    """
+    Returns path to the peer graph for the specified JSON snapshot.
+    """
+    if path.endswith('.json'):
+        path = path[:-5]
+    return f'{path}.graph.npz'
+
+
+class PeerGraph(object):
+    """
+    Directed graph of nodes and the peers they advertised in CSR form.
+    Crawled nodes come first, i.e. have ids 0 to crawled - 1, followed by
+    peers that were only advertised and have no edges of their own.
+    """
+
+    def __init__(self, names, indptr, indices):
+        self.names = names
+        self.indptr = indptr
+        self.indices = indices
+        self._ids = None
+
+    @classmethod
+    def build(cls, adjacency):
+        """
+        Returns PeerGraph from an iterable of (node, peers) tuples with
+        nodes and peers as strings, e.g. ADDRESS-PORT.
+        """
+        adjacency = list(adjacency)
+        ids = {}
+        for (node, _) in adjacency:
+            ids.setdefault(node, len(ids))
+
+        indptr = array('q', [0])
+        indices = array('i')
+        for (_, peers) in adjacency:
+            indices.extend(sorted(set(
+                ids.setdefault(peer, len(ids)) for peer in peers)))
+            indptr.append(len(indices))
+        indptr.extend([len(indices)] * (len(ids) + 1 - len(indptr)))
+
+        (offsets, strings) = encode_strings(ids)
+        names = StringColumn(np.arange(len(ids)), offsets, strings)
+        graph = cls(names,
+                    np.frombuffer(indptr, np.int64),
+                    np.frombuffer(indices, np.int32))
+        graph._ids = ids
+        return graph
+
+    def save(self, path):
+        """
+        Saves the graph into the specified .npz file via a temporary file
+        that is renamed into place once written.
+        """
+        (fd, tmp_path) = mkstemp(path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f,
+                                    indptr=self.indptr,
+                                    indices=self.indices,
+                                    offsets=self.names.offsets,
+                                    strings=self.names.strings)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """
+        Returns PeerGraph from the specified .npz file.
+        """
+        with np.load(path) as data:
+            offsets = data['offsets']
+            names = StringColumn(
+                np.arange(len(offsets) - 1), offsets, data['strings'])
+            return cls(names, data['indptr'], data['indices'])
+
+    @property
+    def edges(self):
+        return len(self.indices)
+
+    def name(self, node_id):
+        """
+        Returns name of the node with the specified id.
+        """
+        return self.names.lookup(node_id)
+
+    def id(self, name):
+        """
+        Returns id of the specified node or None if it is not in the graph.
+        """
+        if self._ids is None:
+            self._ids = {name: i for (i, name) in enumerate(self.names.table)}
+        return self._ids.get(name)
+
+    def peers(self, node_id):
+        """
+        Returns sorted ids of the peers advertised by the specified node.
+        """
+        return self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def out_degree(self):
+        """
+        Returns number of peers advertised by each node.
+        """
+        return np.diff(self.indptr)
+
+    def in_degree(self):
+        """
+        Returns number of nodes that advertised each node.
+        """
+        return np.bincount(self.indices, minlength=len(self))
+
+    def coverage(self, reachable):
+        """
+        Returns {reachable, advertised, reachable_advertised} for the
+        specified reachable nodes, i.e. number of reachable nodes, of nodes
+        advertised by at least one node and of reachable nodes among them.
+        """
+        is_reachable = np.zeros(len(self), bool)
+        reachable = list(reachable)
+        ids = [self.id(name) for name in reachable]
+        is_reachable[[i for i in ids if i is not None]] = True
+        advertised = self.in_degree() > 0
+        return {
+            'reachable': len(reachable),
+            'advertised': int(advertised.sum()),
+            'reachable_advertised': int((advertised & is_reachable).sum()),
+        }
+
+    def overlap(self, a, b):
+        """
+        Returns Jaccard similarity of the peers advertised by the nodes with
+        the specified ids, i.e. shared peers / distinct peers of both.
+        """
+        (peers_a, peers_b) = (self.peers(a), self.peers(b))
+        union = np.union1d(peers_a, peers_b).size
+        if union == 0:
+            return 0.0
+        shared = np.intersect1d(peers_a, peers_b, assume_unique=True).size
+        return shared / union
+
+    def __len__(self):
+        return len(self.indptr) - 1
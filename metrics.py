@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# metrics.py - Prometheus metrics endpoint.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Counters, gauges and histograms rendered in the Prometheus text exposition
+format and served over HTTP by a gevent WSGI server, e.g. for crawl.py with
+metrics_port set.
+"""
+
+import logging
+from bisect import bisect_left
+
+from gevent.pywsgi import WSGIServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds for latency histograms.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30)
+
+
+def escape(value):
+    """
+    Returns label value escaped for the text exposition format.
+    """
+    return (str(value).replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{escape(value)}"'
+                     for (name, value) in labels)
+    return f'{{{pairs}}}'
+
+
+class Metric(object):
+    """
+    Named metric with a value per combination of label values.
+    """
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+
+    def key(self, labels):
+        """
+        Returns tuple of label values in label order. Raises ValueError if
+        the specified labels do not match those of the metric.
+        """
+        if set(labels) != set(self.labels):
+            raise ValueError(f'{self.name}: expected labels {self.labels}, '
+                             f'got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self):
+        """
+        Yields (name, ((label, value), ...), value) for each sample.
+        """
+        for (key, value) in sorted(self.values.items()):
+            yield (self.name, tuple(zip(self.labels, key)), value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}',
+                 f'# TYPE {self.name} {self.kind}']
+        for (name, labels, value) in self.samples():
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Gauge set explicitly or, if function is specified, read from it when
+    rendered.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is not None:
+            yield (self.name, (), self.function())
+            return
+        yield from super().samples()
+
+
+class Histogram(Metric):
+    """
+    Histogram with cumulative bucket counts, sum and count per combination
+    of label values.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(),
+                 buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        values = self.values.get(key)
+        if values is None:
+            # Per-bucket counts including +Inf, sum and count.
+            values = self.values[key] = [0] * (len(self.buckets) + 1) + [0, 0]
+        values[bisect_left(self.buckets, value)] += 1
+        values[-2] += value
+        values[-1] += 1
+
+    def samples(self):
+        for (key, values) in sorted(self.values.items()):
+            labels = tuple(zip(self.labels, key))
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+            for (bound, count) in zip(bounds, values):
+                cumulative += count
+                yield (f'{self.name}_bucket', labels + (('le', bound),),
+                       cumulative)
+            yield (f'{self.name}_sum', labels, values[-2])
+            yield (f'{self.name}_count', labels, values[-1])
+
+
+class Registry(object):
+    """
+    Collection of metrics with names prefixed by the specified namespace.
+    """
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.metrics = []
+
+    def register(self, metric):
+        metric.name = f'{self.namespace}_{metric.name}'
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(),
+                  buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """
+        Returns all metrics in the text exposition format.
+        """
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+    def app(self, environ, start_response):
+        """
+        WSGI application serving the metrics at /metrics.
+        """
+        if environ['PATH_INFO'] != '/metrics':
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return [b'Not Found\n']
+        data = self.render().encode()
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE),
+                                  ('Content-Length', str(len(data)))])
+        return [data]
+
+    def serve(self, address, port):
+        """
+        Starts serving the metrics in the background and returns the
+        server.
+        """
+        server = WSGIServer((address, port), self.app, log=None)
+        server.start()
+        logging.info(f'Metrics: http://{address}:{server.server_port}'
+                     f'/metrics')
+        return server
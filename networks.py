@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# networks.py - Compiled index for IP network membership checks.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""
+Compiled index for IP network membership checks.
+"""
+
+from bisect import bisect_right
+
+
+class NetworkIndex(object):
+    """
+    Sorted, non-overlapping address intervals compiled from a collection of
+    (network address, netmask) integer tuples, e.g. from
+    crawl.list_excluded_networks().
+
+    Overlapping and adjacent networks are merged at build time so a lookup is
+    a single bisect over the interval starts, i.e. O(log n) comparisons
+    regardless of how many bogon prefixes were loaded.
+    """
+
+    def __init__(self, networks=None, bits=32):
+        self.hostmask = (1 << bits) - 1
+        self.starts = []
+        self.ends = []
+        self.size = 0
+        if networks:
+            self.build(networks)
+
+    def build(self, networks):
+        """
+        Rebuilds the index from an iterable of (network, netmask) tuples.
+        """
+        intervals = sorted(
+            (network, network | (~netmask & self.hostmask))
+            for (network, netmask) in networks)
+
+        starts = []
+        ends = []
+        for (start, end) in intervals:
+            if ends and start <= ends[-1] + 1:
+                if end > ends[-1]:
+                    ends[-1] = end
+                continue
+            starts.append(start)
+            ends.append(end)
+
+        self.starts = starts
+        self.ends = ends
+        self.size = len(intervals)
+
+    def __contains__(self, addr):
+        """
+        Returns True if integer address falls within any indexed network.
+        """
+        i = bisect_right(self.starts, addr) - 1
+        return i >= 0 and addr <= self.ends[i]
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# peercache.py - Packed peer cache records.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Packed binary records for the peer cache in crawl.py.
+
+A record is a format byte (RAW or ZLIB) followed by the, optionally
+zlib-compressed, body: a dictionary of the distinct addresses in the record
+as length-prefixed packed bytes (see address.py) and one fixed-size entry
+per peer referencing its address by index, i.e. each address is stored once
+however many ports, services or timestamps it was advertised with.
+"""
+
+import ast
+import struct
+import zlib
+
+from address import Address
+
+RAW = b'\x01'
+ZLIB = b'\x02'
+
+COUNT = struct.Struct('<H')
+# Address index, port, services and timestamp.
+PEER = struct.Struct('<HHQI')
+
+
+def pack_peers(peers, compress=True):
+    """
+    Returns record for the specified (address, port, services, timestamp)
+    tuples.
+    """
+    index = {}
+    for (address, _, _, _) in peers:
+        index.setdefault(address, len(index))
+
+    body = [COUNT.pack(len(index))]
+    for address in index:
+        packed = Address.parse(address).packed
+        body.append(bytes([len(packed)]) + packed)
+    body.append(COUNT.pack(len(peers)))
+    for (address, port, services, timestamp) in peers:
+        body.append(PEER.pack(index[address], port, services, timestamp))
+
+    body = b''.join(body)
+    if compress:
+        return ZLIB + zlib.compress(body)
+    return RAW + body
+
+
+def unpack_peers(record):
+    """
+    Returns list of (address, port, services, timestamp) tuples from the
+    specified record. Records cached as Python literals before records were
+    packed are also accepted.
+    """
+    kind = record[:1]
+    if kind == ZLIB:
+        body = zlib.decompress(record[1:])
+    elif kind == RAW:
+        body = record[1:]
+    elif kind == b'[':
+        return ast.literal_eval(record.decode())
+    else:
+        raise ValueError(f'invalid peer cache record: {record[:16]!r}')
+
+    (count,) = COUNT.unpack_from(body)
+    offset = COUNT.size
+    addresses = []
+    for _ in range(count):
+        length = body[offset]
+        packed = body[offset + 1:offset + 1 + length]
+        addresses.append(Address.from_packed(packed).text)
+        offset += 1 + length
+
+    (count,) = COUNT.unpack_from(body, offset)
+    offset += COUNT.size
+    end = offset + count * PEER.size
+    return [(addresses[i], port, services, timestamp)
+            for (i, port, services, timestamp)
+            in PEER.iter_unpack(body[offset:end])]
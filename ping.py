@@ -33,8 +33,6 @@ monkey.patch_all()
 
 import gevent
 import gevent.pool
-import glob
-import json
 import logging
 import os
 import random
@@ -47,12 +45,14 @@ from binascii import hexlify
 from binascii import unhexlify
 from configparser import ConfigParser
 
+from address import Address
 from protocol import Connection
 from protocol import ConnectionError
 from protocol import ProtocolError
+from snapshot import latest_snapshot
+from snapshot import load_snapshot
 from utils import configure_logger
 from utils import get_keys
-from utils import ip_to_network
 from utils import new_redis_conn
 
 redis.connection.socket = gevent.socket
@@ -65,9 +65,13 @@ class Keepalive(object):
     Implements keepalive mechanic to keep the specified connection with a node.
     """
 
-    def __init__(self, conn=None, version_msg=None, redis_conn=None):
+    def __init__(self, conn=None, version_msg=None, redis_conn=None,
+                 address=None):
         self.conn = conn
         self.node = conn.to_addr
+        if address is None:
+            address = Address.parse(self.node[0])
+        self.address = address
 
         self.start_time = int(time.time())
         self.last_ping = self.start_time
@@ -133,7 +137,7 @@ class Keepalive(object):
             return False
         logging.debug(f'pinging {self.node} ({nonce}) {now}')
 
-        key = f'ping:{self.node[0]}-{self.node[1]}:{nonce}'
+        key = f'ping:{self.address.key(self.node[1])}:{nonce}'
         self.redis_conn.lpush(key, int(self.last_ping * 1000))  # milliseconds
         self.redis_conn.expire(key, CONF['rtt_ttl'])
 
@@ -150,7 +154,7 @@ class Keepalive(object):
         """
         self.last_version = now
 
-        version_key = f'version:{self.node[0]}-{self.node[1]}'
+        version_key = f'version:{self.address.key(self.node[1])}'
         version_data = self.redis_conn.get(version_key)
 
         if version_data is None:
@@ -192,9 +196,8 @@ class Keepalive(object):
                     if inv['type'] != 2:
                         continue
                     key = f"binv:{inv['hash'].decode()}"
-                    self.redis_pipe.execute_command(
-                        'ZADD', key, 'LT', ms,
-                        f'{self.node[0]}-{self.node[1]}')
+                    self.redis_pipe.zadd(
+                        key, {self.address.key(self.node[1]): ms}, lt=True)
                     self.redis_pipe.expire(key, CONF['inv_ttl'])
             self.redis_pipe.execute()
 
@@ -211,11 +214,16 @@ def task(redis_conn):
         return
     (address, port, services, height) = eval(node)
     node = (address, port)
+    try:
+        address = Address.parse(address)
+    except ValueError as err:
+        logging.warning(err)
+        return
 
     # Check if prefix has hit its limit
     cidr_key = None
-    if ':' in address and CONF['ipv6_prefix'] < 128:
-        cidr = ip_to_network(address, CONF['ipv6_prefix'])
+    if address.is_ipv6 and CONF['ipv6_prefix'] < 128:
+        cidr = address.cidr(CONF['ipv6_prefix'])
         cidr_key = f'ping:cidr:{cidr}'
         nodes = redis_conn.incr(cidr_key)
         logging.info(f'+CIDR {cidr}: {nodes}')
@@ -233,7 +241,7 @@ def task(redis_conn):
         return
 
     proxy = None
-    if address.endswith('.onion') and CONF['onion']:
+    if address.is_onion and CONF['onion']:
         proxy = random.choice(CONF['tor_proxies'])
 
     version_msg = {}
@@ -263,7 +271,7 @@ def task(redis_conn):
         redis_conn.srem('open', str(node))
         return
 
-    if address.endswith('.onion'):
+    if address.is_onion:
         # Map local port to .onion node.
         local_port = conn.socket.getsockname()[1]
         logging.debug(f'Local port {conn.to_addr}: {local_port}')
@@ -272,7 +280,8 @@ def task(redis_conn):
     Keepalive(
         conn=conn,
         version_msg=version_msg,
-        redis_conn=redis_conn).keepalive()
+        redis_conn=redis_conn,
+        address=address).keepalive()
 
     if cidr_key:
         nodes = redis_conn.decr(cidr_key)
@@ -335,11 +344,9 @@ def get_snapshot():
     Returns latest JSON file (based on creation date) containing a snapshot of
     all reachable nodes from a completed crawl.
     """
-    snapshot = None
-    try:
-        snapshot = max(glob.iglob(f"{CONF['crawl_dir']}/*.json"))
-    except ValueError as err:
-        logging.warning(err)
+    snapshot = latest_snapshot(CONF['crawl_dir'])
+    if snapshot is None:
+        logging.warning(f"No snapshot in {CONF['crawl_dir']}")
     return snapshot
 
 
@@ -348,9 +355,8 @@ def get_nodes(path):
     Returns all reachable nodes from a JSON file.
     """
     nodes = []
-    text = open(path, 'r').read()
     try:
-        nodes = json.loads(text)
+        nodes = load_snapshot(path)
     except ValueError as err:
         logging.warning(err)
     return nodes
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# ratelimit.py - Hierarchical token bucket rate limiter.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Hierarchical token bucket rate limiter.
+"""
+
+import time
+
+from utils import LruCache
+
+
+class TokenBucket(object):
+    """
+    Token bucket refilled at rate tokens per second up to burst tokens.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        elapsed = max(0.0, now - self.updated)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated = now
+
+    def wait(self):
+        """
+        Returns seconds until a token is available.
+        """
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RateLimiter(object):
+    """
+    Token buckets for a global budget and for each key at one or more named
+    levels, e.g. {'asn': 2, 'prefix': 1} for per-ASN and per-network limits.
+    A request is only allowed if every applicable bucket has a token, in
+    which case a token is taken from each of them.
+
+    Rates are in requests per second with bursts of up to one second's worth
+    (min. 1). A rate of 0 disables the global budget or a level. Buckets are
+    kept for the maxsize most recently used keys per level; an evicted
+    bucket would have been full anyway unless its key was used again within
+    a second or so.
+    """
+
+    def __init__(self, rate=0, levels=None, maxsize=100000):
+        self.rate = rate
+        self.levels = {level: level_rate
+                       for (level, level_rate) in (levels or {}).items()
+                       if level_rate > 0}
+        self.buckets = {level: LruCache(maxsize) for level in self.levels}
+        self.bucket = None
+        if rate > 0:
+            self.bucket = TokenBucket(rate, max(1, rate), time.monotonic())
+
+    @property
+    def enabled(self):
+        return self.bucket is not None or len(self.levels) > 0
+
+    def acquire(self, keys, now=None):
+        """
+        Takes a token for the specified {level: key} from every applicable
+        bucket. Levels without a key, e.g. ASN of an unknown address, are
+        not limited. Returns None if allowed or (level, seconds to wait) for
+        the first bucket without a token, with 'global' for the global
+        budget.
+        """
+        if now is None:
+            now = time.monotonic()
+
+        buckets = []
+        if self.bucket is not None:
+            buckets.append(('global', self.bucket))
+        for (level, rate) in self.levels.items():
+            key = keys.get(level)
+            if key is None:
+                continue
+            bucket = self.buckets[level].get(key)
+            if bucket is None:
+                bucket = TokenBucket(rate, max(1, rate), now)
+                self.buckets[level].put(key, bucket)
+            buckets.append((level, bucket))
+
+        for (level, bucket) in buckets:
+            bucket.refill(now)
+            if bucket.tokens < 1:
+                return (level, bucket.wait())
+        for (_, bucket) in buckets:
+            bucket.tokens -= 1
+        return None
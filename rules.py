@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# rules.py - Compact encoding for crawl exclusion rule sets.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Compact records for the rule sets shared by crawl.py master and slaves
+through Redis, i.e. included ASNs and excluded IPv4/IPv6 networks.
+
+A record is a format byte (RAW or ZLIB) followed by the, optionally
+zlib-compressed, body. The body holds the ASN numbers as 32-bit integers or
+one fixed-size entry per network: its address and prefix length. Entries
+are sorted so that equal rule sets have equal records.
+"""
+
+import ast
+import logging
+import struct
+import zlib
+
+RAW = b'\x01'
+ZLIB = b'\x02'
+
+ASN = struct.Struct('<I')
+MAX_ASN = 2 ** 32 - 1
+# Network address as 4 (IPv4) or 16 (IPv6) big-endian bytes and prefix length.
+NETWORK = {
+    32: struct.Struct('>4sB'),
+    128: struct.Struct('>16sB'),
+}
+
+
+def pack_record(body, compress):
+    if compress:
+        return ZLIB + zlib.compress(body)
+    return RAW + body
+
+
+def unpack_record(record):
+    """
+    Returns body of the specified record or None for a record stored as a
+    Python literal before records were packed.
+    """
+    kind = record[:1]
+    if kind == ZLIB:
+        return zlib.decompress(record[1:])
+    if kind == RAW:
+        return record[1:]
+    if kind in (b'{', b's'):
+        return None
+    raise ValueError(f'invalid rules record: {record[:16]!r}')
+
+
+def is_asn(asn):
+    """
+    Returns True if the specified string is a 32-bit ASN, e.g. AS13335.
+    """
+    number = asn[2:]
+    return (asn.startswith('AS') and number.isascii() and number.isdigit() and
+            int(number) <= MAX_ASN)
+
+
+def pack_asns(asns, compress=True):
+    """
+    Returns record for the specified set of ASNs, e.g. {'AS1', 'AS2'}.
+    Malformed ASNs are skipped with a warning.
+    """
+    numbers = []
+    for asn in asns:
+        if is_asn(asn):
+            numbers.append(int(asn[2:]))
+        else:
+            logging.warning(f'Invalid ASN: {asn!r}')
+    return pack_record(
+        b''.join(ASN.pack(number) for number in sorted(numbers)), compress)
+
+
+def unpack_asns(record):
+    """
+    Returns set of ASNs from the specified record.
+    """
+    body = unpack_record(record)
+    if body is None:
+        return ast.literal_eval(record.decode())
+    return set(f'AS{number}' for (number,) in ASN.iter_unpack(body))
+
+
+def pack_networks(networks, bits, compress=True):
+    """
+    Returns record for the specified set of (network address, netmask)
+    integer tuples of an address family with the given number of bits.
+    """
+    entry = NETWORK[bits]
+    hostmask = (1 << bits) - 1
+    body = b''.join(
+        entry.pack(network.to_bytes(bits // 8, 'big'),
+                   bits - (~netmask & hostmask).bit_length())
+        for (network, netmask) in sorted(networks))
+    return pack_record(body, compress)
+
+
+def unpack_networks(record, bits):
+    """
+    Returns set of (network address, netmask) integer tuples from the
+    specified record.
+    """
+    body = unpack_record(record)
+    if body is None:
+        return ast.literal_eval(record.decode())
+    hostmask = (1 << bits) - 1
+    return set(
+        (int.from_bytes(network, 'big'),
+         hostmask ^ ((1 << (bits - prefix)) - 1))
+        for (network, prefix) in NETWORK[bits].iter_unpack(body))
@@ -1,4 +1,6 @@
 from multiprocessing import Process
+import gevent
+import os
 import sys
 
 from crawl import main as crawl_main
@@ -51,6 +53,19 @@ def run_export():
     export_main([None, export_config_path, 'master'])
 
 
+# In-process storage is not shared across processes, so run all components
+# as greenlets of this process instead, see storage.py. Each still logs to its
+# own logfile, see configure_logger().
+if os.environ.get('STORAGE') == 'memory':
+    try:
+        gevent.joinall([gevent.spawn(run_crawl),
+                        gevent.spawn(run_ping),
+                        gevent.spawn(run_resolve),
+                        gevent.spawn(run_export)])
+    except KeyboardInterrupt:
+        pass
+    exit(0)
+
 try:
     crawl = Process(target=run_crawl)
     crawl.start()
@@ -0,0 +1,190 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from configparser import ConfigParser
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from simulator import Network  # noqa: E402
+from simulator import TOPOLOGIES  # noqa: E402
+from snapshot import get_manifest  # noqa: E402
+from snapshot import latest_snapshot  # noqa: E402
+from utils import new_redis_conn  # noqa: E402
+
+# Name of the fake DNS seeder, answered from the seed cache.
+SEEDER = 'seed.simulator.invalid'
+
+
+def redis_calls(redis_conn):
+    """
+    Returns number of calls per command processed by Redis since startup.
+    """
+    return {name[8:]: stats['calls']
+            for (name, stats) in redis_conn.info('commandstats').items()}
+
+
+# ---
+# Parse arguments
+# ---
+parser = argparse.ArgumentParser(
+    description='Benchmark a crawl by crawl.py of a simulated network of '
+                'peers listening on loopback addresses, see simulator.py')
+parser.add_argument('--nodes', '-n', type=int, default=1000,
+                    help='number of simulated peers')
+parser.add_argument('--addresses', type=int,
+                    help='number of loopback addresses to spread peers '
+                         'over, on consecutive ports (default: --nodes)')
+parser.add_argument('--degree', '-d', type=int, default=8,
+                    help='peers advertised by each peer')
+parser.add_argument('--topology', '-t', choices=TOPOLOGIES,
+                    default='random')
+parser.add_argument('--latency', type=float, default=0.0,
+                    help='seconds to delay each reply')
+parser.add_argument('--jitter', type=float, default=0.0,
+                    help='max. seconds added at random to --latency')
+parser.add_argument('--drop-rate', type=float, default=0.0,
+                    help='share of connections closed without a reply')
+parser.add_argument('--down-rate', type=float, default=0.0,
+                    help='share of peers not listening')
+parser.add_argument('--tarpit-rate', type=float, default=0.0,
+                    help='share of peers never replying')
+parser.add_argument('--seeds', type=int, default=10,
+                    help='number of peers returned by the DNS seeder')
+parser.add_argument('--conf', '-c',
+                    default=os.path.join(ROOT_DIR, 'conf', 'samples',
+                                         'crawl.regtest.conf'),
+                    help='crawl.py configuration to override')
+parser.add_argument('--set', '-s', action='append', default=[],
+                    metavar='OPTION=VALUE',
+                    help='override a crawl.py option, e.g. workers=100')
+parser.add_argument('--processes', '-p', type=int, default=0,
+                    help='number of slave processes')
+parser.add_argument('--redis-db', type=int, default=15,
+                    help='Redis database for crawl.py (flushed!)')
+parser.add_argument('--timeout', type=float, default=600,
+                    help='max. seconds to wait for the crawl to complete')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+# A listening socket per peer and a connection per crawl.py worker.
+(soft, hard) = resource.getrlimit(resource.RLIMIT_NOFILE)
+if soft < hard:
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# ---
+# Configuration
+# ---
+tmp_dir = tempfile.mkdtemp(prefix='bench-crawl-')
+conf = ConfigParser(inline_comment_prefixes='#')
+conf.read(args.conf)
+port = conf.getint('crawl', 'port')
+
+net = Network(args.nodes, port=port, addresses=args.addresses,
+              degree=args.degree, topology=args.topology,
+              latency=args.latency, jitter=args.jitter,
+              drop_rate=args.drop_rate, down_rate=args.down_rate,
+              tarpit_rate=args.tarpit_rate, seed=args.seed,
+              magic_number=conf.get('crawl', 'magic_number'))
+seeds = net.seeds(args.seeds)
+(discovered, reachable) = net.reachable(seeds)
+
+seed_cache = os.path.join(tmp_dir, 'seeds.json')
+with open(seed_cache, 'w') as f:
+    json.dump({SEEDER: seeds}, f)
+
+conf.read_dict({'crawl': {
+    'logfile': os.path.join(tmp_dir, 'crawl.log'),
+    'log_to_console': 'False',
+    'debug': 'False',
+    'db': str(args.redis_db),
+    'seeders': SEEDER,
+    'seed_timeout': '1',
+    'seed_cache': seed_cache,
+    'exclude_private': 'False',
+    'warm_start': 'False',
+    'rolling': 'False',
+    'metrics_port': '0',
+    'crawl_dir': os.path.join(tmp_dir, 'crawl'),
+}})
+for option in args.set:
+    (name, value) = option.split('=', 1)
+    conf.set('crawl', name.strip(), value.strip())
+conf_path = os.path.join(tmp_dir, 'crawl.conf')
+with open(conf_path, 'w') as f:
+    conf.write(f)
+
+
+# ---
+# Crawl
+# ---
+redis_conn = new_redis_conn(db=args.redis_db)
+redis_conn.flushdb()
+before = redis_calls(redis_conn)
+
+net.start()
+command = [sys.executable, os.path.join(ROOT_DIR, 'crawl.py'), conf_path,
+           'master']
+if args.processes > 0:
+    command.extend(['--processes', str(args.processes)])
+start = time.perf_counter()
+crawler = subprocess.Popen(command, cwd=ROOT_DIR, stdout=subprocess.DEVNULL)
+
+polls = 0
+elapsed = None
+try:
+    while time.perf_counter() - start < args.timeout:
+        if crawler.poll() is not None:
+            sys.exit(f'crawl.py exited with {crawler.returncode}, '
+                     f"see {conf.get('crawl', 'logfile')}")
+        polls += 1
+        if redis_conn.exists('crawl:first_snapshot'):
+            elapsed = time.perf_counter() - start
+            break
+        time.sleep(0.1)
+finally:
+    after = redis_calls(redis_conn)
+    crawler.send_signal(signal.SIGINT)
+    crawler.wait()
+    net.stop()
+
+if elapsed is None:
+    sys.exit(f'Crawl did not complete in {args.timeout:.0f}s, '
+             f"see {conf.get('crawl', 'logfile')}")
+
+path = latest_snapshot(conf.get('crawl', 'crawl_dir'))
+manifest = get_manifest(path) or {}
+crawled = manifest.get('coverage', {}).get('crawled', 0)
+shutil.rmtree(tmp_dir)
+
+# Calls by this script: one EXISTS per poll and INFO before and after.
+calls = {command: count - before.get(command, 0)
+         for (command, count) in after.items()}
+calls['exists'] = calls.get('exists', 0) - polls
+calls['info'] = calls.get('info', 0) - 2
+ops = sum(calls.values())
+
+
+# ---
+# Print
+# ---
+print(f'Network: {args.nodes} peers ({args.topology}, degree '
+      f'{args.degree}), {len(discovered)} discoverable and '
+      f'{len(reachable)} reachable from {len(seeds)} seeds')
+print(f"Reachable: {manifest.get('rows', 0)} of {len(reachable)}")
+print(f'Crawled: {crawled} nodes ({net.stats["connections"]} connections, '
+      f'{net.stats["dropped"]} dropped)')
+print(f'Time to complete: {elapsed:.1f} s')
+print(f'Nodes/s: {crawled / elapsed:,.1f}')
+print(f'Redis ops: {ops:,} ({ops / max(crawled, 1):,.1f} per node)')
+for (command, count) in sorted(calls.items(), key=lambda item: -item[1])[:8]:
+    if count > 0:
+        print(f'  {command}: {count:,}')
@@ -0,0 +1,78 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from networks import NetworkIndex  # noqa: E402
+
+
+# ---
+# Parse arguments
+# ---
+parser = argparse.ArgumentParser(
+    description='Benchmark excluded network lookups used by crawl.py')
+parser.add_argument('--addresses', '-a', type=int, default=1000000,
+                    help='number of synthetic IPv4 addresses to check')
+parser.add_argument('--networks', '-n', type=int, default=5000,
+                    help='number of synthetic excluded IPv4 networks')
+parser.add_argument('--linear-sample', '-l', type=int, default=10000,
+                    help='addresses to check with the linear scan '
+                         '(extrapolated to --addresses)')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+
+# ---
+# Synthetic data, sized like fullbogons-ipv4 + DROP/EDROP lists
+# ---
+networks = set()
+while len(networks) < args.networks:
+    prefix = random.randint(8, 32)
+    netmask = ((1 << prefix) - 1) << (32 - prefix)
+    networks.add((random.getrandbits(32) & netmask, netmask))
+
+addresses = [random.getrandbits(32) for _ in range(args.addresses)]
+
+
+# ---
+# Linear scan (previous crawl.is_excluded)
+# ---
+sample = addresses[:args.linear_sample]
+start = time.perf_counter()
+linear = [any([(addr & net[1] == net[0]) for net in networks])
+          for addr in sample]
+linear_elapsed = time.perf_counter() - start
+linear_rate = len(sample) / linear_elapsed
+
+
+# ---
+# Compiled index
+# ---
+start = time.perf_counter()
+index = NetworkIndex(networks, bits=32)
+build_elapsed = time.perf_counter() - start
+
+start = time.perf_counter()
+indexed = [addr in index for addr in addresses]
+index_elapsed = time.perf_counter() - start
+index_rate = len(addresses) / index_elapsed
+
+assert indexed[:len(sample)] == linear, 'index disagrees with linear scan'
+
+
+# ---
+# Print
+# ---
+print(f'Networks: {len(networks)} ({len(index.starts)} merged intervals)')
+print(f'Addresses: {len(addresses)} ({sum(indexed)} excluded)')
+print(f'Index build: {build_elapsed * 1000:.1f} ms')
+print(f'Linear scan: {linear_rate:,.0f} lookups/s '
+      f'(est. {len(addresses) / linear_rate:.1f} s for all addresses)')
+print(f'Index: {index_rate:,.0f} lookups/s ({index_elapsed:.2f} s)')
+print(f'Speedup: {index_rate / linear_rate:,.0f}x')
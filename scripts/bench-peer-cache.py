@@ -0,0 +1,115 @@
+import argparse
+import os
+import random
+import socket
+import sys
+import time
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from peercache import pack_peers  # noqa: E402
+from peercache import unpack_peers  # noqa: E402
+
+
+def redis_memory(redis_conn, records):
+    """
+    Returns bytes used by Redis for the records stored under temporary keys.
+    """
+    keys = [f'bench:peer:{i}' for i in range(len(records))]
+    redis_pipe = redis_conn.pipeline(transaction=False)
+    for (key, record) in zip(keys, records):
+        redis_pipe.set(key, record)
+    redis_pipe.execute()
+    for key in keys:
+        redis_pipe.memory_usage(key, samples=0)
+    usage = sum(redis_pipe.execute())
+    redis_conn.delete(*keys)
+    return usage
+
+
+# ---
+# Parse arguments
+# ---
+parser = argparse.ArgumentParser(
+    description='Benchmark peer cache records used by crawl.py')
+parser.add_argument('--nodes', '-n', type=int, default=10000,
+                    help='number of cached addr responses')
+parser.add_argument('--peers', '-p', type=int, default=500,
+                    help='peers per addr response')
+parser.add_argument('--ipv6', type=float, default=0.2,
+                    help='share of IPv6 peers')
+parser.add_argument('--redis-db', type=int,
+                    help='also report Redis memory usage in this database')
+parser.add_argument('--seed', type=int, default=1)
+args = parser.parse_args()
+
+random.seed(args.seed)
+
+
+# ---
+# Synthetic addr responses
+# ---
+now = int(time.time())
+responses = []
+for _ in range(args.nodes):
+    peers = []
+    for _ in range(args.peers):
+        if random.random() < args.ipv6:
+            address = socket.inet_ntop(socket.AF_INET6, bytes.fromhex(
+                '20010db8') + random.getrandbits(96).to_bytes(12, 'big'))
+        else:
+            address = '.'.join(str(random.randint(1, 254)) for _ in range(4))
+        peers.append((address, random.choice([12038, 44806]),
+                      random.choice([0, 1, 3]),
+                      now - random.randint(0, 86400)))
+    responses.append(peers)
+
+
+# ---
+# Encode and decode
+# ---
+formats = {
+    'str': (str, lambda record: eval(record)),
+    'packed': (lambda peers: pack_peers(peers, compress=False),
+               unpack_peers),
+    'packed+zlib': (pack_peers, unpack_peers),
+}
+results = {}
+for (name, (encode, decode)) in formats.items():
+    start = time.perf_counter()
+    records = [encode(peers) for peers in responses]
+    encode_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    decoded = [decode(record) for record in records]
+    decode_elapsed = time.perf_counter() - start
+    assert decoded == responses, f'{name} does not round trip'
+
+    results[name] = {
+        'bytes': sum(len(record) for record in records),
+        'encode': encode_elapsed,
+        'decode': decode_elapsed,
+    }
+    if args.redis_db is not None:
+        from utils import new_redis_conn
+        results[name]['redis'] = redis_memory(
+            new_redis_conn(db=args.redis_db), records)
+
+
+# ---
+# Print
+# ---
+print(f'Nodes: {args.nodes}, peers per node: {args.peers}')
+for (name, result) in results.items():
+    line = (f"{name}: {result['bytes'] / 1e6:.1f} MB, "
+            f"encode {result['encode'] / args.nodes * 1e6:.0f} us/node, "
+            f"decode {result['decode'] / args.nodes * 1e6:.0f} us/node")
+    if 'redis' in result:
+        line += f", Redis {result['redis'] / 1e6:.1f} MB"
+    print(line)
+base = results['str']
+for name in ('packed', 'packed+zlib'):
+    print(f"{name} vs. str: {base['bytes'] / results[name]['bytes']:.1f}x "
+          f"smaller, {base['decode'] / results[name]['decode']:.1f}x "
+          f'faster decode')
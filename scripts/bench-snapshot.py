@@ -0,0 +1,148 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+ROOT_DIR = os.path.realpath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT_DIR)
+
+from columns import columns_path  # noqa: E402
+from columns import load_columns  # noqa: E402
+from export import FIELDS  # noqa: E402
+from snapshot import load_snapshot  # noqa: E402
+from snapshot import write_snapshot  # noqa: E402
+
+
+def get_rss():
+    """
+    Returns resident set size of this process in bytes.
+    """
+    pages = int(open('/proc/self/statm').read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def load(reader, path):
+    """
+    Loads user agent and height counts from the snapshot at the specified
+    path the way a consumer needing two columns would.
+    """
+    rss = get_rss()
+    start = time.perf_counter()
+    if reader == 'json':
+        rows = load_snapshot(path)
+        heights = Counter(row[5] for row in rows)
+        agents = Counter(row[2] for row in rows)
+    else:
+        columns = load_columns(columns_path(path), ['height', 'user_agent'])
+        (values, counts) = np.unique(
+            columns['height'], return_counts=True)
+        heights = Counter(dict(zip(values.tolist(), counts.tolist())))
+        agent = columns['user_agent']
+        (codes, counts) = np.unique(agent.codes, return_counts=True)
+        agents = Counter({agent.lookup(code): count for (code, count) in
+                          zip(codes.tolist(), counts.tolist())})
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        'elapsed': elapsed,
+        'rss': get_rss() - rss,
+        'height': heights.most_common(1)[0][0],
+        'agents': len(agents),
+    }))
+
+
+# ---
+# Parse arguments
+# ---
+parser = argparse.ArgumentParser(
+    description='Benchmark JSON snapshot vs. columnar sidecar loading')
+parser.add_argument('--rows', '-r', type=int, default=50000,
+                    help='number of synthetic rows in the snapshot')
+parser.add_argument('--seed', type=int, default=1)
+parser.add_argument('--load', nargs=2, metavar=('READER', 'PATH'),
+                    help=argparse.SUPPRESS)  # Child process mode.
+args = parser.parse_args()
+
+if args.load:
+    load(*args.load)
+    sys.exit(0)
+
+random.seed(args.seed)
+
+
+# ---
+# Synthetic snapshot, shaped like export.py rows
+# ---
+agents = [f'/hsd:{random.randint(2, 6)}.{random.randint(0, 9)}.0/'
+          for _ in range(50)]
+orgs = [(f'AS{random.randint(1, 400000)}', f'Org {i}') for i in range(2000)]
+cities = [(f'City {i}', f'C{i % 200}', 'Etc/UTC') for i in range(5000)]
+now = int(time.time())
+
+rows = []
+for i in range(args.rows):
+    address = '.'.join(str(random.randint(1, 254)) for _ in range(4))
+    (city, country, timezone) = random.choice(cities)
+    (asn, org) = random.choice(orgs)
+    rows.append([
+        address,
+        12038,
+        random.choice(agents),
+        now - random.randint(0, 86400 * 30),
+        random.choice([0, 1, 3]),
+        140000 + random.randint(-2, 0),
+        f'host-{i}.example.com' if random.random() < 0.5 else None,
+        city,
+        country,
+        round(random.uniform(-90, 90), 4),
+        round(random.uniform(-180, 180), 4),
+        timezone,
+        asn,
+        org,
+    ])
+
+directory = tempfile.mkdtemp()
+path = os.path.join(directory, f'{now}.json')
+start = time.perf_counter()
+write_snapshot(path, rows, fields=FIELDS)
+write_elapsed = time.perf_counter() - start
+del rows
+
+json_size = os.path.getsize(path)
+sidecar = columns_path(path)
+columns_size = sum(os.path.getsize(os.path.join(sidecar, name))
+                   for name in os.listdir(sidecar))
+
+
+# ---
+# Load in separate processes to measure RSS
+# ---
+results = {}
+for reader in ('json', 'columns'):
+    output = subprocess.check_output(
+        [sys.executable, __file__, '--load', reader, path])
+    results[reader] = json.loads(output.decode().strip().splitlines()[-1])
+
+assert results['json']['height'] == results['columns']['height']
+assert results['json']['agents'] == results['columns']['agents']
+
+
+# ---
+# Print
+# ---
+print(f'Rows: {args.rows}')
+print(f'Write (JSON + sidecar): {write_elapsed:.2f} s')
+print(f'Size: JSON {json_size / 1e6:.1f} MB, '
+      f'sidecar {columns_size / 1e6:.1f} MB')
+for reader in ('json', 'columns'):
+    result = results[reader]
+    print(f"Load {reader}: {result['elapsed'] * 1000:.1f} ms, "
+          f"RSS +{result['rss'] / 1e6:.1f} MB")
+speedup = results['json']['elapsed'] / results['columns']['elapsed']
+print(f'Speedup: {speedup:.0f}x')
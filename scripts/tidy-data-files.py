@@ -98,13 +98,27 @@ def process_dir(dir: pathlib.Path):
                 try:
                     if tar.getmember(filename):
                         if options['DELETE_ARCHIVED_FILES']:
-                            os.remove(file_path)
+                            remove_data_file(file_path)
                         continue
                 except KeyError:
                     pass  # does not exist
                 tar.add(file_path, filename, recursive=False)
                 if options['DELETE_ARCHIVED_FILES']:
-                    os.remove(file_path)
+                    remove_data_file(file_path)
+
+
+def remove_data_file(file_path: str):
+    os.remove(file_path)
+    # Manifest, columnar sidecar and peer graph written alongside the file
+    manifest_path = f'{file_path}.manifest'
+    if os.path.isfile(manifest_path):
+        os.remove(manifest_path)
+    columns_path = f'{file_path[:-5]}.columns'
+    if os.path.isdir(columns_path):
+        shutil.rmtree(columns_path)
+    graph_path = f'{file_path[:-5]}.graph.npz'
+    if os.path.isfile(graph_path):
+        os.remove(graph_path)
 
 
 def gzip_old_tars(dir: pathlib.Path):
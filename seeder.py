@@ -28,8 +28,6 @@
 Exports reachable nodes into DNS zone files for DNS seeder.
 """
 
-import glob
-import json
 import logging
 import operator
 import os
@@ -39,6 +37,11 @@ import time
 from collections import defaultdict
 from configparser import ConfigParser
 
+from address import Address
+from address import IPV6
+from address import ONION
+from snapshot import latest_snapshot
+from snapshot import load_snapshot
 from utils import new_redis_conn
 
 CONF = {}
@@ -64,9 +67,9 @@ class Seeder(object):
         self.now = int(time.time())
         if dump != self.dump:
             try:
-                self.nodes = json.loads(open(dump, 'r').read())
-            except ValueError:
-                logging.warning('Write pending')
+                self.nodes = load_snapshot(dump)
+            except ValueError as err:
+                logging.warning(err)
                 return
             if len(self.nodes) == 0:
                 logging.warning(f'len(self.nodes): {len(self.nodes)}')
@@ -129,9 +132,14 @@ class Seeder(object):
         aaaa_records = []
         txt_records = []
         for address in addresses:
-            if address.endswith('.onion'):
+            try:
+                family = Address.parse(address).family
+            except ValueError as err:
+                logging.warning(err)
+                continue
+            if family == ONION:
                 txt_records.append(f'@\tIN\tTXT\t{address}')
-            elif ':' in address:
+            elif family == IPV6:
                 aaaa_records.append(f'@\tIN\tAAAA\t{address}')
             else:
                 a_records.append(f'@\tIN\tA\t{address}')
@@ -210,10 +218,9 @@ def cron():
     seeder = Seeder(redis_conn=redis_conn)
     while True:
         time.sleep(5)
-        try:
-            dump = max(glob.iglob(f"{CONF['export_dir']}/*.json"))
-        except ValueError as err:
-            logging.warning(err)
+        dump = latest_snapshot(CONF['export_dir'])
+        if dump is None:
+            logging.warning(f"No snapshot in {CONF['export_dir']}")
             continue
         logging.info(f'Dump: {dump}')
         seeder.export_nodes(dump)
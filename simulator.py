@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# simulator.py - Loopback Handshake network for crawl benchmarks.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Simulated Handshake network of peers listening on loopback addresses, e.g.
+127.1.0.1 to 127.1.3.232, speaking just enough of the protocol for crawl.py:
+version/verack, getaddr/addr and ping/pong.
+
+Linux routes all of 127.0.0.0/8 to the loopback interface so peers can
+listen on distinct addresses without any configuration. Elsewhere, spread
+them over distinct ports on fewer addresses instead, e.g. addresses=1.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+import logging
+import random
+import socket
+import time
+from collections import Counter
+from functools import partial
+from gevent.server import StreamServer
+
+from protocol import HeaderTooShortError
+from protocol import PayloadTooShortError
+from protocol import ProtocolError
+from protocol import SOCKET_BUFSIZE
+from protocol import Serializer
+from protocol import TO_SERVICES
+
+# Peer states.
+UP = 'up'  # Completes handshakes and answers getaddr.
+DOWN = 'down'  # Advertised by other peers but not listening.
+TARPIT = 'tarpit'  # Accepts connections and never replies.
+
+TOPOLOGIES = ('random', 'ring', 'scale-free')
+
+USER_AGENT = '/hnsnodes-simulator:0.1/'
+
+# Max. addresses per addr message.
+MAX_ADDR = 1000
+
+
+def build_topology(size, degree, topology, rng):
+    """
+    Returns list of peer indexes advertised by each of the size peers:
+    random: degree peers picked at random
+    ring: the next degree peers, i.e. a crawl as deep as size / degree
+    scale-free: preferential attachment, i.e. a few well-connected hubs
+    """
+    degree = min(degree, size - 1)
+    if topology == 'random':
+        peers = []
+        for index in range(size):
+            sample = rng.sample(range(size - 1), degree)
+            peers.append([i + (i >= index) for i in sample])
+        return peers
+    if topology == 'ring':
+        return [[(index + i) % size for i in range(1, degree + 1)]
+                for index in range(size)]
+    if topology == 'scale-free':
+        peers = [set() for _ in range(size)]
+        # Peer indexes repeated once per edge so that rng.choice() picks
+        # peers in proportion to their degree.
+        ends = list(range(min(degree + 1, size)))
+        for index in ends:
+            peers[index].update(i for i in ends if i != index)
+        ends = ends * degree
+        for index in range(degree + 1, size):
+            targets = set()
+            while len(targets) < degree:
+                targets.add(rng.choice(ends))
+            for target in targets:
+                peers[index].add(target)
+                peers[target].add(index)
+                ends.extend((index, target))
+        return [sorted(p) for p in peers]
+    raise ValueError(f'unknown topology: {topology}')
+
+
+class Network(object):
+    """
+    Simulated network of size peers. Peers are assigned loopback addresses
+    counting up from base_address, wrapping around to the next port after
+    the given number of addresses.
+
+    Each peer is DOWN with probability down_rate, else a TARPIT with
+    probability tarpit_rate, else UP. An UP peer closes an incoming
+    connection without a reply with probability drop_rate and delays each
+    reply by latency plus up to jitter seconds.
+    """
+
+    def __init__(self, size, port=14038, addresses=None,
+                 base_address='127.1.0.1', degree=8, topology='random',
+                 latency=0.0, jitter=0.0, drop_rate=0.0, down_rate=0.0,
+                 tarpit_rate=0.0, seed=None, **conf):
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        # Serializer options, e.g. magic_number, user_agent and height.
+        self.conf = dict(
+            {'from_services': TO_SERVICES, 'user_agent': USER_AGENT}, **conf)
+
+        if addresses is None:
+            addresses = size
+        base = int.from_bytes(
+            socket.inet_pton(socket.AF_INET, base_address), 'big')
+        self.nodes = []
+        for index in range(size):
+            packed = (base + index % addresses).to_bytes(4, 'big')
+            self.nodes.append((socket.inet_ntop(socket.AF_INET, packed),
+                               port + index // addresses))
+
+        self.states = []
+        for _ in range(size):
+            if self.rng.random() < down_rate:
+                self.states.append(DOWN)
+            elif self.rng.random() < tarpit_rate:
+                self.states.append(TARPIT)
+            else:
+                self.states.append(UP)
+
+        self.peers = build_topology(size, degree, topology, self.rng)
+        self.servers = []
+        self.stats = Counter()
+        self.handshaked = set()
+
+    def start(self):
+        """
+        Starts listening on the addresses of all peers not DOWN.
+        """
+        for (index, node) in enumerate(self.nodes):
+            if self.states[index] == DOWN:
+                continue
+            server = StreamServer(node, partial(self.handle, index))
+            server.start()
+            self.servers.append(server)
+        logging.info(f'Listening: {len(self.servers)} peers')
+
+    def stop(self):
+        for server in self.servers:
+            server.stop(timeout=0)
+        self.servers = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def seeds(self, count):
+        """
+        Returns addresses of up to count UP peers listening on the first
+        port, i.e. as returned by a DNS seeder.
+        """
+        port = self.nodes[0][1]
+        return [address for (index, (address, node_port))
+                in enumerate(self.nodes)
+                if node_port == port and self.states[index] == UP][:count]
+
+    def reachable(self, seeds):
+        """
+        Returns (discovered, reachable) sets of peer indexes that a crawl
+        starting from the specified seed addresses would discover and
+        complete a handshake with, barring connections dropped with
+        drop_rate.
+        """
+        port = self.nodes[0][1]
+        index = {node: i for (i, node) in enumerate(self.nodes)}
+        queue = [index[(address, port)] for address in seeds]
+        discovered = set(queue)
+        reachable = set()
+        while queue:
+            i = queue.pop()
+            if self.states[i] != UP:
+                continue
+            reachable.add(i)
+            for peer in self.peers[i]:
+                if peer not in discovered:
+                    discovered.add(peer)
+                    queue.append(peer)
+        return (discovered, reachable)
+
+    def handle(self, index, sock, address):
+        """
+        Serves a connection to the peer at index until it is closed.
+        """
+        self.stats['connections'] += 1
+        if self.states[index] == UP and self.rng.random() < self.drop_rate:
+            self.stats['dropped'] += 1
+            sock.close()
+            return
+
+        serializer = Serializer(**self.conf)
+        data = b''
+        try:
+            while True:
+                chunk = sock.recv(SOCKET_BUFSIZE)
+                if not chunk:
+                    break
+                if self.states[index] == TARPIT:
+                    continue
+                data += chunk
+                while data:
+                    try:
+                        (msg, data) = serializer.deserialize_msg(data)
+                    except (HeaderTooShortError, PayloadTooShortError):
+                        break
+                    self.reply(index, sock, address, serializer, msg)
+        except (ProtocolError, socket.error) as err:
+            logging.debug(f'{self.nodes[index]}: {err}')
+        finally:
+            sock.close()
+
+    def reply(self, index, sock, address, serializer, msg):
+        """
+        Replies to the specified message received by the peer at index.
+        """
+        command = msg['command']
+        self.stats[command.decode()] += 1
+        if self.latency or self.jitter:
+            gevent.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+        if command == b'version':
+            self.handshaked.add(index)
+            sock.sendall(b''.join([
+                serializer.serialize_msg(
+                    command=b'version', to_addr=address,
+                    from_addr=self.nodes[index]),
+                serializer.serialize_msg(command=b'verack'),
+            ]))
+        elif command == b'getaddr':
+            now = int(time.time())
+            addr_list = [
+                (now - self.rng.randint(0, 3600), TO_SERVICES) +
+                self.nodes[peer]
+                for peer in self.peers[index]]
+            sock.sendall(b''.join(
+                serializer.serialize_msg(
+                    command=b'addr', addr_list=addr_list[i:i + MAX_ADDR])
+                for i in range(0, len(addr_list), MAX_ADDR)))
+        elif command == b'ping':
+            sock.sendall(serializer.serialize_msg(
+                command=b'pong', nonce=msg['nonce']))
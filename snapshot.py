@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# snapshot.py - Atomic JSON snapshot writer and reader.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Atomic JSON snapshot writer and reader shared by crawl.py, export.py, ping.py
+and seeder.py.
+
+Rows are streamed into a temporary file in the same directory as the
+snapshot, fsync'd and renamed into place, followed by a manifest with the row
+count and SHA-256 checksum of the snapshot, e.g. 1663113591.json and
+1663113591.json.manifest. If fields are specified, a columnar sidecar (see
+columns.py) is written before the manifest, e.g. 1663113591.columns.
+"""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from columns import ColumnWriter
+from columns import columns_path
+
+MANIFEST_SUFFIX = '.manifest'
+
+# Temporary files from mkstemp() are only readable by owner.
+FILE_MODE = 0o644
+
+
+class SnapshotWriter(object):
+    """
+    Streams rows into a JSON array file that only appears at its final path
+    once all rows are written, so readers never see partial data. Used as a
+    context manager, the snapshot is committed on exit or discarded if an
+    exception is raised.
+
+    Without fields, memory use does not grow with the number of rows. If
+    fields are specified, rows are also accumulated in memory per field for
+    the columnar sidecar, i.e. one value per field and row plus one entry
+    per distinct string, which is more compact than the rows themselves but
+    still grows with their number. Entries in info, e.g. crawl coverage, are
+    added into the manifest.
+    """
+
+    def __init__(self, path, fields=None, info=None):
+        self.path = path
+        self.columns = ColumnWriter(fields) if fields else None
+        self.info = info or {}
+        (fd, self.tmp_path) = mkstemp(path)
+        self.file = os.fdopen(fd, 'w')
+        self.sha256 = hashlib.sha256()
+        self.rows = 0
+        self.size = 0
+        self._write('[')
+
+    def _write(self, text):
+        data = text.encode()
+        self.sha256.update(data)
+        self.size += len(data)
+        self.file.write(text)
+
+    def write(self, row):
+        """
+        Appends a row into the snapshot.
+        """
+        if self.rows > 0:
+            self._write(', ')
+        self._write(json.dumps(row))
+        if self.columns is not None:
+            self.columns.append(row)
+        self.rows += 1
+
+    def commit(self):
+        """
+        Flushes the snapshot to disk, renames it to its final path and writes
+        its sidecar, if any, and manifest.
+        """
+        self._write(']')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+        manifest = {
+            'rows': self.rows,
+            'bytes': self.size,
+            'sha256': self.sha256.hexdigest(),
+        }
+        if self.columns is not None:
+            path = columns_path(self.path)
+            self.columns.save(path)
+            manifest['columns'] = os.path.basename(path)
+        manifest.update(self.info)
+        write_atomic(self.path + MANIFEST_SUFFIX, json.dumps(manifest))
+        fsync_dir(os.path.dirname(self.path) or '.')
+
+    def abort(self):
+        """
+        Discards the partially written snapshot.
+        """
+        self.file.close()
+        try:
+            os.remove(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+
+def mkstemp(path):
+    """
+    Returns (fd, path) of a new hidden temporary file next to the specified
+    path, readable like files created with open().
+    """
+    (fd, tmp_path) = tempfile.mkstemp(
+        dir=os.path.dirname(path) or '.',
+        prefix=f'.{os.path.basename(path)}.',
+        suffix='.tmp')
+    os.chmod(tmp_path, FILE_MODE)
+    return (fd, tmp_path)
+
+
+def write_atomic(path, text):
+    """
+    Writes text into the specified path via a fsync'd temporary file.
+    """
+    (fd, tmp_path) = mkstemp(path)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def fsync_dir(path):
+    """
+    Persists renames in the specified directory.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_snapshot(path, rows, fields=None):
+    """
+    Writes rows into a snapshot at the specified path.
+    Returns the number of rows written.
+    """
+    with SnapshotWriter(path, fields=fields) as writer:
+        for row in rows:
+            writer.write(row)
+    return writer.rows
+
+
+def get_manifest(path):
+    """
+    Returns manifest for the specified snapshot or None if it has none.
+    """
+    try:
+        text = open(path + MANIFEST_SUFFIX, 'r').read()
+    except FileNotFoundError:
+        return None
+    return json.loads(text)
+
+
+def latest_snapshot(directory):
+    """
+    Returns path to the latest committed snapshot in the specified directory
+    or None if there is none. Snapshots without a manifest, i.e. written
+    before manifests were introduced, are only considered if no snapshot in
+    the directory has a manifest.
+    """
+    paths = sorted(glob.iglob(os.path.join(directory, '*.json')),
+                   reverse=True)
+    for path in paths:
+        if os.path.exists(path + MANIFEST_SUFFIX):
+            return path
+    if paths:
+        return paths[0]
+    return None
+
+
+def load_snapshot(path):
+    """
+    Returns rows from the specified snapshot. Raises ValueError if the
+    snapshot does not match its manifest or is not valid JSON.
+    """
+    data = open(path, 'rb').read()
+    manifest = get_manifest(path)
+    if manifest is None:
+        logging.debug(f'{path} has no manifest')
+        return json.loads(data)
+
+    if len(data) != manifest['bytes']:
+        raise ValueError(f"{path}: expected {manifest['bytes']} bytes, "
+                         f'got {len(data)}')
+    if hashlib.sha256(data).hexdigest() != manifest['sha256']:
+        raise ValueError(f'{path}: checksum mismatch')
+    rows = json.loads(data)
+    if len(rows) != manifest['rows']:
+        raise ValueError(f"{path}: expected {manifest['rows']} rows, "
+                         f'got {len(rows)}')
+    return rows
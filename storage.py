@@ -0,0 +1,734 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# storage.py - Redis and in-process storage backends.
+#
+# Copyright (c) Addy Yeow <ayeowch@gmail.com>
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+
+"""
+Storage backends for the keys, sets, sorted sets, hashes, lists, expiring
+keys, pubsub and pipelines used by crawl.py, ping.py, resolve.py and
+export.py through utils.new_redis_conn().
+
+The interface is the subset of the redis-py client used by these
+components, so the Redis backend is the client itself and MemoryStorage
+implements the same methods with the same return types (values, members
+and keys as bytes) on plain Python structures. MemoryStorage instances
+share their databases and channels within a process, e.g. run.py with
+STORAGE=memory, but not across processes.
+"""
+
+import fnmatch
+import heapq
+import time
+from bisect import bisect_left
+from bisect import bisect_right
+from bisect import insort
+from collections import deque
+
+import gevent.queue
+import redis
+
+BACKENDS = ('redis', 'memory')
+
+# Time source for key expiry.
+clock = time.time
+
+WRONGTYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+
+def new_storage(backend='redis', db=0, host='localhost', port=6379,
+                password=None):
+    """
+    Returns new connection to the specified storage backend and database.
+    """
+    if backend == 'redis':
+        return redis.StrictRedis(db=db, host=host, port=port,
+                                 password=password)
+    if backend == 'memory':
+        return MemoryStorage(db=db)
+    raise ValueError(f'unknown storage backend: {backend}')
+
+
+def encode(value):
+    """
+    Returns value as bytes, as encoded by redis-py.
+    """
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode()
+    if isinstance(value, bool):
+        raise redis.exceptions.DataError('invalid input of type bool')
+    if isinstance(value, float):
+        return repr(value).encode()
+    if isinstance(value, int):
+        return str(value).encode()
+    raise redis.exceptions.DataError(
+        f'invalid input of type {type(value).__name__}')
+
+
+def parse_bound(value):
+    """
+    Returns (score, exclusive) for a sorted set range bound, e.g. 5, '(5',
+    '-inf' or '+inf'.
+    """
+    if isinstance(value, (int, float)):
+        return (float(value), False)
+    value = value.decode() if isinstance(value, bytes) else value
+    if value.startswith('('):
+        return (float(value[1:]), True)
+    return (float(value), False)
+
+
+def parse_int(value):
+    try:
+        return int(value)
+    except ValueError:
+        raise redis.exceptions.ResponseError(
+            'value is not an integer or out of range')
+
+
+class Last(object):
+    """
+    Compares greater than any sorted set member.
+    """
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+LAST = Last()
+
+
+class SortedSet(object):
+    """
+    Members mapped to their scores and kept as (score, member) tuples in
+    score order, ties in member order as in Redis.
+    """
+    __slots__ = ('scores', 'items')
+
+    def __init__(self):
+        self.scores = {}
+        self.items = []
+
+    def add(self, member, score):
+        old = self.scores.get(member)
+        if old is not None:
+            if old == score:
+                return
+            del self.items[bisect_left(self.items, (old, member))]
+        self.scores[member] = score
+        insort(self.items, (score, member))
+
+    def remove(self, member):
+        score = self.scores.pop(member, None)
+        if score is None:
+            return False
+        del self.items[bisect_left(self.items, (score, member))]
+        return True
+
+    def span(self, min_score, max_score):
+        """
+        Returns (start, stop) indexes of the items within the score bounds.
+        """
+        (low, exclusive) = parse_bound(min_score)
+        if exclusive:
+            start = bisect_right(self.items, (low, LAST))
+        else:
+            start = bisect_left(self.items, (low,))
+        (high, exclusive) = parse_bound(max_score)
+        if exclusive:
+            stop = bisect_left(self.items, (high,))
+        else:
+            stop = bisect_right(self.items, (high, LAST))
+        return (start, max(start, stop))
+
+    def __len__(self):
+        return len(self.scores)
+
+
+class Database(object):
+    """
+    Keys of a database with their expiry times, kept in a heap to remove
+    expired keys that are never accessed again.
+    """
+
+    def __init__(self):
+        self.data = {}
+        self.expires = {}
+        self.heap = []
+
+
+class MemoryServer(object):
+    """
+    Databases and pubsub channels shared by MemoryStorage instances.
+    """
+
+    def __init__(self):
+        self.databases = {}
+        self.channels = {}
+
+    def database(self, db):
+        if db not in self.databases:
+            self.databases[db] = Database()
+        return self.databases[db]
+
+
+SERVER = MemoryServer()
+
+
+class MemoryStorage(object):
+    """
+    In-process storage with the redis-py client methods used by this
+    project. Commands run to completion without yielding to other
+    greenlets, so pipelines are applied atomically like MULTI/EXEC.
+    """
+
+    def __init__(self, db=0, server=None):
+        self.server = server if server is not None else SERVER
+        self.database = self.server.database(db)
+        self.data = self.database.data
+        self.expires = self.database.expires
+
+    def _sweep(self):
+        """
+        Removes keys whose expiry time has passed.
+        """
+        heap = self.database.heap
+        now = clock()
+        while heap and heap[0][0] <= now:
+            (deadline, key) = heapq.heappop(heap)
+            if self.expires.get(key) == deadline:
+                del self.expires[key]
+                del self.data[key]
+
+    def _get(self, name, kind):
+        """
+        Returns value of the specified type for key or None if the key does
+        not exist.
+        """
+        self._sweep()
+        value = self.data.get(encode(name))
+        if value is not None and not isinstance(value, kind):
+            raise redis.exceptions.ResponseError(WRONGTYPE)
+        return value
+
+    def _create(self, name, kind):
+        """
+        Returns value of the specified type for key, created if the key does
+        not exist.
+        """
+        value = self._get(name, kind)
+        if value is None:
+            value = self.data[encode(name)] = kind()
+        return value
+
+    def _put(self, name, value):
+        name = encode(name)
+        self.data[name] = value
+        self.expires.pop(name, None)
+
+    def _prune(self, name, value):
+        """
+        Removes key once its set, sorted set, hash or list is empty.
+        """
+        if value is not None and len(value) == 0:
+            self.delete(name)
+
+    # ---
+    # Connection
+    # ---
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return MemoryPipeline(self)
+
+    def pubsub(self, **kwargs):
+        return MemoryPubSub(self.server, **kwargs)
+
+    def publish(self, channel, message):
+        channel = encode(channel)
+        subscribers = self.server.channels.get(channel, ())
+        for subscriber in subscribers:
+            subscriber.messages.put({
+                'type': 'message',
+                'pattern': None,
+                'channel': channel,
+                'data': encode(message),
+            })
+        return len(subscribers)
+
+    def ping(self):
+        return True
+
+    def close(self):
+        pass
+
+    # ---
+    # Keys
+    # ---
+
+    def delete(self, *names):
+        self._sweep()
+        deleted = 0
+        for name in map(encode, names):
+            if self.data.pop(name, None) is not None:
+                deleted += 1
+            self.expires.pop(name, None)
+        return deleted
+
+    unlink = delete
+
+    def exists(self, *names):
+        self._sweep()
+        return sum(1 for name in names if encode(name) in self.data)
+
+    def expire(self, name, time):
+        self._sweep()
+        name = encode(name)
+        if name not in self.data:
+            return False
+        deadline = clock() + time
+        self.expires[name] = deadline
+        heapq.heappush(self.database.heap, (deadline, name))
+        return True
+
+    def ttl(self, name):
+        self._sweep()
+        name = encode(name)
+        if name not in self.data:
+            return -2
+        if name not in self.expires:
+            return -1
+        return round(self.expires[name] - clock())
+
+    def keys(self, pattern='*'):
+        self._sweep()
+        pattern = encode(pattern)
+        return [key for key in self.data if fnmatch.fnmatchcase(key, pattern)]
+
+    def scan(self, cursor=0, match=None, count=None):
+        """
+        Returns all keys matching the pattern in a single iteration.
+        """
+        return (0, self.keys(match or '*'))
+
+    def flushdb(self):
+        self.data.clear()
+        self.expires.clear()
+        del self.database.heap[:]
+        return True
+
+    # ---
+    # Strings
+    # ---
+
+    def get(self, name):
+        return self._get(name, bytes)
+
+    def mget(self, keys, *args):
+        keys = [keys] if isinstance(keys, (bytes, str)) else list(keys)
+        self._sweep()
+        values = []
+        for key in keys + list(args):
+            value = self.data.get(encode(key))
+            values.append(value if isinstance(value, bytes) else None)
+        return values
+
+    def set(self, name, value, ex=None, px=None, nx=False, xx=False):
+        self._sweep()
+        exists = encode(name) in self.data
+        if (nx and exists) or (xx and not exists):
+            return None
+        self._put(name, encode(value))
+        if ex is not None:
+            self.expire(name, ex)
+        elif px is not None:
+            self.expire(name, px / 1000)
+        return True
+
+    def setex(self, name, time, value):
+        return self.set(name, value, ex=time)
+
+    def incr(self, name, amount=1):
+        value = parse_int(self._get(name, bytes) or 0) + amount
+        name = encode(name)
+        self.data[name] = encode(value)
+        return value
+
+    incrby = incr
+
+    def decr(self, name, amount=1):
+        return self.incr(name, -amount)
+
+    # ---
+    # Hashes
+    # ---
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        fields = self._create(name, dict)
+        added = 0
+        for (key, value) in items.items():
+            key = encode(key)
+            added += key not in fields
+            fields[key] = encode(value)
+        return added
+
+    def hsetnx(self, name, key, value):
+        fields = self._create(name, dict)
+        key = encode(key)
+        if key in fields:
+            return 0
+        fields[key] = encode(value)
+        return 1
+
+    def hget(self, name, key):
+        return (self._get(name, dict) or {}).get(encode(key))
+
+    def hmget(self, name, keys, *args):
+        keys = [keys] if isinstance(keys, (bytes, str)) else list(keys)
+        fields = self._get(name, dict) or {}
+        return [fields.get(encode(key)) for key in keys + list(args)]
+
+    def hgetall(self, name):
+        return dict(self._get(name, dict) or {})
+
+    def hdel(self, name, *keys):
+        fields = self._get(name, dict)
+        if fields is None:
+            return 0
+        deleted = 0
+        for key in map(encode, keys):
+            if fields.pop(key, None) is not None:
+                deleted += 1
+        self._prune(name, fields)
+        return deleted
+
+    def hincrby(self, name, key, amount=1):
+        fields = self._create(name, dict)
+        key = encode(key)
+        value = parse_int(fields.get(key, 0)) + amount
+        fields[key] = encode(value)
+        return value
+
+    def hlen(self, name):
+        return len(self._get(name, dict) or {})
+
+    def hscan_iter(self, name, match=None, count=None):
+        pattern = encode(match or '*')
+        for (key, value) in list((self._get(name, dict) or {}).items()):
+            if fnmatch.fnmatchcase(key, pattern):
+                yield (key, value)
+
+    # ---
+    # Sets
+    # ---
+
+    def sadd(self, name, *values):
+        members = self._create(name, set)
+        size = len(members)
+        members.update(map(encode, values))
+        return len(members) - size
+
+    def srem(self, name, *values):
+        members = self._get(name, set)
+        if members is None:
+            return 0
+        size = len(members)
+        members.difference_update(map(encode, values))
+        self._prune(name, members)
+        return size - len(members)
+
+    def smembers(self, name):
+        return set(self._get(name, set) or ())
+
+    def scard(self, name):
+        return len(self._get(name, set) or ())
+
+    def sismember(self, name, value):
+        return encode(value) in (self._get(name, set) or ())
+
+    def spop(self, name, count=None):
+        members = self._get(name, set)
+        if count is None:
+            member = members.pop() if members else None
+            self._prune(name, members)
+            return member
+        popped = [members.pop() for _ in range(min(count, len(members)))] \
+            if members else []
+        self._prune(name, members)
+        return popped
+
+    # ---
+    # Sorted sets
+    # ---
+
+    def zadd(self, name, mapping, nx=False, xx=False, ch=False, gt=False,
+             lt=False):
+        zset = self._create(name, SortedSet)
+        added = 0
+        changed = 0
+        for (member, score) in mapping.items():
+            member = encode(member)
+            score = float(score)
+            old = zset.scores.get(member)
+            if old is None:
+                if xx:
+                    continue
+                added += 1
+            elif (nx or (gt and score <= old) or (lt and score >= old) or
+                    score == old):
+                continue
+            changed += 1
+            zset.add(member, score)
+        self._prune(name, zset)
+        return changed if ch else added
+
+    def zincrby(self, name, amount, value):
+        zset = self._create(name, SortedSet)
+        value = encode(value)
+        score = zset.scores.get(value, 0.0) + amount
+        zset.add(value, score)
+        return score
+
+    def zrem(self, name, *values):
+        zset = self._get(name, SortedSet)
+        if zset is None:
+            return 0
+        removed = sum(zset.remove(value) for value in map(encode, values))
+        self._prune(name, zset)
+        return removed
+
+    def zcard(self, name):
+        return len(self._get(name, SortedSet) or ())
+
+    def zscore(self, name, value):
+        zset = self._get(name, SortedSet)
+        return zset.scores.get(encode(value)) if zset is not None else None
+
+    def zcount(self, name, min, max):
+        zset = self._get(name, SortedSet)
+        if zset is None:
+            return 0
+        (start, stop) = zset.span(min, max)
+        return stop - start
+
+    def zrange(self, name, start, end, desc=False, withscores=False,
+               score_cast_func=float):
+        zset = self._get(name, SortedSet)
+        if zset is None:
+            return []
+        items = zset.items[::-1] if desc else zset.items
+        size = len(items)
+        start = max(start + size if start < 0 else start, 0)
+        end = end + size if end < 0 else end
+        return format_items(items[start:end + 1], withscores,
+                            score_cast_func)
+
+    def zrangebyscore(self, name, min, max, start=None, num=None,
+                      withscores=False, score_cast_func=float):
+        zset = self._get(name, SortedSet)
+        if zset is None:
+            return []
+        (first, stop) = zset.span(min, max)
+        items = zset.items[first:stop]
+        if start is not None and num is not None:
+            items = items[start:start + num if num >= 0 else None]
+        return format_items(items, withscores, score_cast_func)
+
+    def zremrangebyscore(self, name, min, max):
+        zset = self._get(name, SortedSet)
+        if zset is None:
+            return 0
+        (start, stop) = zset.span(min, max)
+        for (_, member) in zset.items[start:stop]:
+            del zset.scores[member]
+        del zset.items[start:stop]
+        self._prune(name, zset)
+        return stop - start
+
+    def zpopmax(self, name, count=None):
+        return self._pop(name, count, -1)
+
+    def zpopmin(self, name, count=None):
+        return self._pop(name, count, 0)
+
+    def _pop(self, name, count, index):
+        zset = self._get(name, SortedSet)
+        if zset is None:
+            return []
+        popped = []
+        for _ in range(min(count or 1, len(zset))):
+            (score, member) = zset.items.pop(index)
+            del zset.scores[member]
+            popped.append((member, score))
+        self._prune(name, zset)
+        return popped
+
+    # ---
+    # Lists
+    # ---
+
+    def lpush(self, name, *values):
+        items = self._create(name, deque)
+        items.extendleft(map(encode, values))
+        return len(items)
+
+    def rpush(self, name, *values):
+        items = self._create(name, deque)
+        items.extend(map(encode, values))
+        return len(items)
+
+    def rpushx(self, name, *values):
+        if self._get(name, deque) is None:
+            return 0
+        return self.rpush(name, *values)
+
+    def llen(self, name):
+        return len(self._get(name, deque) or ())
+
+    def lrange(self, name, start, end):
+        return list(self._get(name, deque) or ())[slice_list(start, end)]
+
+    def ltrim(self, name, start, end):
+        items = self._get(name, deque)
+        if items is not None:
+            kept = list(items)[slice_list(start, end)]
+            items.clear()
+            items.extend(kept)
+            self._prune(name, items)
+        return True
+
+
+def slice_list(start, end):
+    """
+    Returns slice for an inclusive Redis list range.
+    """
+    return slice(start, None if end == -1 else end + 1)
+
+
+def format_items(items, withscores, score_cast_func):
+    if withscores:
+        return [(member, score_cast_func(score)) for (score, member) in items]
+    return [member for (_, member) in items]
+
+
+class MemoryPipeline(object):
+    """
+    Queues MemoryStorage commands until execute() is called.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self.storage, name)
+
+        def queue(*args, **kwargs):
+            self.commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    def execute(self, raise_on_error=True):
+        (commands, self.commands) = (self.commands, [])
+        results = []
+        for (method, args, kwargs) in commands:
+            try:
+                results.append(method(*args, **kwargs))
+            except redis.exceptions.ResponseError as err:
+                results.append(err)
+        if raise_on_error:
+            for result in results:
+                if isinstance(result, redis.exceptions.ResponseError):
+                    raise result
+        return results
+
+    def reset(self):
+        self.commands = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.reset()
+
+
+class MemoryPubSub(object):
+    """
+    Subscription to MemoryServer channels.
+    """
+
+    def __init__(self, server, ignore_subscribe_messages=False):
+        self.server = server
+        self.ignore_subscribe_messages = ignore_subscribe_messages
+        self.channels = set()
+        self.messages = gevent.queue.Queue()
+
+    def subscribe(self, *channels):
+        for channel in map(encode, channels):
+            self.server.channels.setdefault(channel, set()).add(self)
+            self.channels.add(channel)
+            self.messages.put({
+                'type': 'subscribe',
+                'pattern': None,
+                'channel': channel,
+                'data': len(self.channels),
+            })
+
+    def unsubscribe(self, *channels):
+        for channel in list(map(encode, channels)) or list(self.channels):
+            self.server.channels.get(channel, set()).discard(self)
+            self.channels.discard(channel)
+            self.messages.put({
+                'type': 'unsubscribe',
+                'pattern': None,
+                'channel': channel,
+                'data': len(self.channels),
+            })
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        """
+        Returns the next message or None if there is none within timeout
+        seconds.
+        """
+        try:
+            message = self.messages.get(block=bool(timeout), timeout=timeout)
+        except gevent.queue.Empty:
+            return None
+        if message['type'] != 'message' and (
+                ignore_subscribe_messages or self.ignore_subscribe_messages):
+            return None
+        return message
+
+    def close(self):
+        self.unsubscribe()
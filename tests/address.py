@@ -0,0 +1 @@
+../address.py
\ No newline at end of file
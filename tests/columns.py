@@ -0,0 +1 @@
+../columns.py
\ No newline at end of file
@@ -0,0 +1 @@
+../graph.py
\ No newline at end of file
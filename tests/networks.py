@@ -0,0 +1 @@
+../networks.py
\ No newline at end of file
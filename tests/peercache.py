@@ -0,0 +1 @@
+../peercache.py
\ No newline at end of file
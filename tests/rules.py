@@ -0,0 +1 @@
+../rules.py
\ No newline at end of file
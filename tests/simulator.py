@@ -0,0 +1 @@
+../simulator.py
\ No newline at end of file
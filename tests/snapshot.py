@@ -0,0 +1 @@
+../snapshot.py
\ No newline at end of file
@@ -0,0 +1 @@
+../storage.py
\ No newline at end of file
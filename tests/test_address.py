@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+from ipaddress import ip_address
+
+from address import Address
+from address import IPV4
+from address import IPV6
+from address import ONION
+
+
+def test_parse():
+    address = Address.parse('1.2.3.4')
+    assert address.family == IPV4
+    assert address.packed == b'\x01\x02\x03\x04'
+    assert address.value == 0x01020304
+
+    address = Address.parse('2a01:4f8:10a:37ee::2')
+    assert address.family == IPV6
+    assert len(address.packed) == 16
+
+    onion = 'kp3vwr2lzsme4n7pxxatbqm4sxmt6tg372sq2pvwcemouzken325dkad.onion'
+    address = Address.parse(onion)
+    assert address.family == ONION
+    assert len(address.packed) == 35
+    assert Address.from_packed(address.packed).text == onion
+
+    for text in ('1.2.3', '::g', 'not base32!.onion'):
+        with pytest.raises(ValueError):
+            Address.parse(text)
+
+
+def test_from_packed():
+    for text in ('1.2.3.4', '2a01:4f8:10a:37ee::2'):
+        address = Address.parse(text)
+        assert Address.from_packed(address.packed) == address
+        assert Address.from_packed(address.packed).text == text
+
+
+def test_cidr():
+    address = Address.parse('2a01:4f8:10a:37ee::2')
+    assert address.cidr(64) == '2a01:4f8:10a:37ee::/64'
+    assert address.cidr(128) == '2a01:4f8:10a:37ee::2/128'
+    assert Address.parse('10.1.2.3').cidr(16) == '10.1.0.0/16'
+    assert Address.parse('10.1.2.3').network(8) == 10 << 24
+
+
+def test_is_private():
+    for text in ('10.0.0.1', '127.0.0.1', '8.8.8.8', '100.64.0.1',
+                 'fe80::1', '2001:db8::1', '2606:4700:4700::1111'):
+        assert Address.parse(text).is_private == ip_address(text).is_private
+
+
+def test_key():
+    address = Address.parse('1.2.3.4')
+    assert address.key(12038) == '1.2.3.4-12038'
+    assert address.key(12038, 1) == '1.2.3.4-12038-1'
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import math
+import os
+import tempfile
+
+import numpy as np
+import pytest
+
+from columns import FLOAT
+from columns import INT
+from columns import STR
+from columns import ColumnWriter
+from columns import columns_path
+from columns import load_columns
+from snapshot import get_manifest
+from snapshot import load_snapshot
+from snapshot import write_snapshot
+
+FIELDS = (
+    ('address', STR),
+    ('port', INT),
+    ('latitude', FLOAT),
+    ('user_agent', STR),
+)
+
+ROWS = [
+    ['1.2.3.4', 12038, 1.5, '/hsd:5.0.0/'],
+    ['2001:db8::1', 12038, None, '/hsd:5.0.0/'],
+    ['5.6.7.8', 44806, 2.5, None],
+]
+
+
+def test_write_columns():
+    path = os.path.join(tempfile.mkdtemp(), '1.json')
+
+    write_snapshot(path, ROWS, fields=FIELDS)
+
+    assert load_snapshot(path) == ROWS
+    assert get_manifest(path)['columns'] == '1.columns'
+
+    columns = load_columns(columns_path(path))
+    assert isinstance(columns['port'], np.memmap)
+    assert columns['port'].tolist() == [12038, 12038, 44806]
+    assert columns['address'].tolist() == [row[0] for row in ROWS]
+    assert columns['user_agent'].table == ['/hsd:5.0.0/']
+    assert columns['user_agent'][2] is None
+    assert math.isnan(columns['latitude'][1])
+
+
+def test_load_columns_subset():
+    path = os.path.join(tempfile.mkdtemp(), '1.columns')
+    writer = ColumnWriter(FIELDS)
+    for row in ROWS:
+        writer.append(row)
+    writer.save(path)
+
+    columns = load_columns(path, ['user_agent'])
+    assert list(columns) == ['user_agent']
+    assert len(columns['user_agent']) == 3
+
+    with pytest.raises(KeyError):
+        load_columns(path, ['hostname'])
+
+
+def test_column_writer_mismatch():
+    writer = ColumnWriter(FIELDS)
+    with pytest.raises(ValueError):
+        writer.append(ROWS[0][:2])
+
+
+def test_write_columns_empty():
+    path = os.path.join(tempfile.mkdtemp(), '1.json')
+    write_snapshot(path, [], fields=FIELDS)
+
+    columns = load_columns(columns_path(path))
+    assert len(columns['address']) == 0
+    assert columns['port'].tolist() == []
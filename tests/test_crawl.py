@@ -1,17 +1,59 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
+import tempfile
 import unittest
 from unittest.mock import MagicMock
 from unittest import mock
 
+import fakeredis
+
 from crawl import CONF
+from crawl import DEFERRED_OFFSET
+from crawl import EXCLUDED
+from crawl import GROUP
+from crawl import INFLIGHT
+from crawl import REACHABLE
+from crawl import REACHABLE_PRIORITY
+from crawl import RULES_VERSION
+from crawl import SLAVES
+from crawl import STREAM
+from crawl import add_pending
+from crawl import adjust_workers
 from crawl import connect
+from crawl import crawl_node
+from crawl import delete_legacy_keys
+from crawl import dump
+from crawl import epoch_keys
+from crawl import finish_pending
 from crawl import get_cached_peers
+from crawl import get_failure
 from crawl import get_peers
+from crawl import get_priority
+from crawl import get_timeout
 from crawl import getaddr
+from crawl import in_backoff
 from crawl import init_conf
+from crawl import is_excluded
+from crawl import list_included_asns
+from crawl import log_throughput
+from crawl import past_cutoff
+from crawl import pop_due
+from crawl import pop_pending
+from crawl import refresh_rules
+from crawl import reschedule
+from crawl import restart
+from crawl import roll_epoch
+from crawl import set_pending
+from crawl import supervise
 from crawl import update_excluded_networks
+from crawl import update_included_asns
+from crawl import visit
+from crawl import warm_pending
+from snapshot import load_snapshot
+from snapshot import write_snapshot
+from storage import MemoryServer
+from storage import MemoryStorage
 
 
 class CrawlTestCase(unittest.TestCase):
@@ -41,6 +83,24 @@ class CrawlTestCase(unittest.TestCase):
         peers = get_cached_peers(self.conn, self.redis_conn)
         self.assertEqual(peers, set([]))
 
+    def test_get_cached_peers_latest(self):
+        self.redis_conn.get.return_value = (
+            b"[('1.2.3.4', 8333, 1, 100), ('1.2.3.4', 8333, 1, 200)]")
+        peers = get_cached_peers(self.conn, self.redis_conn)
+        self.assertEqual(peers, set([('1.2.3.4', 8333, 1, 200)]))
+
+    def test_get_priority(self):
+        CONF['max_age'] = 1000
+        now = 10000
+
+        fresh = get_priority(now, 0, now)
+        stale = get_priority(now - 900, 0, now)
+        failing = get_priority(now, 2, now)
+
+        self.assertAlmostEqual(fresh, 2.0)
+        assert fresh > stale > failing
+        assert get_priority(now - 2000, 0, now) == 1.0
+
     @mock.patch('crawl.Connection')
     def test_connect(self, mock_connection):
         def mock_redis_conn_get(*args, **kwargs):
@@ -56,14 +116,555 @@ class CrawlTestCase(unittest.TestCase):
             '/bitnodes.io:0.3/')
 
     def test_update_excluded_networks(self):
-        def mock_redis_conn_get(*args, **kwargs):
-            return b'set()'
-        self.redis_conn.get.side_effect = mock_redis_conn_get
+        redis_conn = MemoryStorage(server=MemoryServer())
+        CONF['exclude_ipv4_bogons_from_urls'] = []
+        CONF['exclude_ipv4_networks'] = set()
 
         assert CONF['current_exclude_ipv4_networks'] is None
-        assert CONF['current_exclude_ipv4_networks'] is None
+        assert CONF['current_exclude_ipv6_networks'] is None
 
-        update_excluded_networks(self.redis_conn)
+        update_excluded_networks(redis_conn)
 
         assert len(CONF['current_exclude_ipv4_networks']) == 0
         assert len(CONF['current_exclude_ipv6_networks']) == 0
+
+    def test_refresh_rules(self):
+        redis_conn = MemoryStorage(server=MemoryServer())
+        CONF['exclude_ipv4_bogons_from_urls'] = []
+        CONF['exclude_ipv4_networks'] = {(167772160, 4278190080)}  # 10/8
+        update_included_asns(redis_conn)
+        update_excluded_networks(redis_conn)
+        version = CONF['rules_version']
+        index = CONF['exclude_ipv4_index']
+
+        # Unchanged rule sets keep their version and are not rebuilt.
+        update_excluded_networks(redis_conn)
+        refresh_rules(redis_conn)
+        assert redis_conn.hget(RULES_VERSION, 'exclude-ipv4-networks') == b'1'
+        assert CONF['rules_version'] == version
+        assert CONF['exclude_ipv4_index'] is index
+
+        # Only the rule set that changed is fetched and rebuilt.
+        CONF['exclude_ipv4_networks'] = set()
+        update_excluded_networks(redis_conn)
+        assert redis_conn.hget(RULES_VERSION, 'exclude-ipv4-networks') == b'2'
+        assert redis_conn.hget(RULES_VERSION, 'exclude-ipv6-networks') == b'1'
+        assert CONF['rules_version'] == version + 1
+        assert len(CONF['exclude_ipv4_index']) == 0
+
+    def test_refresh_unversioned_rules(self):
+        redis_conn = MemoryStorage(server=MemoryServer())
+        CONF['include_asns'] = ['AS13335', 'AS-FOO']
+        CONF['include_asns_from_url'] = None
+        with self.assertLogs(level='WARNING') as logs:
+            update_included_asns(redis_conn)
+        self.assertIn("Invalid ASN in include_asns: 'AS-FOO'", logs.output[0])
+        assert CONF['current_include_asns'] == {'AS13335'}
+
+        # A rule set without a version is fetched and unpacked.
+        redis_conn.set('include-asns', b"{'AS1'}")
+        redis_conn.hdel(RULES_VERSION, 'include-asns')
+        refresh_rules(redis_conn)
+        assert CONF['current_include_asns'] == {'AS1'}
+
+    def test_list_included_asns(self):
+        txt = 'AS13335 Cloudflare\nAS-FOO\n# Comment\n\nAS15169 Google'
+        with self.assertLogs(level='WARNING') as logs:
+            asns = list_included_asns(txt)
+        assert asns == {'AS13335', 'AS15169'}
+        self.assertIn("Invalid ASN: 'AS-FOO'", logs.output[0])
+
+    def test_is_excluded_cache(self):
+        redis_conn = MemoryStorage(server=MemoryServer())
+        CONF['exclude_ipv4_bogons_from_urls'] = []
+        CONF['exclude_ipv4_networks'] = {(167772160, 4278190080)}  # 10/8
+        CONF['exclude_private'] = False
+
+        update_included_asns(redis_conn)
+        update_excluded_networks(redis_conn)
+
+        assert is_excluded('10.1.2.3') is True
+        assert is_excluded('10.1.2.3') is True
+        assert is_excluded('8.8.8.8') is False
+        assert EXCLUDED.stats()[:2] == (1, 2)
+
+        # New rules invalidate memoized decisions.
+        version = CONF['rules_version']
+        CONF['exclude_ipv4_networks'] = set()
+        update_excluded_networks(redis_conn)
+        assert CONF['rules_version'] > version
+        assert is_excluded('10.1.2.3') is False
+
+    def test_in_backoff(self):
+        CONF['backoff_base'] = 600
+        CONF['backoff_max'] = 3600
+
+        assert get_failure(None) is None
+        assert in_backoff(None, 1000) is False
+
+        record = get_failure(b'1000:1:timeout')
+        assert record == (1000, 1, 'timeout')
+        assert in_backoff(record, 1000 + 599) is True
+        assert in_backoff(record, 1000 + 600) is False
+
+        record = get_failure(b'1000:3:refused')
+        assert in_backoff(record, 1000 + 2399) is True
+        assert in_backoff(record, 1000 + 2400) is False
+
+        # Capped at backoff_max.
+        record = get_failure(b'1000:10:handshake')
+        assert in_backoff(record, 1000 + 3600) is False
+
+    def test_reschedule(self):
+        CONF['rolling_min_interval'] = 300
+        CONF['rolling_max_interval'] = 3600
+        node = ('1.2.3.4', 8333, 1)
+        redis_pipe = self.redis_conn.pipeline.return_value
+
+        # Stable node doubles its interval.
+        self.redis_conn.hget.return_value = b'600'
+        reschedule(node, True, True, self.redis_conn)
+        redis_pipe.hset.assert_called_with('crawl:interval', str(node), 1200)
+
+        # Volatile node halves its interval.
+        reschedule(node, True, False, self.redis_conn)
+        redis_pipe.hset.assert_called_with('crawl:interval', str(node), 300)
+        redis_pipe.zrem.assert_called_with('crawl:live', '1.2.3.4-8333')
+
+        # Node that stays unreachable is dropped.
+        reschedule(node, False, False, self.redis_conn)
+        redis_pipe.zrem.assert_called_with('crawl:schedule', str(node))
+
+    @mock.patch('crawl.time.time', return_value=1000)
+    def test_pop_due(self, mock_time):
+        redis_conn = fakeredis.FakeStrictRedis()
+        redis_conn.zadd('crawl:schedule', {'a': 950, 'b': 900, 'c': 2000})
+
+        assert pop_due(redis_conn) == b'b'
+
+        # A node claimed by another worker since it was selected is skipped.
+        with mock.patch.object(redis_conn, 'zrangebyscore',
+                               return_value=[b'b', b'a']):
+            assert pop_due(redis_conn) == b'a'
+
+        # A node not due yet is left on the schedule.
+        assert pop_due(redis_conn) is None
+        assert redis_conn.zrange('crawl:schedule', 0, -1) == [b'c']
+
+    @mock.patch('crawl.time.time', return_value=2000)
+    def test_restart(self, mock_time):
+        redis_conn = MemoryStorage(server=MemoryServer())
+        CONF['crawl_dir'] = tempfile.mkdtemp()
+        CONF['exclude_ipv4_bogons_from_urls'] = []
+        CONF['include_checked'] = False
+        redis_conn.sadd('up', 'node:1.2.3.4-8333-1')
+        redis_conn.zadd('crawl:reached', {'node:1.2.3.4-8333-1': 1990})
+        redis_conn.set('crawl:start', 1000)
+
+        assert restart(2000, redis_conn, start=1980) == 2000
+
+        # The new crawl starts as its nodes are queued.
+        assert redis_conn.get('crawl:start') == b'2000'
+        assert redis_conn.zscore('pending', str(('1.2.3.4', 8333, 1))) == \
+            REACHABLE_PRIORITY
+        assert redis_conn.sismember(REACHABLE, '1.2.3.4-8333')
+        assert redis_conn.get('crawl:reach95') == b'10'
+
+    def test_dump(self):
+        CONF['crawl_dir'] = tempfile.mkdtemp()
+        redis_pipe = self.redis_conn.pipeline.return_value
+        redis_pipe.execute.return_value = [
+            [b'100', None],
+            [str((70015, '/hsd:5.0.0/', 1)).encode(), None],
+        ]
+        nodes = [b'node:1.2.3.4-8333-1', b'node:5.6.7.8-8333-1']
+
+        height = dump(1, nodes, self.redis_conn)
+
+        self.assertEqual(height, 100)
+        self.assertEqual(
+            load_snapshot(os.path.join(CONF['crawl_dir'], '1.json')),
+            [['1.2.3.4', 8333, 1, 100, '/hsd:5.0.0/'],
+             ['5.6.7.8', 8333, 1, 0, '']])
+        redis_pipe.mget.assert_any_call(
+            ['height:1.2.3.4-8333-1', 'height:5.6.7.8-8333-1'])
+        redis_pipe.mget.assert_any_call(
+            ['version:1.2.3.4-8333', 'version:5.6.7.8-8333'])
+
+    def test_adjust_workers(self):
+        CONF['min_workers'] = 10
+        CONF['max_workers'] = 100
+        CONF['max_timeout_rate'] = 0.5
+        CONF['max_redis_latency'] = 0.05
+        CONF['min_reachable_rate'] = 0.05
+        stats = {
+            'connects': 100,
+            'reachable': 20,
+            'timeouts': 10,
+            'redis_calls': 100,
+            'redis_time': 0.1,
+        }
+
+        self.assertEqual(
+            adjust_workers(50, stats, 0.9, 1000), (60, 'backlog'))
+        self.assertEqual(
+            adjust_workers(100, stats, 0.9, 1000), (100, 'backlog'))
+        self.assertEqual(adjust_workers(50, stats, 0.9, 10), (50, 'steady'))
+        self.assertEqual(
+            adjust_workers(50, stats, 0.05, 1000), (37, 'fd headroom'))
+        self.assertEqual(
+            adjust_workers(50, dict(stats, timeouts=60), 0.9, 1000),
+            (37, 'timeouts'))
+        self.assertEqual(
+            adjust_workers(12, dict(stats, redis_time=10), 0.9, 1000),
+            (10, 'redis latency'))
+
+        # Held while connects mostly fail to reach a node.
+        self.assertEqual(
+            adjust_workers(50, dict(stats, reachable=2), 0.9, 1000),
+            (50, 'unreachable'))
+        self.assertEqual(
+            adjust_workers(5, dict(stats, reachable=2), 0.9, 1000),
+            (10, 'unreachable'))
+        self.assertEqual(
+            adjust_workers(50, dict(stats, connects=0), 0.9, 1000),
+            (60, 'backlog'))
+
+    @mock.patch('crawl.time.time')
+    def test_log_throughput(self, mock_time):
+        CONF['cron_delay'] = 10
+        mock_time.return_value = 1000
+        self.redis_conn.hgetall.return_value = {
+            b'host:1': b'(995, 100.0, 10.0, 1.0)',
+            b'host:2': b'(990, 50.0, 5.0, 0.0)',
+            b'host:3': b'(900, 80.0, 8.0, 0.0)',  # Stopped reporting.
+        }
+
+        with self.assertLogs(level='INFO') as logs:
+            log_throughput(self.redis_conn)
+
+        self.assertIn('150.0 connects/s, 15.0 reachable/s, 1.0 deferred/s '
+                      '(2 processes)', logs.output[0])
+        self.redis_conn.hdel.assert_called_once_with(
+            'crawl:throughput', b'host:3')
+
+    @mock.patch('crawl.gevent.sleep', side_effect=StopIteration)
+    @mock.patch('crawl.subprocess.Popen')
+    def test_supervise(self, mock_popen, mock_sleep):
+        CONF['config'] = 'crawl.conf'
+        CONF['logfile'] = 'log/crawl.log'
+        CONF['metrics_port'] = 0
+        CONF['processes'] = 2
+        self.addCleanup(SLAVES.clear)
+
+        with self.assertRaises(StopIteration):
+            supervise()
+
+        # Each slave logs to its own file.
+        logfiles = [call.args[0][call.args[0].index('--logfile') + 1]
+                    for call in mock_popen.call_args_list]
+        self.assertEqual(logfiles, ['log/crawl.1.log', 'log/crawl.2.log'])
+
+    def test_delete_legacy_keys(self):
+        redis_conn = MemoryStorage(server=MemoryServer())
+        redis_conn.set('node:1.2.3.4-8333', '')
+        redis_conn.set('crawl:cidr:2001:db8::/32', 1)
+        redis_conn.set('crawl:epoch', 1)
+
+        assert delete_legacy_keys(redis_conn) == 2
+        assert sorted(redis_conn.keys()) == [
+            b'crawl:epoch', b'crawl:legacy:deleted']
+
+        # Only once per Redis database.
+        redis_conn.set('node:1.2.3.4-8333', '')
+        assert delete_legacy_keys(redis_conn) == 0
+        assert redis_conn.exists('node:1.2.3.4-8333')
+
+    def test_roll_epoch(self):
+        self.redis_conn.get.return_value = b'7'
+        redis_pipe = MagicMock()
+
+        epoch = roll_epoch(self.redis_conn, redis_pipe)
+
+        self.assertEqual(epoch, 8)
+        redis_pipe.set.assert_called_with('crawl:epoch', 8)
+        redis_pipe.unlink.assert_called_with(
+            'crawl:epoch:7:nodes',
+            'crawl:epoch:7:cidr',
+            'crawl:epoch:7:queued',
+            'crawl:epoch:7:coverage',
+            'crawl:epoch:7:graph')
+
+    @mock.patch('crawl.HANDSHAKES')
+    @mock.patch('crawl.connect')
+    @mock.patch('crawl.open_socket')
+    def test_visit(self, mock_open_socket, mock_connect, mock_handshakes):
+        CONF['handshake_workers'] = 2
+        CONF['rolling'] = False
+        node = ('127.0.0.1', 8333, 1)
+        key = 'node:127.0.0.1-8333'
+        sock = MagicMock()
+
+        # Connected sockets are queued for a handshake worker.
+        CONF['consumer'] = 'host:1'
+        mock_open_socket.return_value = sock
+        visit(node, key, False, self.redis_conn)
+        mock_handshakes.put.assert_called_once_with(
+            (node, key, False, sock, f'host:1:{key}'))
+
+        # Unreachable nodes are not.
+        mock_handshakes.reset_mock()
+        mock_open_socket.return_value = None
+        visit(node, key, False, self.redis_conn)
+        mock_handshakes.put.assert_not_called()
+        mock_connect.assert_not_called()
+
+        # Single-stage crawl connects and handshakes in the same worker.
+        CONF['handshake_workers'] = 0
+        visit(node, key, False, self.redis_conn)
+        mock_connect.assert_called_once_with(key, self.redis_conn)
+
+    @mock.patch('crawl.is_excluded', return_value=False)
+    @mock.patch('crawl.add_pending')
+    @mock.patch('crawl.resolve_seeders')
+    def test_set_pending_seed_cache(self, mock_resolve_seeders,
+                                    mock_add_pending, mock_is_excluded):
+        CONF['seeders'] = {'a.example.com', 'b.example.com'}
+        CONF['onion'] = False
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            CONF['seed_cache'] = os.path.join(tmpdir, 'seeds.json')
+
+            mock_resolve_seeders.return_value = {
+                'a.example.com': ['1.1.1.1'],
+                'b.example.com': ['2.2.2.2'],
+            }
+            set_pending(self.redis_conn)
+
+            # Seeder b did not answer, its cached address is used instead.
+            mock_add_pending.reset_mock()
+            mock_resolve_seeders.return_value = {
+                'a.example.com': ['1.1.1.2'],
+            }
+            set_pending(self.redis_conn)
+
+        nodes = set()
+        for call in mock_add_pending.call_args_list:
+            nodes.update(eval(node)[0] for node in call.args[1])
+        self.assertEqual(nodes, {'1.1.1.2', '2.2.2.2'})
+
+    @mock.patch('crawl.is_excluded', return_value=False)
+    @mock.patch('crawl.add_pending')
+    def test_warm_pending(self, mock_add_pending, mock_is_excluded):
+        self.redis_conn.mget.return_value = [None, b'1000:3:timeout']
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            CONF['crawl_dir'] = tmpdir
+            write_snapshot(os.path.join(tmpdir, '1000.json'), [
+                ['1.1.1.1', 8333, 1, 100, '/a/'],
+                ['2.2.2.2', 8333, 1, 100, '/b/'],
+            ])
+            self.assertEqual(warm_pending(self.redis_conn), 2)
+
+            # Snapshot older than max_age is ignored.
+            CONF['max_age'] = -1
+            self.assertEqual(warm_pending(self.redis_conn), 0)
+
+        self.redis_conn.mget.assert_called_once_with(
+            ['fail:1.1.1.1-8333', 'fail:2.2.2.2-8333'])
+        mock_add_pending.assert_called_once_with(self.redis_conn, {
+            "('1.1.1.1', 8333, 1)": 1000,
+            "('2.2.2.2', 8333, 1)": 250,
+        })
+        self.redis_conn.pipeline().sadd.assert_called_once_with(
+            REACHABLE, '1.1.1.1-8333', '2.2.2.2-8333')
+
+    @mock.patch('crawl.gevent.sleep')
+    @mock.patch('crawl.check_rate', return_value=5.0)
+    def test_defer_pending(self, mock_check_rate, mock_sleep):
+        CONF['queue'] = 'zset'
+        CONF['rolling'] = False
+        CONF['backoff_retry'] = 1
+        redis_conn = fakeredis.FakeStrictRedis()
+        node = str(('1.2.3.4', 8333, 1))
+
+        # Rate-limited node is put back below all other nodes, keeping its
+        # order among deferred nodes, without holding up the worker.
+        crawl_node(node, 1, False, redis_conn, priority=1000)
+        self.assertEqual(redis_conn.zscore('pending', node),
+                         1000 - DEFERRED_OFFSET)
+        assert not redis_conn.hexists(epoch_keys(1)[0], '1.2.3.4-8333')
+        mock_sleep.assert_not_called()
+
+        # Deferred again once no other node is left, the worker waits.
+        (_, priority) = redis_conn.zpopmax('pending')[0]
+        crawl_node(node, 1, False, redis_conn, priority=priority)
+        self.assertEqual(redis_conn.zscore('pending', node),
+                         1000 - DEFERRED_OFFSET)
+        mock_sleep.assert_called_once_with(1)
+
+        # Unless it has since been gossiped with a higher priority.
+        redis_conn.zadd('pending', {node: 1500})
+        crawl_node(node, 1, False, redis_conn, priority=1000)
+        self.assertEqual(redis_conn.zscore('pending', node), 1500)
+
+    @mock.patch('crawl.visit')
+    @mock.patch('crawl.check_rate', return_value=None)
+    def test_epoch_ttl(self, mock_check_rate, mock_visit):
+        CONF['queue'] = 'zset'
+        CONF['rolling'] = False
+        CONF['backoff_retry'] = 1
+        CONF['ipv6'] = True
+        CONF['ipv6_prefix'] = 64
+        CONF['max_age'] = 600
+        redis_conn = fakeredis.FakeStrictRedis()
+
+        # Epoch keys expire after their last write, also if written to by a
+        # worker still on an epoch that has since been rolled.
+        crawl_node(str(('2001:db8::1', 8333, 1)), 1, False, redis_conn,
+                   priority=1000)
+        (claims, cidrs, *_) = epoch_keys(1)
+        assert 0 < redis_conn.ttl(claims) <= 600
+        assert 0 < redis_conn.ttl(cidrs) <= 600
+        mock_visit.assert_called_once()
+
+    def test_finish_pending(self):
+        CONF['queue'] = 'zset'
+        CONF['consumer'] = 'host:1'
+        redis_pipe = self.redis_conn.pipeline.return_value
+
+        # Other nodes still in flight.
+        redis_pipe.execute.return_value = [1, 2, 0]
+        finish_pending('host:1:1', None, self.redis_conn)
+        redis_pipe.zrem.assert_called_once_with('crawl:inflight', 'host:1:1')
+        self.redis_conn.publish.assert_not_called()
+
+        # Last node crawled.
+        redis_pipe.execute.return_value = [1, 0, 0]
+        finish_pending('host:1:1', None, self.redis_conn)
+        self.redis_conn.publish.assert_called_once_with(
+            'crawl:idle', 'host:1')
+
+    def test_pop_pending_idle(self):
+        CONF['queue'] = 'zset'
+        CONF['consumer'] = 'host:1'
+        redis_conn = fakeredis.FakeStrictRedis()
+        pubsub = redis_conn.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe('crawl:idle')
+        pubsub.get_message()
+
+        # Nothing to pop while another node is in flight.
+        redis_conn.zadd(INFLIGHT, {'host:1:1': 1})
+        self.assertEqual(pop_pending(redis_conn, 'host:1:2')[0], None)
+        self.assertEqual(redis_conn.zrange(INFLIGHT, 0, -1), [b'host:1:1'])
+        assert pubsub.get_message() is None
+
+        # Once no node is in flight, an empty pop notifies master in case the
+        # worker that finished the last node saw this worker's marker.
+        redis_conn.zrem(INFLIGHT, 'host:1:1')
+        self.assertEqual(pop_pending(redis_conn, 'host:1:2')[0], None)
+        self.assertEqual(redis_conn.zcard(INFLIGHT), 0)
+        self.assertEqual(pubsub.get_message()['data'], b'host:1')
+
+    @mock.patch('crawl.time.time')
+    def test_deadline(self, mock_time):
+        CONF['rolling'] = False
+        CONF['target_crawl_seconds'] = 1000
+        CONF['crawl_start'] = 10000
+        CONF['inflight'] = 100
+        CONF['backlog'] = 50000
+        redis_conn = fakeredis.FakeStrictRedis()
+        redis_conn.sadd(REACHABLE, '1.2.3.4-12038')
+        reachable = str(('1.2.3.4', 12038, 1)).encode()
+        gossiped = str(('5.6.7.8', 12038, 1)).encode()
+
+        # 500 seconds left for 500 nodes per worker in flight.
+        mock_time.return_value = 10500
+        self.assertEqual(get_timeout(15), 1.0)
+        CONF['backlog'] = 10000
+        self.assertEqual(get_timeout(15), 5.0)
+        self.assertEqual(get_timeout(3), 3)
+        self.assertFalse(past_cutoff(gossiped, redis_conn))
+
+        # Within the last 10%, only nodes reachable in the previous crawl,
+        # whatever priority other nodes have accumulated from gossip.
+        mock_time.return_value = 10950
+        self.assertTrue(past_cutoff(gossiped, redis_conn))
+        self.assertFalse(past_cutoff(reachable, redis_conn))
+
+        # No target.
+        CONF['target_crawl_seconds'] = 0
+        self.assertEqual(get_timeout(15), 15)
+        self.assertFalse(past_cutoff(gossiped, redis_conn))
+
+
+class StreamTestCase(unittest.TestCase):
+    """
+    Crawl stream (queue = stream) against fakeredis.
+    """
+
+    def setUp(self):
+        conf_filepath = os.path.join(
+            os.path.dirname(os.path.realpath(__file__)),
+            '..',
+            'conf',
+            'crawl.conf.default')
+        init_conf([None, conf_filepath, 'master'])
+
+        CONF['queue'] = 'stream'
+        CONF['consumer'] = 'host:1'
+        CONF['epoch'] = 1
+        self.redis_conn = fakeredis.FakeStrictRedis()
+        self.redis_conn.xgroup_create(STREAM, GROUP, id='0', mkstream=True)
+
+    def test_add_pending_dedup(self):
+        # Same ADDRESS-PORT with different services is queued once.
+        add_pending(self.redis_conn, {
+            str(('1.2.3.4', 8333, 1)): 2,
+            str(('1.2.3.4', 8333, 0)): 2,
+            str(('1.2.3.4', 8334, 1)): 2,
+        })
+        add_pending(self.redis_conn, {str(('1.2.3.4', 8333, 1)): 1000})
+        self.assertEqual(self.redis_conn.xlen(STREAM), 2)
+
+    def test_pop_finish_pending(self):
+        node = str(('1.2.3.4', 8333, 1))
+        add_pending(self.redis_conn, {node: 1000})
+
+        (popped, priority, epoch, entry) = pop_pending(
+            self.redis_conn, 'host:1:1')
+        self.assertEqual(popped, node.encode())
+        self.assertEqual(priority, 1000)
+        self.assertEqual(epoch, 0)
+        assert entry is not None
+        self.assertEqual(self.redis_conn.zcard(INFLIGHT), 1)
+        self.assertEqual(
+            self.redis_conn.xpending(STREAM, GROUP)['pending'], 1)
+
+        # Nothing left to deliver.
+        self.assertEqual(pop_pending(self.redis_conn, 'host:1:2')[0], None)
+        self.assertEqual(self.redis_conn.zcard(INFLIGHT), 1)
+
+        finish_pending('host:1:1', entry, self.redis_conn)
+        self.assertEqual(self.redis_conn.xlen(STREAM), 0)
+        self.assertEqual(
+            self.redis_conn.xpending(STREAM, GROUP)['pending'], 0)
+        self.assertEqual(self.redis_conn.zcard(INFLIGHT), 0)
+
+    def test_reclaim_pending(self):
+        node = str(('1.2.3.4', 8333, 1))
+        add_pending(self.redis_conn, {node: 1000})
+
+        # Delivered to a consumer that exited without acknowledging it.
+        self.redis_conn.xreadgroup(GROUP, 'host:2', {STREAM: '>'}, count=1)
+
+        CONF['stream_reclaim_idle'] = 3600
+        self.assertEqual(pop_pending(self.redis_conn, 'host:1:1')[0], None)
+
+        CONF['stream_reclaim_idle'] = 0
+        (popped, _, _, entry) = pop_pending(self.redis_conn, 'host:1:1')
+        self.assertEqual(popped, node.encode())
+        consumers = {consumer['name']: consumer['pending'] for consumer
+                     in self.redis_conn.xinfo_consumers(STREAM, GROUP)}
+        self.assertEqual(consumers[b'host:1'], 1)
+        self.assertEqual(consumers[b'host:2'], 0)
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import numpy as np
+
+from graph import PeerGraph
+from graph import graph_path
+
+ADJACENCY = [
+    ('a-1', ['b-1', 'c-1', 'x-1']),
+    ('b-1', ['a-1', 'c-1', 'c-1']),
+    ('c-1', []),
+]
+
+
+def test_build():
+    graph = PeerGraph.build(ADJACENCY)
+
+    assert len(graph) == 4
+    assert graph.edges == 5
+    assert [graph.name(i) for i in range(len(graph))] == [
+        'a-1', 'b-1', 'c-1', 'x-1']
+    assert graph.peers(graph.id('b-1')).tolist() == [0, 2]
+    assert graph.peers(graph.id('x-1')).tolist() == []
+    assert graph.out_degree().tolist() == [3, 2, 0, 0]
+    assert graph.in_degree().tolist() == [1, 1, 2, 1]
+
+
+def test_save_load():
+    path = graph_path(os.path.join(tempfile.mkdtemp(), '1.json'))
+    assert path.endswith('1.graph.npz')
+
+    PeerGraph.build(ADJACENCY).save(path)
+    graph = PeerGraph.load(path)
+
+    assert graph.indptr.dtype == np.int64
+    assert graph.indices.dtype == np.int32
+    assert graph.id('x-1') == 3
+    assert graph.id('y-1') is None
+    assert graph.in_degree().tolist() == [1, 1, 2, 1]
+    assert oct(os.stat(path).st_mode & 0o777) == '0o644'
+
+
+def test_coverage():
+    graph = PeerGraph.build(ADJACENCY)
+
+    assert graph.coverage(['a-1', 'c-1', 'z-1']) == {
+        'reachable': 3,
+        'advertised': 4,
+        'reachable_advertised': 2,
+    }
+
+
+def test_overlap():
+    graph = PeerGraph.build(ADJACENCY)
+
+    # a-1 and b-1 both advertised c-1 out of {a-1, b-1, c-1, x-1}.
+    assert graph.overlap(graph.id('a-1'), graph.id('b-1')) == 0.25
+    assert graph.overlap(graph.id('c-1'), graph.id('x-1')) == 0.0
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from metrics import Registry
+
+
+def test_counter():
+    registry = Registry('test')
+    counter = registry.counter('connects_total', 'Connects', ['result'])
+
+    counter.inc(result='reachable')
+    counter.inc(2, result='timeout')
+    counter.inc(result='reachable')
+
+    assert registry.render() == (
+        '# HELP test_connects_total Connects\n'
+        '# TYPE test_connects_total counter\n'
+        'test_connects_total{result="reachable"} 2\n'
+        'test_connects_total{result="timeout"} 2\n')
+
+
+def test_counter_labels():
+    counter = Registry('test').counter('connects_total', 'Connects',
+                                       ['result'])
+    with pytest.raises(ValueError):
+        counter.inc(reason='timeout')
+
+
+def test_gauge():
+    registry = Registry('test')
+    workers = registry.gauge('workers', 'Workers', ['state'])
+    registry.gauge('pending', 'Pending', function=lambda: 7)
+
+    workers.set(10, state='total')
+    workers.inc(state='busy')
+    workers.inc(state='busy')
+    workers.dec(state='busy')
+
+    text = registry.render()
+    assert 'test_workers{state="busy"} 1\n' in text
+    assert 'test_workers{state="total"} 10\n' in text
+    assert 'test_pending 7\n' in text
+
+
+def test_histogram():
+    registry = Registry('test')
+    histogram = registry.histogram('seconds', 'Latency', buckets=(0.1, 1))
+
+    histogram.observe(0.05)
+    histogram.observe(0.1)
+    histogram.observe(5)
+
+    assert registry.render().splitlines()[2:] == [
+        'test_seconds_bucket{le="0.1"} 2',
+        'test_seconds_bucket{le="1"} 2',
+        'test_seconds_bucket{le="+Inf"} 3',
+        'test_seconds_sum 5.15',
+        'test_seconds_count 3',
+    ]
+
+
+def test_escape():
+    registry = Registry('test')
+    registry.counter('total', 'Total', ['agent']).inc(agent='/a"b\\c/')
+
+    assert 'test_total{agent="/a\\"b\\\\c/"} 1' in registry.render()
+
+
+def test_app():
+    registry = Registry('test')
+    registry.counter('total', 'Total').inc()
+    responses = []
+
+    body = registry.app({'PATH_INFO': '/metrics'},
+                        lambda status, headers: responses.append(status))
+    assert responses[-1] == '200 OK'
+    assert b'test_total 1\n' in body[0]
+
+    registry.app({'PATH_INFO': '/'},
+                 lambda status, headers: responses.append(status))
+    assert responses[-1] == '404 Not Found'
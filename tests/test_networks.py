@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from ipaddress import ip_address
+from ipaddress import ip_network
+
+from networks import NetworkIndex
+
+
+def to_tuple(cidr):
+    network = ip_network(cidr)
+    return (int(network.network_address), int(network.netmask))
+
+
+def test_network_index_ipv4():
+    index = NetworkIndex([
+        to_tuple('10.0.0.0/8'),
+        to_tuple('10.1.0.0/16'),  # Nested in 10.0.0.0/8
+        to_tuple('192.168.0.0/24'),
+        to_tuple('192.168.1.0/24'),  # Adjacent to 192.168.0.0/24
+        to_tuple('203.0.113.7/32'),
+    ], bits=32)
+
+    assert len(index) == 5
+    assert len(index.starts) == 3
+
+    assert int(ip_address('10.255.255.255')) in index
+    assert int(ip_address('192.168.1.200')) in index
+    assert int(ip_address('203.0.113.7')) in index
+
+    assert int(ip_address('9.255.255.255')) not in index
+    assert int(ip_address('11.0.0.0')) not in index
+    assert int(ip_address('192.168.2.0')) not in index
+    assert int(ip_address('203.0.113.8')) not in index
+    assert int(ip_address('0.0.0.0')) not in index
+
+
+def test_network_index_ipv6():
+    index = NetworkIndex([to_tuple('2001:db8::/32')], bits=128)
+
+    assert int(ip_address('2001:db8:ffff::1')) in index
+    assert int(ip_address('2001:db9::1')) not in index
+
+
+def test_network_index_empty():
+    index = NetworkIndex(bits=32)
+
+    assert len(index) == 0
+    assert int(ip_address('1.1.1.1')) not in index
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+
+from peercache import RAW
+from peercache import ZLIB
+from peercache import pack_peers
+from peercache import unpack_peers
+
+PEERS = [
+    ('1.2.3.4', 12038, 1, 1663113591),
+    ('1.2.3.4', 44806, 3, 1663113592),
+    ('2001:db8::1', 12038, 0, 1663113593),
+    ('aaaaaaaaaaaaaaaa.onion', 12038, 1, 1663113594),
+]
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_pack_unpack(compress):
+    record = pack_peers(PEERS, compress=compress)
+
+    assert record[:1] == (ZLIB if compress else RAW)
+    assert unpack_peers(record) == PEERS
+
+
+def test_pack_unpack_empty():
+    assert unpack_peers(pack_peers([])) == []
+
+
+def test_address_dictionary():
+    # Each address is stored once however many times it is advertised.
+    once = pack_peers(PEERS[:1], compress=False)
+    twice = pack_peers(PEERS[:2], compress=False)
+    assert len(twice) - len(once) == 16
+
+
+def test_unpack_legacy():
+    assert unpack_peers(str(PEERS).encode()) == PEERS
+
+
+def test_unpack_invalid():
+    with pytest.raises(ValueError):
+        unpack_peers(b'__import__("os")')
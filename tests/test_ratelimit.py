@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from ratelimit import RateLimiter
+
+
+def test_rate_limiter_global():
+    limiter = RateLimiter(rate=2)
+
+    assert limiter.acquire({}, now=0) is None
+    assert limiter.acquire({}, now=0) is None
+    (level, wait) = limiter.acquire({}, now=0)
+    assert level == 'global'
+    assert wait == 0.5
+
+    # Refilled at 2 tokens per second.
+    assert limiter.acquire({}, now=0.5) is None
+    assert limiter.acquire({}, now=0.5) is not None
+
+
+def test_rate_limiter_levels():
+    limiter = RateLimiter(levels={'asn': 1, 'prefix': 0})
+    assert limiter.enabled
+    assert 'prefix' not in limiter.levels
+
+    assert limiter.acquire({'asn': 'AS1'}, now=0) is None
+    assert limiter.acquire({'asn': 'AS1'}, now=0) == ('asn', 1.0)
+    assert limiter.acquire({'asn': 'AS2'}, now=0) is None
+    assert limiter.acquire({'asn': None}, now=0) is None
+    assert limiter.acquire({'asn': 'AS1'}, now=1) is None
+
+
+def test_rate_limiter_all_or_nothing():
+    limiter = RateLimiter(rate=10, levels={'prefix': 1})
+
+    assert limiter.acquire({'prefix': '10.0.0.0/16'}, now=0) is None
+    assert limiter.acquire({'prefix': '10.0.0.0/16'}, now=0)[0] == 'prefix'
+
+    # Denied request did not take a token from the global budget.
+    assert limiter.bucket.tokens == 9
+
+
+def test_rate_limiter_disabled():
+    limiter = RateLimiter()
+    assert not limiter.enabled
+    assert limiter.acquire({'asn': 'AS1'}) is None
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+from ipaddress import ip_network
+
+import pytest
+
+from rules import RAW
+from rules import ZLIB
+from rules import is_asn
+from rules import pack_asns
+from rules import pack_networks
+from rules import unpack_asns
+from rules import unpack_networks
+
+
+def networks(*cidrs):
+    return set((int(network.network_address), int(network.netmask))
+               for network in map(ip_network, cidrs))
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_pack_unpack_networks(compress):
+    v4 = networks('0.0.0.0/8', '10.0.0.0/8', '192.0.2.1/32')
+    v6 = networks('::/0', '2001:db8::/32', '::1/128')
+
+    record = pack_networks(v4, 32, compress=compress)
+    assert record[:1] == (ZLIB if compress else RAW)
+    assert unpack_networks(record, 32) == v4
+    assert unpack_networks(pack_networks(v6, 128, compress), 128) == v6
+
+
+def test_pack_order():
+    # Equal rule sets have equal records whatever their iteration order.
+    v4 = networks('10.0.0.0/8', '192.168.0.0/16', '172.16.0.0/12')
+    assert pack_networks(v4, 32) == pack_networks(set(sorted(v4)), 32)
+    assert len(pack_networks(v4, 32, compress=False)) == 1 + 3 * 5
+
+
+def test_pack_unpack_asns():
+    asns = {'AS13335', 'AS4294967295'}
+    assert unpack_asns(pack_asns(asns)) == asns
+
+
+def test_invalid_asns():
+    assert is_asn('AS13335')
+    assert not is_asn('AS-FOO')
+    assert not is_asn('AS4294967296')
+    assert not is_asn('AS\u00b2')
+    assert not is_asn('13335')
+    assert unpack_asns(pack_asns({'AS13335', 'AS-FOO'})) == {'AS13335'}
+    assert unpack_asns(pack_asns(set())) == set()
+
+
+def test_unpack_legacy():
+    assert unpack_asns(b"{'AS13335'}") == {'AS13335'}
+    assert unpack_asns(b'set()') == set()
+    assert unpack_networks(b'{(167772160, 4278190080)}', 32) == networks(
+        '10.0.0.0/8')
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from protocol import Connection
+from simulator import DOWN
+from simulator import Network
+from simulator import TARPIT
+from simulator import TOPOLOGIES
+from simulator import UP
+from simulator import build_topology
+
+
+@pytest.mark.parametrize('topology', TOPOLOGIES)
+def test_build_topology(topology):
+    peers = build_topology(50, 4, topology, random.Random(1))
+
+    assert len(peers) == 50
+    for (index, advertised) in enumerate(peers):
+        assert len(advertised) >= 4
+        assert index not in advertised
+        assert len(set(advertised)) == len(advertised)
+
+
+def test_addresses():
+    net = Network(5, port=24038, addresses=2, base_address='127.1.0.1')
+
+    assert net.nodes == [
+        ('127.1.0.1', 24038),
+        ('127.1.0.2', 24038),
+        ('127.1.0.1', 24039),
+        ('127.1.0.2', 24039),
+        ('127.1.0.1', 24040),
+    ]
+    assert net.seeds(10) == ['127.1.0.1', '127.1.0.2']
+
+
+def test_reachable():
+    net = Network(6, degree=1, topology='ring')
+    net.states = [UP, UP, DOWN, UP, TARPIT, UP]
+
+    (discovered, reachable) = net.reachable(['127.1.0.1'])
+    assert discovered == {0, 1, 2}
+    assert reachable == {0, 1}
+
+
+def test_handshake_getaddr():
+    net = Network(3, port=24038, addresses=1, base_address='127.0.0.1',
+                  degree=2, seed=1)
+    with net:
+        conn = Connection(net.nodes[0], socket_timeout=5)
+        conn.open()
+        version = conn.handshake()
+        addr_msgs = conn.getaddr()
+        conn.close()
+
+    assert version['user_agent'] == '/hnsnodes-simulator:0.1/'
+    peers = [(peer['ipv4'], peer['port'])
+             for addr_msg in addr_msgs for peer in addr_msg['addr_list']]
+    assert sorted(peers) == net.nodes[1:]
+    assert net.handshaked == {0}
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import json
+import os
+import tempfile
+
+import pytest
+
+from snapshot import SnapshotWriter
+from snapshot import get_manifest
+from snapshot import latest_snapshot
+from snapshot import load_snapshot
+from snapshot import write_snapshot
+
+ROWS = [
+    ['1.2.3.4', 12038, 1, 100, '/hsd:5.0.0/'],
+    ['2001:db8::1', 12038, 1, 101, '/hsd:5.0.0/'],
+]
+
+
+def test_write_snapshot():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, '1.json')
+
+    assert write_snapshot(path, iter(ROWS)) == 2
+
+    assert open(path).read() == json.dumps(ROWS)
+    assert get_manifest(path)['rows'] == 2
+    assert load_snapshot(path) == ROWS
+    assert sorted(os.listdir(directory)) == ['1.json', '1.json.manifest']
+
+
+def test_write_snapshot_empty():
+    path = os.path.join(tempfile.mkdtemp(), '1.json')
+    write_snapshot(path, [])
+    assert load_snapshot(path) == []
+
+
+def test_snapshot_writer_abort():
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, '1.json')
+
+    with pytest.raises(RuntimeError):
+        with SnapshotWriter(path) as writer:
+            writer.write(ROWS[0])
+            raise RuntimeError
+
+    assert os.listdir(directory) == []
+
+
+def test_load_snapshot_corrupt():
+    path = os.path.join(tempfile.mkdtemp(), '1.json')
+    write_snapshot(path, ROWS)
+    open(path, 'w').write(json.dumps(ROWS[:1]))
+
+    with pytest.raises(ValueError):
+        load_snapshot(path)
+
+
+def test_latest_snapshot():
+    directory = tempfile.mkdtemp()
+    assert latest_snapshot(directory) is None
+
+    # Legacy snapshot without manifest.
+    open(os.path.join(directory, '1.json'), 'w').write(json.dumps(ROWS))
+    assert latest_snapshot(directory) == os.path.join(directory, '1.json')
+
+    write_snapshot(os.path.join(directory, '2.json'), ROWS)
+    open(os.path.join(directory, '3.json'), 'w').write('[')
+    assert latest_snapshot(directory) == os.path.join(directory, '2.json')
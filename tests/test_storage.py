@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import pytest
+import redis
+
+import storage
+from storage import MemoryServer
+from storage import MemoryStorage
+from storage import new_storage
+
+
+@pytest.fixture
+def conn():
+    return MemoryStorage(db=1, server=MemoryServer())
+
+
+def test_new_storage():
+    assert isinstance(new_storage('memory'), MemoryStorage)
+    assert isinstance(new_storage('redis'), redis.StrictRedis)
+    with pytest.raises(ValueError):
+        new_storage('memcached')
+
+
+def test_strings(conn):
+    assert conn.set('a', 1) is True
+    assert conn.set('a', 2, nx=True) is None
+    assert conn.get('a') == b'1'
+    assert conn.incr('a') == 2
+    assert conn.decr('b') == -1
+    assert conn.mget(['a', 'b', 'c']) == [b'2', b'-1', None]
+    assert conn.delete('a', 'c') == 1
+    assert conn.exists('a', 'b') == 1
+
+
+def test_databases(conn):
+    other = MemoryStorage(db=2, server=conn.server)
+    shared = MemoryStorage(db=1, server=conn.server)
+    conn.set('a', 'x')
+    assert other.get('a') is None
+    assert shared.get('a') == b'x'
+
+
+def test_expire(conn, monkeypatch):
+    now = 1000.0
+    monkeypatch.setattr(storage, 'clock', lambda: now)
+    conn.setex('a', 10, 'x')
+    conn.sadd('b', 'x')
+    conn.expire('b', 20)
+    assert conn.ttl('a') == 10
+    assert conn.ttl('c') == -2
+
+    now += 15
+    assert conn.get('a') is None
+    assert conn.smembers('b') == {b'x'}
+    conn.set('b', 'y')  # Overwriting a key clears its expiry.
+    assert conn.ttl('b') == -1
+
+    now += 10
+    assert conn.keys() == [b'b']
+
+
+def test_wrong_type(conn):
+    conn.sadd('a', 'x')
+    with pytest.raises(redis.exceptions.ResponseError):
+        conn.zadd('a', {'x': 1})
+
+
+def test_hashes(conn):
+    assert conn.hset('h', 'a', 1) == 1
+    assert conn.hset('h', mapping={'a': 2, 'b': 3}) == 1
+    assert conn.hsetnx('h', 'a', 4) == 0
+    assert conn.hincrby('h', 'c', 5) == 5
+    assert conn.hmget('h', ['a', 'd']) == [b'2', None]
+    assert dict(conn.hscan_iter('h')) == conn.hgetall('h') == {
+        b'a': b'2', b'b': b'3', b'c': b'5'}
+    assert conn.hdel('h', 'a', 'b', 'c') == 3
+    assert not conn.exists('h')
+
+
+def test_sets(conn):
+    assert conn.sadd('s', 'a', 'b', 'a') == 2
+    assert conn.sismember('s', 'a')
+    assert conn.srem('s', 'a', 'c') == 1
+    assert conn.spop('s') == b'b'
+    assert conn.spop('s') is None
+    assert conn.scard('s') == 0
+
+
+def test_sorted_sets(conn):
+    assert conn.zadd('z', {'a': 1, 'b': 2, 'c': 2, 'd': 3}) == 4
+    assert conn.zadd('z', {'a': 0, 'b': 5}, gt=True) == 0
+    assert conn.zadd('z', {'e': 4}, nx=True) == 1
+    assert conn.zincrby('z', 1, 'c') == 3.0
+    assert conn.zrange('z', 0, -1, withscores=True) == [
+        (b'a', 1.0), (b'c', 3.0), (b'd', 3.0), (b'e', 4.0), (b'b', 5.0)]
+    assert conn.zrangebyscore('z', '(1', 4) == [b'c', b'd', b'e']
+    assert conn.zcount('z', '-inf', '+inf') == 5
+    assert conn.zpopmax('z') == [(b'b', 5.0)]
+    assert conn.zpopmin('z', 2) == [(b'a', 1.0), (b'c', 3.0)]
+    assert conn.zremrangebyscore('z', '-inf', 3) == 1
+    assert conn.zscore('z', 'e') == 4.0
+    assert conn.zrem('z', 'e') == 1
+    assert conn.zpopmax('z') == []
+
+
+def test_lists(conn):
+    assert conn.rpushx('l', 'a') == 0
+    assert conn.lpush('l', 'a', 'b', 'c') == 3
+    assert conn.lrange('l', 0, -1) == [b'c', b'b', b'a']
+    assert conn.ltrim('l', 0, 1)
+    assert conn.lrange('l', 0, -1) == [b'c', b'b']
+
+
+def test_pipeline(conn):
+    pipe = conn.pipeline()
+    pipe.zadd('z', {'a': 1})
+    pipe.zpopmax('z')
+    pipe.zcard('z')
+    assert pipe.execute() == [1, [(b'a', 1.0)], 0]
+    assert pipe.execute() == []
+
+    conn.set('s', 'x')
+    pipe.sadd('s', 'a')
+    pipe.set('t', 'y')
+    with pytest.raises(redis.exceptions.ResponseError):
+        pipe.execute()
+    assert conn.get('t') == b'y'
+
+
+def test_pubsub(conn):
+    pubsub = conn.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe('channel')
+    assert pubsub.get_message() is None  # Subscribe confirmation.
+    assert conn.publish('channel', 1) == 1
+    assert conn.publish('other', 1) == 0
+
+    msg = pubsub.get_message(timeout=1)
+    assert msg['channel'] == b'channel'
+    assert msg['data'] == b'1'
+    assert pubsub.get_message(timeout=0.01) is None
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import logging
+import os
+import tempfile
+
+import gevent
+
+from utils import configure_logger
+
+
+def test_configure_logger_per_greenlet():
+    # Components run as greenlets of one process each log to their own file.
+    tmpdir = tempfile.mkdtemp()
+    root = logging.getLogger()
+    (level, handlers) = (root.level, root.handlers[:])
+
+    def component(name):
+        configure_logger(logging.INFO, os.path.join(tmpdir, f'{name}.log'))
+        gevent.sleep(0)
+        gevent.spawn(logging.info, f'{name} child').join()
+        logging.info(name)
+
+    try:
+        gevent.joinall([gevent.spawn(component, 'crawl'),
+                        gevent.spawn(component, 'ping')])
+    finally:
+        for handler in root.handlers[len(handlers):]:
+            handler.close()
+        root.handlers = handlers
+        root.setLevel(level)
+
+    for name in ('crawl', 'ping'):
+        with open(os.path.join(tmpdir, f'{name}.log')) as f:
+            lines = [line.split(') ', 1)[1] for line in f.read().splitlines()]
+        assert lines == [f'{name} child', name]
@@ -31,37 +31,70 @@ Common helper methods.
 from gevent import monkey
 monkey.patch_all()
 
+import gevent
 import logging
 from logging.handlers import RotatingFileHandler
 import os
 import sys
-import redis
 import requests
 import time
+from collections import OrderedDict
 from geoip2.database import Reader
-from ipaddress import ip_network
 from maxminddb.errors import InvalidDatabaseError
 
+from address import Address
+from storage import new_storage
+
 
 def configure_logger(level, filename, log_to_console=False):
-    # 1 MB x 3 files
-    logging.basicConfig(level=level,
-                        format='%(asctime)s %(levelname)s (%(funcName)s) %(message)s',
-                        datefmt='%Y-%m-%d %H:%M:%S',
-                        handlers=[
-                            RotatingFileHandler(
-                                filename=filename,
-                                maxBytes=1 * 1000 * 1000,
-                                backupCount=3 - 1
-                            )
-                        ]
-                        )
+    """
+    Adds handlers logging to the specified file, rotated at 1 MB x 3 files,
+    and optionally to stdout into the root logger. Called from a greenlet,
+    e.g. for each component run in one process by run.py, the handlers
+    only log records from the greenlet and the greenlets it spawns, see
+    SpawnTreeFilter.
+    """
+    formatter = logging.Formatter(
+        '%(asctime)s %(levelname)s (%(funcName)s) %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S')
+    handlers = [RotatingFileHandler(filename=filename,
+                                    maxBytes=1 * 1000 * 1000,
+                                    backupCount=3 - 1)]
 
     # also log to stdout
     if log_to_console:
-        logging.getLogger().addHandler(
-            logging.StreamHandler(sys.stdout)
-        )
+        handlers.append(logging.StreamHandler(sys.stdout))
+
+    root = logging.getLogger()
+    root.setLevel(min(root.level, level) if root.handlers else level)
+    tree = get_spawn_tree()
+    for handler in handlers:
+        handler.setLevel(level)
+        handler.setFormatter(formatter)
+        if tree is not None:
+            handler.addFilter(SpawnTreeFilter(tree))
+        root.addHandler(handler)
+
+
+def get_spawn_tree():
+    """
+    Returns dict shared by the current greenlet and all greenlets in its
+    spawn tree or None outside of a greenlet spawned by gevent.
+    """
+    return getattr(gevent.getcurrent(), 'spawn_tree_locals', None)
+
+
+class SpawnTreeFilter(logging.Filter):
+    """
+    Passes records logged from greenlets in the specified spawn tree.
+    """
+
+    def __init__(self, tree):
+        super().__init__()
+        self.tree = tree
+
+    def filter(self, record):
+        return get_spawn_tree() is self.tree
 
 
 class GeoIp(object):
@@ -94,12 +127,62 @@ class GeoIp(object):
         return self.geoip_asn.asn(address)
 
 
+class LruCache(object):
+    """
+    Bounded least-recently-used cache with hit/miss counters.
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            value = self.items[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def clear(self):
+        self.items.clear()
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        """
+        Returns (hits, misses, hit rate in percent) since last reset.
+        """
+        total = self.hits + self.misses
+        rate = 100.0 * self.hits / total if total else 0.0
+        return (self.hits, self.misses, rate)
+
+    def __len__(self):
+        return len(self.items)
+
+
 def new_redis_conn(db=0):
     """
-    Returns new instance of Redis connection with the right db selected.
+    Returns new instance of Redis connection with the right db selected or,
+    with STORAGE=memory, of in-process storage, see storage.py.
     """
-    password = os.environ.get('REDIS_PASSWORD', None)
-    return redis.StrictRedis(db=db, host='localhost', port=6379, password=password)
+    return new_storage(os.environ.get('STORAGE', 'redis'),
+                       db=db,
+                       host=os.environ.get('REDIS_HOST', 'localhost'),
+                       port=int(os.environ.get('REDIS_PORT', 6379)),
+                       password=os.environ.get('REDIS_PASSWORD', None))
 
 
 def get_keys(redis_conn, pattern, count=500):
@@ -120,8 +203,7 @@ def ip_to_network(address, prefix):
     """
     Returns CIDR notation to represent the address and its prefix.
     """
-    network = ip_network(f'{address}/{prefix}', strict=False)
-    return f'{network.network_address}/{prefix}'
+    return Address.parse(address).cidr(prefix)
 
 
 def http_get(url, timeout=15):